@@ -0,0 +1,63 @@
+"""
+The functions in gmcode.functions at production sizes.
+"""
+
+from gmcode import Vector, functions
+from .common import lines_per_second, machine
+
+
+def _spiral(m):
+    # out to 250 mm, 0.1 mm a turn
+    m.g0(1, 0, -1)
+    functions.spiral(m, Vector(0, 0, -1), 250, doc=0.1)
+
+
+def _archimedean_spiral(m):
+    m.g0(1, 0, -1)
+    functions.archimedean_spiral(m, Vector(0, 0, -1), 250, doc=0.1)
+
+
+def _helical_entry(m):
+    # a plate of holes, each entered 10 mm deep
+    for k in range(1_000):
+        m.g0(z=1)
+        m.g0(10 * (k % 40) + 3, 10 * (k // 40))
+        functions.helical_entry(m, Vector(10 * (k % 40), 10 * (k // 40)), -10)
+
+
+def _rect_in(m):
+    # facing a 600 x 400 sheet
+    m.g0(300, 200, -1)
+    functions.rect_in(m, Vector(0, 0), woc=0.5)
+
+
+WORKLOADS = {
+    "spiral": _spiral,
+    "archimedean_spiral": _archimedean_spiral,
+    "helical_entry": _helical_entry,
+    "rect_in": _rect_in,
+}
+
+
+class Functions:
+    params = list(WORKLOADS)
+    param_names = ["function"]
+    timeout = 300
+
+    def setup(self, function):
+        self.func = WORKLOADS[function]
+
+    def time_function(self, function):
+        m = machine()
+        self.func(m)
+        m.flush()
+
+    def peakmem_function(self, function):
+        m = machine()
+        self.func(m)
+        m.flush()
+
+    def track_lines_per_second(self, function):
+        return lines_per_second(self.func)
+
+    track_lines_per_second.unit = "lines/s"  # type: ignore[attr-defined]
@@ -0,0 +1,62 @@
+"""
+Vector and VectorArray arithmetic.
+"""
+
+import numpy as np
+from gmcode import Vector
+from gmcode.geom import VectorArray
+
+
+class VectorArithmetic:
+    def setup(self):
+        self.a = Vector(1.5, -2.25, 3.0)
+        self.b = Vector(-0.5, 4.0, 0.125)
+
+    def time_add(self):
+        self.a + self.b
+
+    def time_sub(self):
+        self.a - self.b
+
+    def time_mul(self):
+        self.a * 2.5
+
+    def time_abs(self):
+        abs(self.a)
+
+    def time_unit_vector(self):
+        self.a.unit_vector()
+
+    def time_cross(self):
+        self.a.cross(self.b)
+
+    def time_isclose(self):
+        self.a.isclose(self.b)
+
+
+class VectorArrayArithmetic:
+    params = [1_000, 1_000_000]
+    param_names = ["points"]
+
+    def setup(self, points):
+        rng = np.random.default_rng(0)
+        self.a = VectorArray(rng.random((points, 3)))
+        self.b = VectorArray(rng.random((points, 3)))
+
+    def time_add(self, points):
+        self.a + self.b
+
+    def time_mul(self, points):
+        self.a * 2.5
+
+    def time_norm(self, points):
+        self.a.norm()
+
+    def time_unit_vector(self, points):
+        self.a.unit_vector()
+
+    def time_cross(self, points):
+        self.a.cross(self.b)
+
+    def peakmem_unit_vector(self, points):
+        self.a.unit_vector()
@@ -0,0 +1,98 @@
+"""
+How fast Machine writes moves, one call at a time and in batches.
+"""
+
+import numpy as np
+from gmcode.toolpath import Toolpath
+from .common import lines_per_second, machine
+
+# moves in a program of production size
+MOVES = 100_000
+
+
+def _points(n: int) -> np.ndarray:
+    """
+    A zigzag of n points, so every move changes X and Y.
+    """
+    k = np.arange(n)
+    return np.stack(
+        [k * 0.01, np.where(k % 2 == 0, 0.0, 5.0), np.full(n, -1.0)], axis=1
+    )
+
+
+def _g1(m, points):
+    for x, y, z in points.tolist():
+        m.g1(x, y, z)
+
+
+def _arc(m, points):
+    for x, y, z in points.tolist():
+        m.arc(x + 1, y, z, i=x + 0.5, j=y, cw=True)
+
+
+def _g1_many(m, points):
+    m.g1_many(points)
+
+
+def _cut_elements(m, elements):
+    m.g0(*elements[0].start)
+    m.cut(elements)
+
+
+def _cut_toolpath(m, path):
+    m.g0(*path.start[0])
+    m.cut(path)
+
+
+def _inputs(workload: str):
+    points = _points(MOVES)
+    if workload in ("g1", "g1_many"):
+        return points
+    if workload == "arc":
+        # where each half circle starts, one apart along X
+        return np.stack([np.arange(MOVES), np.zeros(MOVES), np.full(MOVES, -1)], axis=1)
+
+    # the zigzag with every other move a half circle
+    path = Toolpath(
+        kind=np.arange(MOVES - 1) % 2,
+        start=points[:-1],
+        end=points[1:],
+        centre=(points[:-1] + points[1:]) / 2,
+        cw=np.ones(MOVES - 1, dtype=bool),
+        feed=np.full(MOVES - 1, np.nan),
+    )
+    return path if workload == "cut_toolpath" else path.to_elements()
+
+
+WORKLOADS = {
+    "g1": _g1,
+    "arc": _arc,
+    "g1_many": _g1_many,
+    "cut_elements": _cut_elements,
+    "cut_toolpath": _cut_toolpath,
+}
+
+
+class Emission:
+    params = list(WORKLOADS)
+    param_names = ["workload"]
+    timeout = 300
+
+    def setup(self, workload):
+        self.func = WORKLOADS[workload]
+        self.inputs = _inputs(workload)
+
+    def time_emit(self, workload):
+        m = machine()
+        self.func(m, self.inputs)
+        m.flush()
+
+    def peakmem_emit(self, workload):
+        m = machine()
+        self.func(m, self.inputs)
+        m.flush()
+
+    def track_lines_per_second(self, workload):
+        return lines_per_second(lambda m: self.func(m, self.inputs))
+
+    track_lines_per_second.unit = "lines/s"  # type: ignore[attr-defined]
@@ -0,0 +1,68 @@
+"""
+Writing g-code through each kind of output, with and without buffering.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import time
+from gmcode import Machine
+from gmcode.output import DEFAULT_BUFFER_SIZE
+from .bench_machine import _points
+
+# lines written
+LINES = 100_000
+
+TARGETS = ["file", "gzip", "stream"]
+
+
+class Output:
+    params = [TARGETS, [0, DEFAULT_BUFFER_SIZE]]
+    param_names = ["target", "buffer_size"]
+    timeout = 300
+
+    def setup(self, target, buffer_size):
+        self.directory = tempfile.mkdtemp()
+        self.points = _points(LINES).tolist()
+        text = io.StringIO()
+        self._write(text, buffer_size)
+        self.size = len(text.getvalue().encode())
+
+    def teardown(self, target, buffer_size):
+        shutil.rmtree(self.directory)
+
+    def _outfile(self, target):
+
+        if target == "stream":
+            return io.StringIO()
+        name = "out.ngc.gz" if target == "gzip" else "out.ngc"
+        return os.path.join(self.directory, name)
+
+    def _write(self, outfile, buffer_size):
+
+        with Machine(outfile, buffer_size=buffer_size) as m:
+            m.feedrate(1000)
+            for x, y, z in self.points:
+                m.g1(x, y, z)
+
+    def time_write(self, target, buffer_size):
+        self._write(self._outfile(target), buffer_size)
+
+    def peakmem_write(self, target, buffer_size):
+        self._write(self._outfile(target), buffer_size)
+
+    def track_lines_per_second(self, target, buffer_size):
+        start = time.perf_counter()
+        self._write(self._outfile(target), buffer_size)
+        return LINES / (time.perf_counter() - start)
+
+    track_lines_per_second.unit = "lines/s"  # type: ignore[attr-defined]
+
+    def track_megabytes_per_second(self, target, buffer_size):
+        # of g-code text, before any compression
+        start = time.perf_counter()
+        self._write(self._outfile(target), buffer_size)
+        return self.size / (time.perf_counter() - start) / 1e6
+
+    track_megabytes_per_second.unit = "MB/s"  # type: ignore[attr-defined]
@@ -0,0 +1,43 @@
+"""
+Cutting stock with a program that clears a sheet, at different resolutions
+and numbers of threads.
+"""
+
+from gmcode.parser import Move, LINEAR
+from gmcode.simulate import Stock, Tool, simulate
+
+# width of the square sheet
+SIZE = 200
+TOOL = Tool(6)
+
+
+def _zigzag():
+    """
+    Passes across the sheet a tool radius apart, 1 deep.
+    """
+    moves = []
+    at = (0.0, 0.0, -1.0)
+    for k in range(int(SIZE / TOOL.radius) + 1):
+        x = SIZE if k % 2 == 0 else 0
+        ends = [(x, at[1], -1.0), (x, at[1] + TOOL.radius, -1.0)]
+        for end in ends:
+            moves.append(Move(LINEAR, at, end, feed=1000))
+            at = end
+    return moves
+
+
+class Simulate:
+    params = [[0.5, 0.1], [1, 4]]
+    param_names = ["resolution", "workers"]
+    timeout = 300
+
+    def setup(self, resolution, workers):
+        self.moves = _zigzag()
+
+    def time_simulate(self, resolution, workers):
+        stock = Stock((0, 0, -5), (SIZE, SIZE, 0), resolution)
+        simulate(self.moves, stock, TOOL, workers=workers)
+
+    def peakmem_simulate(self, resolution, workers):
+        stock = Stock((0, 0, -5), (SIZE, SIZE, 0), resolution)
+        simulate(self.moves, stock, TOOL, workers=workers)
@@ -0,0 +1,58 @@
+"""
+Helpers shared by the benchmarks.
+
+The benchmarks are written for asv (airspeed velocity): time_ methods are
+timed, peakmem_ methods have the peak memory of the process measured and
+track_ methods return a number, here how many lines of g-code are written a
+second.
+"""
+
+import math
+import time
+from typing import Callable
+from gmcode import Machine
+from gmcode.output import Sink
+
+
+class CountingSink(Sink):
+    """
+    Throws g-code away, counting the lines and characters written.
+    """
+
+    def __init__(self):
+        self.lines = 0
+        self.characters = 0
+
+    def write(self, text: str):
+
+        self.lines += text.count("\n")
+        self.characters += len(text)
+
+
+def machine(outfile=None, **kwargs) -> Machine:
+    """
+    A Machine ready to cut, writing to outfile or a CountingSink.
+    """
+    m = Machine(CountingSink() if outfile is None else outfile, **kwargs)
+    m.std_init()
+    m.feedrate(1000)
+    return m
+
+
+def lines_per_second(work: Callable[[Machine], object], repeat: int = 3) -> float:
+    """
+    Lines of g-code work(m) writes a second, the best of repeat runs.
+    """
+    best = math.inf
+    lines = 0
+    for _ in range(repeat):
+        sink = CountingSink()
+        m = machine(sink)
+        m.flush()
+        written = sink.lines
+        start = time.perf_counter()
+        work(m)
+        m.flush()
+        best = min(best, time.perf_counter() - start)
+        lines = sink.lines - written
+    return lines / best
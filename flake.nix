@@ -22,7 +22,7 @@
               version = "0.1";
               src = ./.;
 
-              propagatedBuildInputs = with py-self; [ attrs pygcode ];
+              propagatedBuildInputs = with py-self; [ attrs numpy pygcode ];
 
               checkInputs = with py-self; [ pytestCheckHook mypy ];
               pytestFlagsArray = [ "-vv" ];
@@ -86,6 +86,7 @@
           mypy
           black
           attrs
+          numpy
           pygcode
         ] )) ]; };
       }
@@ -0,0 +1,436 @@
+"""
+Pictures of toolpaths, for looking over programs without a GUI.
+
+A Backplot is the path a program takes seen from above, as one polyline with
+arcs and helices split into short lines. It can be drawn into a NumPy image,
+written as a PNG (with zlib, no imaging library is needed) or as an SVG.
+Cutting moves are coloured by depth, where they cross the deepest one wins,
+and rapids are drawn over them in red.
+
+Only as much detail as the picture can show is drawn: a point in the same
+pixel as the one before it is left out unless it is deeper, so programs with
+millions of moves take seconds.
+"""
+
+import attr
+import math
+import os
+import struct
+import zlib
+import numpy as np
+from typing import Iterable, List, Optional, Tuple, Union
+from gmcode import parser
+from gmcode.parser import Move, PLANE_AXES
+
+BACKGROUND = (255, 255, 255)
+RAPID_COLOUR = (220, 30, 30)
+# colours from the highest cutting moves to the deepest
+DEPTH_COLOURS = np.array(
+    [[250, 220, 40], [90, 200, 100], [30, 145, 140], [60, 80, 140], [70, 0, 85]],
+    dtype=np.float64,
+)
+# number of depth colours used in SVGs
+SVG_LEVELS = 16
+
+# arcs are split into lines no more than this many radians long
+_MAX_STEP = math.pi / 8
+# pixels sampled at once when drawing
+_BATCH = 1 << 22
+
+
+def _arcs(
+    start: np.ndarray,
+    end: np.ndarray,
+    centre: np.ndarray,
+    cw: np.ndarray,
+    turns: np.ndarray,
+    axes: Tuple[int, int, int],
+    tolerance: float,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Splits arcs in one plane into lines no more than tolerance from them.
+
+    Returns:
+      The number of lines for each arc, which arc each point belongs to and
+      the points, without the start of each arc.
+    """
+    a0, a1, normal = axes
+    r0 = start[:, [a0, a1]] - centre[:, [a0, a1]]
+    r1 = end[:, [a0, a1]] - centre[:, [a0, a1]]
+    rad0 = np.hypot(r0[:, 0], r0[:, 1])
+    rad1 = np.hypot(r1[:, 0], r1[:, 1])
+    angle0 = np.arctan2(r0[:, 1], r0[:, 0])
+    angle1 = np.arctan2(r1[:, 1], r1[:, 0])
+    sweep = np.where(cw, angle0 - angle1, angle1 - angle0) % (2 * math.pi)
+    sweep = np.where(sweep < 1e-9, 2 * math.pi, sweep)
+    sweep += 2 * math.pi * (np.maximum(turns, 1) - 1)
+
+    radius = np.maximum(np.maximum(rad0, rad1), 1e-12)
+    step = 2 * np.arccos(np.clip(1 - tolerance / radius, -1, 1))
+    step = np.clip(step, 1e-6, _MAX_STEP)
+    counts = np.maximum(np.ceil(sweep / step), 1).astype(np.intp)
+
+    arc = np.repeat(np.arange(len(counts)), counts)
+    first = np.cumsum(counts) - counts
+    t = (np.arange(counts.sum()) - first[arc] + 1) / counts[arc]
+    angle = angle0[arc] + np.where(cw[arc], -1, 1) * sweep[arc] * t
+    rad = rad0[arc] + (rad1 - rad0)[arc] * t
+    points = np.empty((len(arc), 3))
+    points[:, a0] = centre[arc, a0] + rad * np.cos(angle)
+    points[:, a1] = centre[arc, a1] + rad * np.sin(angle)
+    points[:, normal] = start[arc, normal] + (end - start)[arc, normal] * t
+    # the ends are exact
+    last = first + counts - 1
+    points[last] = end
+    return counts, arc, points
+
+
+def _samples(
+    p0: np.ndarray, p1: np.ndarray, z0: np.ndarray, z1: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Pixels along lines between pixel coordinates, with depths.
+
+    Returns:
+      Column, row and depth of each pixel, and the line it is on.
+    """
+    counts = np.ceil(np.abs(p1 - p0).max(axis=1)).astype(np.intp) + 1
+    line = np.repeat(np.arange(len(counts)), counts)
+    first = np.cumsum(counts) - counts
+    t = (np.arange(counts.sum()) - first[line]) / np.maximum(counts[line] - 1, 1)
+    xy = p0[line] + (p1 - p0)[line] * t[:, None]
+    z = z0[line] + (z1 - z0)[line] * t
+    cols, rows = np.floor(xy).astype(np.intp).T
+    return cols, rows, z, line
+
+
+def _path(moves: List[Move], tolerance: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The points motion moves go through, with arcs split into lines no more
+    than tolerance from them.
+
+    Returns:
+      The points, starting with the start of the first move, and the number
+      of lines each move was split into.
+    """
+    kind = np.array([m.kind for m in moves])
+    start = np.array([m.start for m in moves], dtype=np.float64)
+    end = np.array([m.end for m in moves], dtype=np.float64)
+    is_arc = (kind == parser.ARC_CW) | (kind == parser.ARC_CCW)
+    centre = end.copy()
+    if is_arc.any():
+        centre[is_arc] = [m.centre for m, a in zip(moves, is_arc) if a]
+
+    counts = np.ones(len(moves), dtype=np.intp)
+    pieces = []
+    planes = np.array([m.plane for m in moves])
+    for plane, axes in PLANE_AXES.items():
+        sel = np.flatnonzero(is_arc & (planes == plane))
+        if sel.size:
+            turns = np.array([moves[k].turns for k in sel])
+            arc_counts, arc, points = _arcs(
+                start[sel],
+                end[sel],
+                centre[sel],
+                kind[sel] == parser.ARC_CW,
+                turns,
+                axes,
+                tolerance,
+            )
+            counts[sel] = arc_counts
+            pieces.append((sel[arc], arc_counts, points))
+
+    # every move ends at the end of its points, after the first point
+    last = np.cumsum(counts)
+    points = np.empty((last[-1] + 1, 3))
+    points[0] = start[0]
+    points[last[~is_arc]] = end[~is_arc]
+    for move, arc_counts, arc_points in pieces:
+        first = np.cumsum(arc_counts) - arc_counts
+        local = np.arange(len(move)) - np.repeat(first, arc_counts)
+        points[last[move] - counts[move] + 1 + local] = arc_points
+    return points, counts
+
+
+def encode_png(image: np.ndarray) -> bytes:
+    """
+    An H x W x 3 uint8 RGB image as a PNG file.
+    """
+    height, width, _ = image.shape
+    # each row starts with filter type 0, none
+    rows = np.zeros((height, 1 + 3 * width), dtype=np.uint8)
+    rows[:, 1:] = image.reshape(height, 3 * width)
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        crc = zlib.crc32(tag + data) & 0xFFFFFFFF
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", crc)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"".join(
+        [
+            b"\x89PNG\r\n\x1a\n",
+            chunk(b"IHDR", header),
+            chunk(b"IDAT", zlib.compress(rows.tobytes(), 6)),
+            chunk(b"IEND", b""),
+        ]
+    )
+
+
+@attr.s(auto_detect=True, frozen=True, slots=True, eq=False)  # type: ignore[call-overload]
+class View:
+    """
+    Where a Backplot goes in a picture.
+
+    Attributes:
+      width, height: Size of the picture in pixels.
+      scale: Pixels per unit.
+      origin: The XY point at the top left corner.
+    """
+
+    width: int = attr.ib()
+    height: int = attr.ib()
+    scale: float = attr.ib()
+    origin: Tuple[float, float] = attr.ib()
+
+    def pixels(self, points: np.ndarray) -> np.ndarray:
+        """
+        Pixel coordinates of XY points, N x 2. Y goes down the picture.
+        """
+        x = (points[:, 0] - self.origin[0]) * self.scale
+        y = (self.origin[1] - points[:, 1]) * self.scale
+        return np.stack([x, y], axis=1)
+
+
+class Backplot:
+    """
+    The path of a program, seen from above.
+
+    Args:
+      points: N x 3 points the tool goes through, in order.
+      rapid: For each of the N - 1 lines between them, whether it is a rapid.
+    """
+
+    def __init__(self, points: np.ndarray, rapid: np.ndarray):
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        self.rapid = np.asarray(rapid, dtype=bool).reshape(-1)
+        if len(self.rapid) != max(len(self.points) - 1, 0):
+            raise ValueError("There must be one rapid flag per line")
+
+    @classmethod
+    def from_moves(
+        cls,
+        source: Union[str, os.PathLike, Iterable[Move]],
+        tolerance: Optional[float] = None,
+    ) -> "Backplot":
+        """
+        The path of a program.
+
+        Args:
+          source: Path to a g-code file, or Move records from gmcode.parser
+            or gmcode.recorder.Recorder.moves.
+          tolerance: Largest distance arcs are drawn from where they should
+            be, defaults to a 4000th of the size of the program.
+        """
+        if isinstance(source, (str, os.PathLike)):
+            source = parser.parse(source, use_mmap=True)
+        moves = [m for m in source if m.kind in parser.MOTION_KINDS]
+        if not moves:
+            return cls(np.zeros((0, 3)), np.zeros(0, dtype=bool))
+
+        if tolerance is None:
+            ends = np.array([m.end for m in moves] + [moves[0].start])
+            tolerance = max(float(np.ptp(ends[:, :2], axis=0).max()), 1e-9) / 4000
+        points, counts = _path(moves, tolerance)
+        kind = np.array([m.kind for m in moves])
+        return cls(points, np.repeat(kind == parser.RAPID, counts))
+
+    def view(self, width: int = 1024, height: Optional[int] = None, margin: int = 8):
+        """
+        Fits the path in a picture width pixels wide, and height high or as
+        high as needed.
+        """
+        if len(self.points):
+            lo = self.points[:, :2].min(axis=0)
+            hi = self.points[:, :2].max(axis=0)
+        else:
+            lo = hi = np.zeros(2)
+        size = np.maximum(hi - lo, 1e-9)
+        inside = width - 2 * margin
+        scale = inside / size[0]
+        if height is None:
+            height = int(math.ceil(size[1] * scale)) + 2 * margin
+        scale = min(scale, (height - 2 * margin) / size[1])
+        # centred in the picture
+        space = (np.array([width, height]) - size * scale) / 2 / scale
+        origin = (float(lo[0] - space[0]), float(hi[1] + space[1]))
+        return View(width, max(height, 1), scale, origin)
+
+    def _decimated(self, pixels: np.ndarray) -> np.ndarray:
+        """
+        Which points to draw: those in a different pixel to the point before
+        them, at the bottom of a move down, at the ends of the path or between
+        a rapid and a cut.
+        """
+        keep = np.ones(len(pixels), dtype=bool)
+        if len(pixels) > 2:
+            cell = np.floor(pixels).astype(np.intp)
+            z = self.points[:, 2]
+            keep[1:-1] = (
+                np.any(cell[1:-1] != cell[:-2], axis=1)
+                | ((z[1:-1] < z[:-2]) & (z[1:-1] <= z[2:]))
+                | (self.rapid[1:] != self.rapid[:-1])
+            )
+        return keep
+
+    def _lines(self, view: View):
+        """
+        The lines to draw, in pixel coordinates.
+
+        Returns:
+          Points, their depths and whether each line between them is a rapid.
+        """
+        pixels = view.pixels(self.points)
+        keep = np.flatnonzero(self._decimated(pixels))
+        return pixels[keep], self.points[keep, 2], self.rapid[keep[1:] - 1]
+
+    def _depths(self) -> Tuple[float, float]:
+        """
+        Heights of the highest and deepest points that are cut to.
+        """
+        if not self.rapid.size or self.rapid.all():
+            return 0.0, 0.0
+        cut = np.flatnonzero(~self.rapid)
+        z = np.concatenate([self.points[cut, 2], self.points[cut + 1, 2]])
+        return float(z.max()), float(z.min())
+
+    def _fractions(self, z: np.ndarray) -> np.ndarray:
+        """
+        How deep z is, from 0 at the highest cut to 1 at the deepest.
+        """
+        top, bottom = self._depths()
+        return np.clip((top - z) / max(top - bottom, 1e-12), 0, 1)
+
+    @staticmethod
+    def _colours(fractions: np.ndarray) -> np.ndarray:
+        """
+        Depth colours, N x 3 uint8.
+        """
+        stops = np.linspace(0, 1, len(DEPTH_COLOURS))
+        rgb = [np.interp(fractions, stops, DEPTH_COLOURS[:, k]) for k in range(3)]
+        return np.round(np.stack(rgb, axis=1)).astype(np.uint8)
+
+    def image(
+        self, width: int = 1024, height: Optional[int] = None, margin: int = 8
+    ) -> np.ndarray:
+        """
+        Draws the path, see view for the arguments.
+
+        Returns:
+          An H x W x 3 uint8 RGB image.
+        """
+        view = self.view(width, height, margin)
+        w, h = view.width, view.height
+        points, z, rapid = self._lines(view)
+        depth = np.full(w * h, np.inf)
+        rapids = np.zeros(w * h, dtype=bool)
+
+        # lines are drawn in batches of about the same number of pixels
+        lengths = np.abs(np.diff(points, axis=0)).max(axis=1, initial=0) + 2
+        total = np.cumsum(lengths)
+        first = 0
+        while first < len(lengths):
+            limit = total[first] - lengths[first] + _BATCH
+            last = max(int(np.searchsorted(total, limit, side="right")), first + 1)
+            cols, rows, zs, line = _samples(
+                points[first:last],
+                points[first + 1 : last + 1],
+                z[first:last],
+                z[first + 1 : last + 1],
+            )
+            inside = (cols >= 0) & (cols < w) & (rows >= 0) & (rows < h)
+            flat = rows * w + cols
+            is_rapid = rapid[first:last][line]
+            rapids[flat[inside & is_rapid]] = True
+            cut = inside & ~is_rapid
+            np.minimum.at(depth, flat[cut], zs[cut])
+            first = last
+
+        image = np.empty((w * h, 3), dtype=np.uint8)
+        image[:] = BACKGROUND
+        cut = np.isfinite(depth)
+        image[cut] = self._colours(self._fractions(depth[cut]))
+        image[rapids] = RAPID_COLOUR
+        return image.reshape(h, w, 3)
+
+    def png(self, width: int = 1024, height: Optional[int] = None) -> bytes:
+        """
+        The picture drawn by image as a PNG file.
+        """
+        return encode_png(self.image(width, height))
+
+    def svg(self, width: int = 1024, height: Optional[int] = None) -> str:
+        """
+        The path as an SVG file, with cuts in SVG_LEVELS depth colours and
+        rapids dashed.
+        """
+        view = self.view(width, height)
+        points, z, rapid = self._lines(view)
+        out = [
+            '<svg xmlns="http://www.w3.org/2000/svg" '
+            f'width="{view.width}" height="{view.height}" '
+            f'viewBox="0 0 {view.width} {view.height}">',
+            f'<rect width="100%" height="100%" fill="rgb{BACKGROUND}"/>',
+        ]
+        if len(rapid):
+            # lines of the same colour are joined into polylines, the deeper
+            # end of a line sets its colour
+            levels = np.arange(SVG_LEVELS) / (SVG_LEVELS - 1)
+            colours = self._colours(levels).tolist()
+            depth = self._fractions(np.minimum(z[:-1], z[1:]))
+            level = np.round(depth * (SVG_LEVELS - 1)).astype(np.intp)
+            level[rapid] = -1
+            breaks = np.flatnonzero(np.diff(level)) + 1
+            starts = np.concatenate([[0], breaks])
+            stops = np.concatenate([breaks, [len(level)]])
+            for first, last in zip(starts.tolist(), stops.tolist()):
+                coords = " ".join(
+                    f"{x:.1f},{y:.1f}" for x, y in points[first : last + 1].tolist()
+                )
+                if level[first] < 0:
+                    style = f'stroke="rgb{RAPID_COLOUR}" stroke-dasharray="4 2"'
+                else:
+                    style = f'stroke="rgb{tuple(colours[level[first]])}"'
+                out.append(f'<polyline points="{coords}" fill="none" {style}/>')
+        out.append("</svg>")
+        return "\n".join(out) + "\n"
+
+    def write(self, path: Union[str, os.PathLike], width: int = 1024, height=None):
+        """
+        Writes a .png or .svg file.
+        """
+        suffix = os.path.splitext(path)[1].lower()
+        if suffix == ".png":
+            with open(path, "wb") as f0:
+                f0.write(self.png(width, height))
+        elif suffix == ".svg":
+            with open(path, "w") as f0:
+                f0.write(self.svg(width, height))
+        else:
+            raise ValueError(f"Can not write a backplot to a {suffix} file")
+
+
+def backplot(
+    source: Union[str, os.PathLike, Iterable[Move]],
+    path: Union[str, os.PathLike],
+    width: int = 1024,
+    height: Optional[int] = None,
+):
+    """
+    Draws a program to a .png or .svg file.
+
+    Args:
+      source: Path to a g-code file, or Move records.
+      path: File to write.
+      width, height: Size of the picture, see Backplot.view.
+    """
+    Backplot.from_moves(source).write(path, width, height)
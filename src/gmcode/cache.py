@@ -0,0 +1,282 @@
+"""
+Caching of operations that are repeated at different places.
+
+An operation such as functions.spiral produces the same moves, shifted in
+XY, wherever it is started from. OperationCache records an operation once,
+relative to its start point, and replays the recording translated every
+other time it is run with the same parameters and machine state.
+
+LRUCache is the store it and gmcode.job.FragmentCache keep their entries in,
+which can be saved to a file and read back in a later run.
+"""
+
+import attr
+import hashlib
+import inspect
+import os
+import pathlib
+import pickle
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Sequence, Set, Union
+from gmcode.machine import Machine
+from gmcode.geom import Vector
+from gmcode.recorder import Recorder
+
+
+def _relative(val, origin: Vector, places: int) -> Hashable:
+    """
+    Turns an argument into something hashable, with Vectors relative to
+    origin in XY.
+    """
+    if isinstance(val, Vector):
+        return (
+            "Vector",
+            round(val.x - origin.x, places),
+            round(val.y - origin.y, places),
+            round(val.z, places),
+        )
+    if isinstance(val, float):
+        return round(val, places)
+    if isinstance(val, (list, tuple)):
+        return (type(val).__name__,) + tuple(_relative(v, origin, places) for v in val)
+    if isinstance(val, dict):
+        return tuple(sorted((k, _relative(v, origin, places)) for k, v in val.items()))
+    if isinstance(val, frozenset):
+        return tuple(sorted(val))
+    hash(val)  # anything else has to be hashable
+    return val
+
+
+def _translate(val, offset: Vector):
+    """
+    Moves the Vectors in an argument by offset.
+    """
+    if isinstance(val, Vector):
+        return val + offset
+    if isinstance(val, (list, tuple)):
+        return type(val)(_translate(v, offset) for v in val)
+    if isinstance(val, dict):
+        return {k: _translate(v, offset) for k, v in val.items()}
+    return val
+
+
+def _digest_code(h, code, seen: Set[int]):
+
+    h.update(code.co_code)
+    h.update(" ".join(code.co_names).encode())
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            _digest_code(h, const, seen)
+        else:
+            _digest(h, const, seen)
+
+
+def _digest(h, val, seen: Optional[Set[int]] = None):
+    """
+    Adds val to the hash h, by value.
+    """
+    seen = set() if seen is None else seen
+    if isinstance(val, np.ndarray):
+        val = np.ascontiguousarray(val)
+        h.update(f"ndarray {val.dtype} {val.shape} ".encode())
+        h.update(val.tobytes())
+    elif isinstance(val, (list, tuple)):
+        h.update(f"{type(val).__name__} {len(val)} ".encode())
+        for v in val:
+            _digest(h, v, seen)
+    elif isinstance(val, dict):
+        h.update(f"dict {len(val)} ".encode())
+        for k in sorted(val, key=repr):
+            _digest(h, k, seen)
+            _digest(h, val[k], seen)
+    elif attr.has(type(val)):
+        h.update(f"{type(val).__module__}.{type(val).__qualname__} ".encode())
+        _digest(h, attr.astuple(val, recurse=False), seen)
+    elif inspect.isfunction(val) or inspect.ismethod(val):
+        # the code, defaults and closure values are included, so editing a
+        # function or making it with other values changes the digest, but
+        # not the code of functions it calls
+        func = inspect.unwrap(val)
+        h.update(f"function {func.__module__}.{func.__qualname__} ".encode())
+        if id(func) in seen:
+            return
+        seen.add(id(func))
+        if inspect.ismethod(func):
+            _digest(h, func.__self__, seen)
+            func = func.__func__
+        code = getattr(func, "__code__", None)
+        if code is not None:
+            _digest_code(h, code, seen)
+        _digest(h, getattr(func, "__defaults__", None), seen)
+        _digest(h, getattr(func, "__kwdefaults__", None), seen)
+        for cell in getattr(func, "__closure__", None) or ():
+            try:
+                contents = cell.cell_contents
+            except ValueError:  # not assigned yet
+                contents = None
+            _digest(h, contents, seen)
+    else:
+        h.update(f"{type(val).__qualname__} {val!r} ".encode())
+
+
+def digest(val) -> str:
+    """
+    A hash of val by value, including the code of functions in it.
+    """
+    h = hashlib.sha256()
+    _digest(h, val)
+    return h.hexdigest()
+
+
+class LRUCache:
+    """
+    Entries by key, in least recently used order.
+
+    Args:
+      maxsize: Number of entries to keep, the least recently used one is
+        dropped first. None keeps them all.
+      path: File to keep entries in between runs. It is read now, if it
+        exists, and written by save.
+    """
+
+    def __init__(
+        self,
+        maxsize: Optional[int] = None,
+        path: Union[None, str, os.PathLike] = None,
+    ):
+        self.maxsize = maxsize
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        if path is not None and pathlib.Path(path).exists():
+            with open(path, "rb") as f0:
+                self._entries.update(pickle.load(f0))
+            self._trim()
+
+    def __len__(self) -> int:
+
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+
+        return key in self._entries
+
+    def _trim(self):
+
+        while self.maxsize is not None and len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get(self, key: Hashable) -> Any:
+        """
+        The entry for key, None if there isn't one.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: Hashable, entry: Any):
+
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self._trim()
+
+    def retain(self, keys: Sequence[Hashable]):
+        """
+        Drops every entry except those for keys.
+        """
+        keep = set(keys)
+        for key in [k for k in self._entries if k not in keep]:
+            del self._entries[key]
+
+    def clear(self):
+
+        self._entries.clear()
+
+    def save(self, path: Union[None, str, os.PathLike] = None):
+        """
+        Writes the entries to path, or the path given to __init__.
+        """
+        path = path if path is not None else self.path
+        if path is None:
+            raise ValueError("No path to save the cache to")
+
+        tmp = pathlib.Path(f"{path}.tmp")
+        with open(tmp, "wb") as f0:
+            pickle.dump(self._entries, f0, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+
+class OperationCache(LRUCache):
+    """
+    Memoises operations in a position independent form.
+
+    The key is the operation, including its code, defaults and closure values
+    (see digest), its arguments with any Vectors made relative to the
+    machine's XY position, and the machine state that changes what is
+    written: Z position, accuracy, feedrate, plane, path mode, tool and
+    which axes have been written.
+
+    Args:
+      maxsize: Number of recordings to keep, the least recently used one is
+        dropped first.
+      path: File to keep recordings in between runs. It is read now, if it
+        exists, and written by save.
+    """
+
+    def __init__(self, maxsize: int = 128, path: Union[None, str, os.PathLike] = None):
+        super().__init__(maxsize, path)
+
+    def key(self, m: Machine, func: Callable, args: tuple, kwargs: dict) -> Hashable:
+        """
+        The cache key for running func(m, *args, **kwargs).
+        """
+        places = m.places + 3
+        origin = m.position
+        state = attr.astuple(m.snapshot(), recurse=False)
+        return (
+            digest(func),
+            _relative(args, origin, places),
+            _relative(kwargs, origin, places),
+            m.accuracy,
+            _relative(state, origin, places),
+        )
+
+    def run(self, m: Machine, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Does the same as func(m, *args, **kwargs), using a recording if
+        there is one.
+
+        Returns:
+          What func returned the first time. Vectors in it are not moved.
+        """
+        key = self.key(m, func, args, kwargs)
+        offset = Vector(m.position.x, m.position.y)
+        entry = self.get(key)
+        if entry is None:
+            start = attr.evolve(m.snapshot(), position=Vector(z=m.position.z))
+            recorder = Recorder(m.accuracy, start)
+            origin_args = _translate(args, -offset)
+            origin_kwargs = _translate(kwargs, -offset)
+            entry = (recorder, func(recorder, *origin_args, **origin_kwargs))
+            self.put(key, entry)
+
+        recorder, result = entry
+        recorder.replay(m, offset)
+        return result
+
+    def wrap(self, func: Callable[..., Any]) -> Callable[..., Any]:
+        """
+        A cached version of func, which takes the same arguments.
+        """
+
+        def cached(m: Machine, *args, **kwargs):
+            return self.run(m, func, *args, **kwargs)
+
+        cached.__doc__ = func.__doc__
+        return cached
@@ -0,0 +1,291 @@
+"""
+Machining time estimates.
+
+Moves are planned like a motion controller does: every move accelerates and
+decelerates at the machine's limits, corners are taken as fast as the G64 P
+blending tolerance allows (using the junction deviation model), and exact
+path/stop modes come to a stop at every corner. The planning is done on
+arrays of moves, so long programs are estimated quickly.
+"""
+
+import attr
+import math
+import os
+import numpy as np
+from typing import Iterable, List, Optional, Tuple, Union
+from gmcode import parser
+from gmcode.parser import Move, PLANE_AXES
+
+
+@attr.s(auto_detect=True, frozen=True, slots=True)  # type: ignore[call-overload]
+class MachineLimits:
+    """
+    Capabilities of the machine.
+
+    Attributes:
+      rapid: Maximum velocity of the X, Y and Z axes in units per minute. G0
+        moves run at this speed, and G1/G2/G3 are capped by it.
+      acceleration: Maximum acceleration of the X, Y and Z axes in units per
+        second squared.
+      pause: Seconds allowed for each M0/M1 pause.
+      toolchange: Seconds allowed for each tool change.
+    """
+
+    rapid: Tuple[float, float, float] = attr.ib((5000.0, 5000.0, 2000.0))
+    acceleration: Tuple[float, float, float] = attr.ib((500.0, 500.0, 200.0))
+    pause: float = attr.ib(0.0)
+    toolchange: float = attr.ib(0.0)
+
+
+@attr.s(auto_detect=True, slots=True)  # type: ignore[call-overload]
+class Estimate:
+    """
+    Time in seconds and distance in units spent on each type of move.
+    """
+
+    cutting: float = attr.ib(0.0)
+    rapid: float = attr.ib(0.0)
+    dwell: float = attr.ib(0.0)
+    other: float = attr.ib(0.0)
+    cutting_distance: float = attr.ib(0.0)
+    rapid_distance: float = attr.ib(0.0)
+    moves: int = attr.ib(0)
+    pauses: int = attr.ib(0)
+    toolchanges: int = attr.ib(0)
+
+    @property
+    def total(self) -> float:
+
+        return self.cutting + self.rapid + self.dwell + self.other
+
+
+def _geometry(moves: List[Move]):
+    """
+    Lengths and unit tangents at the start and end of each move.
+
+    Returns:
+      length, radius (inf for straight moves), tangent in, tangent out
+    """
+    n = len(moves)
+    start = np.array([m.start for m in moves], dtype=np.float64)
+    end = np.array([m.end for m in moves], dtype=np.float64)
+    length = np.empty(n)
+    radius = np.full(n, np.inf)
+    t_in = np.empty((n, 3))
+    t_out = np.empty((n, 3))
+
+    is_arc = np.array([m.kind in (parser.ARC_CW, parser.ARC_CCW) for m in moves])
+    straight = ~is_arc
+    delta = end[straight] - start[straight]
+    length[straight] = np.sqrt(np.einsum("ij,ij->i", delta, delta))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        unit = delta / length[straight, None]
+    unit = np.nan_to_num(unit)  # zero length moves have no direction
+    t_in[straight] = unit
+    t_out[straight] = unit
+
+    for plane, (a0, a1, normal) in PLANE_AXES.items():
+        sel = np.flatnonzero(is_arc & np.array([m.plane == plane for m in moves]))
+        if sel.size == 0:
+            continue
+        centre = np.array([moves[k].centre for k in sel], dtype=np.float64)
+        cw = np.array([moves[k].kind == parser.ARC_CW for k in sel])
+        turns = np.array([moves[k].turns for k in sel], dtype=np.float64)
+        r0 = start[sel][:, [a0, a1]] - centre[:, [a0, a1]]
+        r1 = end[sel][:, [a0, a1]] - centre[:, [a0, a1]]
+        rad = (np.hypot(r0[:, 0], r0[:, 1]) + np.hypot(r1[:, 0], r1[:, 1])) / 2
+        angle0 = np.arctan2(r0[:, 1], r0[:, 0])
+        angle1 = np.arctan2(r1[:, 1], r1[:, 0])
+        sweep = np.where(cw, angle0 - angle1, angle1 - angle0) % (2 * math.pi)
+        sweep = np.where(sweep < 1e-9, 2 * math.pi, sweep)
+        sweep += 2 * math.pi * (np.maximum(turns, 1) - 1)
+        planar = rad * sweep
+        height = end[sel, normal] - start[sel, normal]
+        arc_length = np.hypot(planar, height)
+        length[sel] = arc_length
+        radius[sel] = rad
+
+        sign = np.where(cw, -1.0, 1.0)
+        for r, tangent in ((r0, t_in), (r1, t_out)):
+            with np.errstate(invalid="ignore", divide="ignore"):
+                scale = planar / (rad * arc_length)
+                tangent[sel, a0] = -sign * r[:, 1] * scale
+                tangent[sel, a1] = sign * r[:, 0] * scale
+                tangent[sel, normal] = height / arc_length
+
+    return length, radius, t_in, t_out
+
+
+def _profile_times(length, v_in2, v_out2, v_max, accel):
+    """
+    Time for trapezoidal velocity profiles.
+
+    Args:
+      length: Distance of each move.
+      v_in2, v_out2: Squared entry and exit velocities.
+      v_max: Cruise velocity.
+      accel: Acceleration.
+    """
+    v_in = np.sqrt(v_in2)
+    v_out = np.sqrt(v_out2)
+    peak = np.sqrt(np.maximum((2 * accel * length + v_in2 + v_out2) / 2, 0))
+    triangle = (2 * peak - v_in - v_out) / accel
+    cruise_length = length - (2 * v_max**2 - v_in2 - v_out2) / (2 * accel)
+    trapezoid = (2 * v_max - v_in - v_out) / accel + cruise_length / v_max
+    return np.where(peak <= v_max, triangle, trapezoid)
+
+
+class _Planner:
+    """
+    Plans a sequence of continuous motion moves in chunks.
+    """
+
+    def __init__(self, limits: MachineLimits, result: Estimate, chunk_size: int):
+        self.limits = limits
+        self.result = result
+        self.chunk_size = chunk_size
+        self.rapid = np.array(limits.rapid, dtype=np.float64) / 60
+        self.accel = np.array(limits.acceleration, dtype=np.float64)
+        self.moves: List[Move] = []
+        self.entry2 = 0.0  # squared velocity at the start of self.moves
+        self.next_plan = chunk_size
+
+    def add(self, move: Move):
+
+        self.moves.append(move)
+        if len(self.moves) > self.next_plan:
+            self._plan(stop=False)
+            self.next_plan = len(self.moves) + self.chunk_size
+
+    def stop(self):
+        """
+        Plans everything in the buffer, coming to a stop at the end.
+        """
+        if self.moves:
+            self._plan(stop=True)
+        self.entry2 = 0.0
+        self.next_plan = self.chunk_size
+
+    def _plan(self, stop: bool):
+
+        moves = self.moves
+        n = len(moves)
+        length, radius, t_in, t_out = _geometry(moves)
+        kind = np.array([m.kind for m in moves])
+        plane = np.array([m.plane for m in moves])
+        feed = np.array(
+            [m.feed if m.feed is not None else np.nan for m in moves], dtype=np.float64
+        )
+        blend = np.array([m.blend for m in moves], dtype=np.float64)
+        if np.any(np.isnan(feed) & (kind != parser.RAPID)):
+            raise ValueError("Feedrate is not set for a feed move")
+
+        # velocity and acceleration limits along the path from the axis limits
+        direction = np.abs(t_in) + np.abs(t_out)
+        with np.errstate(divide="ignore"):
+            axis_v = np.min(2 * self.rapid / direction, axis=1)
+            accel = np.min(2 * self.accel / direction, axis=1)
+        is_arc = np.isfinite(radius)
+        for name, (a0, a1, _) in PLANE_AXES.items():
+            sel = is_arc & (plane == name)
+            if sel.any():
+                planar_accel = min(self.accel[a0], self.accel[a1])
+                accel[sel] = np.minimum(accel[sel], planar_accel)
+                axis_v[sel] = np.minimum(
+                    axis_v[sel], min(self.rapid[a0], self.rapid[a1])
+                )
+        moving = length > 0
+        accel = np.where(moving, accel, self.accel.min())
+        axis_v = np.where(moving, axis_v, self.rapid.min())
+        v_max = np.where(kind == parser.RAPID, axis_v, np.minimum(axis_v, feed / 60))
+        # centripetal acceleration limit
+        v_max = np.minimum(v_max, np.sqrt(accel * radius))
+
+        # junction limits between moves, node k is the start of move k
+        cos = np.einsum("ij,ij->i", t_out[:-1], t_in[1:])
+        sin_half = np.sqrt(np.clip((1 + cos) / 2, 0, 1))
+        junction_accel = np.minimum(accel[:-1], accel[1:])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            deviation2 = junction_accel * blend[1:] * sin_half / (1 - sin_half)
+        deviation2 = np.where(sin_half >= 1 - 1e-12, np.inf, deviation2)
+        deviation2 = np.where(sin_half <= 1e-12, 0, deviation2)
+        deviation2 = np.where(blend[1:] == 0, 0, deviation2)
+        v_limit = np.minimum(v_max[:-1], v_max[1:]) ** 2
+        junction = np.minimum(v_limit, deviation2)
+        same_mode = (kind[:-1] == parser.RAPID) == (kind[1:] == parser.RAPID)
+        junction = np.where(same_mode, junction, 0.0)
+
+        # Moves that haven't been read yet can only slow down the end of the
+        # buffer, so plan as if it ends at full speed, then only keep the
+        # moves that are too far from the end for braking to reach them.
+        last = 0.0 if stop else v_max[-1] ** 2
+        limit = np.concatenate([[self.entry2], junction, [last]])
+        gain = np.concatenate([[0.0], np.cumsum(2 * accel * length)])
+        forward = gain + np.minimum.accumulate(limit - gain)
+        backward = np.minimum.accumulate((forward + gain)[::-1])[::-1] - gain
+        v2 = np.minimum(forward, backward)
+
+        if not stop:
+            braking = np.max(v_max) ** 2 / (2 * np.min(accel))
+            distance = np.concatenate([[0.0], np.cumsum(length)])
+            settled = (distance[-1] - distance >= braking) | (limit == 0)
+            settled[-1] = False
+            n = int(np.max(np.flatnonzero(settled), initial=0))
+            if n == 0:
+                return
+            v2 = v2[: n + 1]
+            length, kind, v_max, accel = (a[:n] for a in (length, kind, v_max, accel))
+
+        self.moves = moves[n:]
+        self.entry2 = float(v2[-1]) if not stop else 0.0
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            times = _profile_times(length, v2[:-1], v2[1:], v_max, accel)
+        times = np.where(length > 0, times, 0.0)
+
+        rapid = kind == parser.RAPID
+        self.result.rapid += float(times[rapid].sum())
+        self.result.cutting += float(times[~rapid].sum())
+        self.result.rapid_distance += float(length[rapid].sum())
+        self.result.cutting_distance += float(length[~rapid].sum())
+        self.result.moves += n
+
+
+def estimate(
+    source: Union[str, os.PathLike, Iterable[Move]],
+    limits: Optional[MachineLimits] = None,
+    chunk_size: int = 1 << 16,
+) -> Estimate:
+    """
+    Estimates how long a program takes to run.
+
+    Args:
+      source: Path to a g-code file, or Move records from gmcode.parser.
+      limits: Machine capabilities, defaults to MachineLimits().
+      chunk_size: Number of moves planned at once.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        source = parser.parse(source)
+    if limits is None:
+        limits = MachineLimits()
+
+    result = Estimate()
+    planner = _Planner(limits, result, chunk_size)
+    for move in source:
+        kind = move.kind
+        if kind in parser.MOTION_KINDS:
+            planner.add(move)
+            continue
+
+        planner.stop()
+        if kind == parser.DWELL:
+            result.dwell += move.value
+        elif kind == parser.PAUSE:
+            result.pauses += 1
+            result.other += limits.pause
+        elif kind == parser.TOOLCHANGE:
+            result.toolchanges += 1
+            result.other += limits.toolchange
+
+    planner.stop()
+    return result
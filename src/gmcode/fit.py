@@ -0,0 +1,188 @@
+"""
+Arc fitting.
+
+Curves that were tessellated into short lines are turned back into G2/G3
+arcs, which makes programs much smaller and lets the controller run curves at
+full feed instead of stuttering from one micro-segment to the next.
+
+Runs of lines are scanned greedily: each arc or line is grown as long as every
+original point stays within the tolerance of it, searching for the longest
+fit with a doubling then bisecting search.
+"""
+
+import math
+import numpy as np
+from typing import List, Optional, Tuple, Union, overload
+from gmcode.geom import VectorArray, PathElement, TOLERANCE
+from gmcode.toolpath import Toolpath, LINE, ARC
+from gmcode.simplify import _segment_distances, _map_line_runs, _map_element_runs
+
+Fit = Tuple[int, Optional[np.ndarray], bool]  # kind, centre, cw
+
+
+def _circle(a: np.ndarray, b: np.ndarray, c: np.ndarray):
+    """
+    Centre of the circle through three XY points, None if they are in a line.
+    """
+    b = b - a
+    c = c - a
+    d = 2 * (b[0] * c[1] - b[1] * c[0])
+    if abs(d) < 1e-12 * (b.dot(b) + c.dot(c)):
+        return None, False
+
+    b2 = b.dot(b)
+    c2 = c.dot(c)
+    centre = a + np.array([c[1] * b2 - b[1] * c2, b[0] * c2 - c[0] * b2]) / d
+    return centre, d < 0
+
+
+def _fit(points: np.ndarray, first: int, last: int, tolerance: float) -> Optional[Fit]:
+    """
+    Tries to replace the lines from points[first] to points[last] with one
+    line or arc.
+
+    Returns:
+      (LINE or ARC, centre, cw), or None if neither fits.
+    """
+    run = points[first : last + 1]
+    a, c = run[0], run[-1]
+    if last - first == 1 or np.all(_segment_distances(run, a, c) <= tolerance):
+        return LINE, None, False
+
+    if np.ptp(run[:, 2]) > TOLERANCE:
+        return None  # ArcXY has to be flat
+
+    xy = run[:, :2]
+    centre, cw = _circle(xy[0], xy[len(xy) // 2], xy[-1])
+    if centre is None:
+        return None
+
+    radial = xy - centre
+    dists = np.hypot(radial[:, 0], radial[:, 1])
+    radius = (dists[0] + dists[-1]) / 2
+    if np.max(np.abs(dists - radius)) > tolerance:
+        return None
+
+    # every line has to turn the same way, less than a full circle in total
+    angles = np.arctan2(radial[:, 1], radial[:, 0])
+    steps = (np.diff(angles) + math.pi) % (2 * math.pi) - math.pi
+    if cw:
+        steps = -steps
+    if np.any(steps <= 0) or np.sum(steps) >= 2 * math.pi - 1e-9:
+        return None
+
+    # the middle of each line is inside the arc by the sagitta
+    chord = np.diff(xy, axis=0)
+    half2 = np.einsum("ij,ij->i", chord, chord) / 4
+    sagitta = radius - np.sqrt(np.maximum(radius**2 - half2, 0))
+    if np.max(sagitta) > tolerance:
+        return None
+
+    return ARC, np.array([centre[0], centre[1], run[0, 2]]), cw
+
+
+def _longest_fit(points: np.ndarray, first: int, tolerance: float) -> Tuple[int, Fit]:
+    """
+    Finds the furthest point that points[first] can be joined to by one line
+    or arc.
+    """
+    n = len(points)
+    best: Tuple[int, Fit] = (first + 1, (LINE, None, False))
+    step = 2
+    bad = n
+    while first + step < n:
+        result = _fit(points, first, first + step, tolerance)
+        if result is None:
+            bad = first + step
+            break
+        best = (first + step, result)
+        step *= 2
+
+    lo, hi = best[0], min(bad, n)
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        result = _fit(points, first, mid, tolerance)
+        if result is None:
+            hi = mid
+        else:
+            lo = mid
+            best = (mid, result)
+
+    return best
+
+
+def fit_points(points: Union[VectorArray, np.ndarray], tolerance: float) -> Toolpath:
+    """
+    Replaces a polyline with as few lines and XY arcs as possible.
+
+    Every point of the polyline, and every line between them, stays within
+    tolerance of the result. Arcs are only fitted where Z does not change.
+
+    Args:
+      points: N x 3 array of points.
+      tolerance: Largest allowable distance from the polyline.
+
+    Returns:
+      A Toolpath of lines and arcs from the first point to the last.
+    """
+    if isinstance(points, VectorArray):
+        points = points.data
+    arr = np.asarray(points, dtype=np.float64)
+    if len(arr):
+        # zero length lines don't go anywhere and have no direction
+        moved = np.any(np.diff(arr, axis=0) != 0, axis=1)
+        arr = arr[np.concatenate([[True], moved])]
+
+    kind: List[int] = []
+    ends: List[int] = []
+    centres: List[np.ndarray] = []
+    cw: List[bool] = []
+    first = 0
+    while first < len(arr) - 1:
+        last, (k, centre, direction) = _longest_fit(arr, first, tolerance)
+        kind.append(k)
+        ends.append(last)
+        centres.append(np.zeros(3) if centre is None else centre)
+        cw.append(direction)
+        first = last
+
+    starts = [0] + ends[:-1]
+    return Toolpath(
+        kind=kind,
+        start=arr[starts].reshape(-1, 3),
+        end=arr[ends].reshape(-1, 3),
+        centre=np.array(centres).reshape(-1, 3),
+        cw=cw,
+        feed=np.full(len(kind), np.nan),
+    )
+
+
+@overload
+def fit_arcs(paths: Toolpath, tolerance: float) -> Toolpath: ...
+
+
+@overload
+def fit_arcs(paths: List[PathElement], tolerance: float) -> List[PathElement]: ...
+
+
+def fit_arcs(paths, tolerance):
+    """
+    Replaces runs of Lines with ArcXYs, and Lines, that are within tolerance
+    of them. Existing arcs are left alone.
+
+    Args:
+      paths: A list of PathElements or a Toolpath.
+      tolerance: Largest allowable distance from the original path, usually
+        Machine.accuracy.
+
+    Returns:
+      The same type as paths.
+    """
+
+    def func(points):
+        return fit_points(points, tolerance)
+
+    if isinstance(paths, Toolpath):
+        return _map_line_runs(paths, func)
+
+    return _map_element_runs(paths, func)
@@ -0,0 +1,56 @@
+"""
+Number formatting for g-code output.
+"""
+
+from functools import lru_cache
+from typing import Callable, Iterable, List
+
+
+class Formatter:
+    """
+    Formats numbers to a fixed number of decimal places.
+
+    Args:
+      places: Number of decimal places.
+      strip_zeros: Remove trailing zeros, so 10.0 becomes "10" instead of
+        "10.0000".
+      cache_size: Remember this many recently formatted numbers. Useful when
+        the same coordinates are used over and over, eg. facing a grid. 0
+        disables the cache.
+    """
+
+    def __init__(self, places: int, strip_zeros: bool = False, cache_size: int = 0):
+        self.places = places
+        self.strip_zeros = strip_zeros
+        self.cache_size = cache_size
+
+        func: Callable[[float], str] = f"%.{places}f".__mod__
+        if strip_zeros:
+            func = self._stripper(func)
+
+        if cache_size > 0:
+            func = lru_cache(maxsize=cache_size)(func)
+
+        self._format = func
+
+    @staticmethod
+    def _stripper(func: Callable[[float], str]) -> Callable[[float], str]:
+        def strip(num: float) -> str:
+            s = func(num)
+            if "." in s:
+                s = s.rstrip("0").rstrip(".")
+            if s == "-0":
+                s = "0"
+            return s
+
+        return strip
+
+    def __call__(self, num: float) -> str:
+
+        return self._format(num)
+
+    def many(self, nums: Iterable[float]) -> List[str]:
+        """
+        Formats a sequence of numbers.
+        """
+        return list(map(self._format, nums))
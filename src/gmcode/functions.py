@@ -2,12 +2,97 @@
 Functions that operate on a Machine object.
 """
 
+import numpy as np
 from gmcode import Machine, Vector, MachineError
-from gmcode.geom import ArcXY
+from gmcode.toolpath import Toolpath, LINE, ARC
+from gmcode.offset import (
+    Contour,
+    Region,
+    concentric_loops,
+    zigzag_passes,
+    loop_toolpath,
+)
+from gmcode.material import Material
+from gmcode.instrument import timed
 from itertools import cycle, product
-from math import copysign, ceil, atan2
+from math import copysign, ceil, atan2, acos, cos, pi
+from typing import Any, Callable, List, Optional, Sequence
 
 
+def spiral_path(
+    start: Vector,
+    centre: Vector,
+    radius_end: float,
+    doc: float = 0.2,
+    cw: bool = True,
+    accuracy: float = 1e-4,
+) -> Toolpath:
+    """
+    The moves spiral makes, as a Toolpath.
+
+    Every half turn is worked out at once: half turn k goes around a point
+    doc / 4 to one side of centre or the other, starting (-1)**k * (r + k *
+    doc / 2) from centre along the line to start, where r is the starting
+    radius. There is no limit on the number of turns.
+
+    Args:
+      start: Where the spiral starts.
+      centre, radius_end, doc, cw: See spiral.
+      accuracy: Stop once the radius is within this of radius_end - doc.
+    """
+    if abs(centre.z - start.z) > accuracy:
+        raise MachineError("Can not handle centre and start point outside of XY plane")
+
+    offset = Vector(start.x - centre.x, start.y - centre.y)
+    radius_start = abs(offset)
+    direction = offset.unit_vector()
+    doc = copysign(doc, radius_end - radius_start)  # negative for cutting inwards
+    sign = copysign(1, doc)
+
+    # the first half turn that ends within doc of radius_end is the last
+    turns = (sign * (radius_end - radius_start) - 1.25 * abs(doc) - accuracy) / (
+        abs(doc) / 2
+    )
+    k = np.arange(max(ceil(turns), 0) + 2)
+    radii = radius_start + doc / 4 + k * doc / 2
+    done = sign * ((radius_end - doc) - radii) <= accuracy
+    done[-1] = True
+    k = k[: int(np.argmax(done)) + 1]
+
+    alternate = np.where(k % 2 == 0, 1.0, -1.0)
+    along = alternate * (radius_start + k * doc / 2)
+    pivots = -alternate * doc / 4
+    last = -alternate[-1] * (radius_start + len(k) * doc / 2)
+    final = copysign(radius_end, last)
+
+    def points(distances):
+        return np.stack(
+            [
+                centre.x + distances * direction.x,
+                centre.y + distances * direction.y,
+                np.full(len(distances), start.z),
+            ],
+            axis=1,
+        )
+
+    # a circle at the start radius, the half turns, then a circle, a step out
+    # and a circle at the end radius
+    starts = np.concatenate([[radius_start], along, [last, last, final]])
+    ends = np.concatenate([[radius_start], along[1:], [last, last, final, final]])
+    pivots = np.concatenate([[0.0], pivots, [0.0, 0.0, 0.0]])
+    kind = np.full(len(starts), ARC)
+    kind[-2] = LINE
+    return Toolpath(
+        kind=kind,
+        start=points(starts),
+        end=points(ends),
+        centre=points(pivots),
+        cw=np.full(len(starts), cw),
+        feed=np.full(len(starts), np.nan),
+    )
+
+
+@timed
 def spiral(
     m: Machine, centre: Vector, radius_end: float, doc: float = 0.2, cw: bool = True
 ):
@@ -22,39 +107,118 @@ def spiral(
       doc: Depth of cut.
       cw: Clockwise?
 
-    Used for pocketing/clearing material.
+    Used for pocketing/clearing material. The spiral is made of half circle
+    arcs, see spiral_path.
     """
+    m.cut(spiral_path(m.position, centre, radius_end, doc, cw, m.accuracy))
 
-    if (centre.z - m.position.z) > m.accuracy:
+
+def _circumcentres(a: np.ndarray, b: np.ndarray, c: np.ndarray) -> np.ndarray:
+    """
+    Centres of the circles through rows of three XY points.
+    """
+    b = b - a
+    c = c - a
+    d = 2 * (b[:, 0] * c[:, 1] - b[:, 1] * c[:, 0])
+    b2 = np.einsum("ij,ij->i", b, b)
+    c2 = np.einsum("ij,ij->i", c, c)
+    offset = np.stack(
+        [c[:, 1] * b2 - b[:, 1] * c2, b[:, 0] * c2 - c[:, 0] * b2], axis=1
+    )
+    return a + offset / d[:, None]
+
+
+def archimedean_path(
+    start: Vector,
+    centre: Vector,
+    radius_end: float,
+    doc: float = 0.2,
+    cw: bool = True,
+    accuracy: float = 1e-4,
+) -> Toolpath:
+    """
+    An Archimedean spiral made of arcs, as a Toolpath. The radius changes by
+    doc every turn, smoothly instead of in half turn steps like spiral_path,
+    and it finishes with a circle at radius_end.
+
+    Every turn is split into the same number of arcs, each through the start,
+    middle and end of its piece of the spiral, doubling the number until the
+    arcs are within accuracy of the spiral.
+
+    Args:
+      start: Where the spiral starts.
+      centre, radius_end, doc, cw: See spiral.
+      accuracy: Largest allowable distance from the spiral.
+    """
+    if abs(centre.z - start.z) > accuracy:
         raise MachineError("Can not handle centre and start point outside of XY plane")
 
-    vec0 = m.position - centre
-    radius_current = abs(vec0)
-    doc = copysign(doc, radius_end - radius_current)  # negative for cutting inwards
-    wobble = vec0.unit_vector() * doc / 4
-    centres = [centre - wobble, centre + wobble]
-    counter = 0
-    m.arc(i=centre.x, j=centre.y, cw=cw)
-    for c in cycle(centres):
-        # make a 180 degree arc around c
-        end = c - (m.position - c)
-        a = ArcXY(start=m.position, end=end, centre=c, cw=cw)
-        m.cut([a])
-        distance_to_go = copysign(1, doc) * ((radius_end - doc) - a.radius())
-        if distance_to_go <= m.accuracy:
+    offset = Vector(start.x - centre.x, start.y - centre.y)
+    radius_start = abs(offset)
+    angle_start = atan2(offset.y, offset.x) if radius_start > 0 else 0.0
+    sweep = 2 * np.pi * abs(radius_end - radius_start) / doc
+    pitch = (radius_end - radius_start) / sweep if sweep > 0 else 0.0
+    turn = -1 if cw else 1
+    origin = np.array([centre.x, centre.y])
+
+    def spiral_points(t):
+        radius = radius_start + pitch * t
+        angle = angle_start + turn * t
+        return origin + np.stack(
+            [radius * np.cos(angle), radius * np.sin(angle)], axis=1
+        )
+
+    first = last = pivots = np.zeros((0, 2))
+    segments = max(ceil(sweep / (np.pi / 2)), 1)
+    while sweep > 0:
+        t = np.linspace(0, sweep, 2 * segments + 1)
+        xy = spiral_points(t)
+        xy[0] = start.x, start.y
+        first, middle, last = xy[:-1:2], xy[1::2], xy[2::2]
+        pivots = _circumcentres(first, middle, last)
+
+        # compare the spiral and the arcs between the points they go through
+        between = spiral_points((t[:-1] + t[1:]) / 2)
+        arc = np.repeat(np.arange(segments), 2)
+        radii = np.hypot(*(first - pivots).T)
+        error = np.abs(np.hypot(*(between - pivots[arc]).T) - radii[arc])
+        if np.max(error) <= accuracy / 2:
             break
+        segments *= 2
+
+    end = last[-1] if len(last) else np.array([start.x, start.y])
+    circle = end[None, :]
+    origins = np.vstack([first, circle])
+    ends = np.vstack([last, circle])
+    pivots = np.vstack([pivots, origin[None, :]])
+    height = np.full((len(origins), 1), start.z)
+    return Toolpath.arcs(
+        np.hstack([origins, height]),
+        np.hstack([ends, height]),
+        np.hstack([pivots, height]),
+        cw=cw,
+    )
 
-        counter += 1
-        if counter > 10000:
-            raise MachineError("Infinite loop in spiral")
 
-    # final cut, a circle at end radius
-    m.arc(i=centre.x, j=centre.y, cw=cw)
-    end = centre + (m.position - centre).unit_vector() * radius_end
-    m.g1(end.x, end.y)
-    m.arc(i=centre.x, j=centre.y, cw=cw)
+@timed
+def archimedean_spiral(
+    m: Machine, centre: Vector, radius_end: float, doc: float = 0.2, cw: bool = True
+):
+    """
+    Like spiral, but follows an Archimedean spiral, whose radius changes
+    steadily, to within the machine's accuracy.
+
+    Args:
+      m: Machine object to act upon.
+      centre: Centre point of the spiral, at the same height as the machine.
+      radius_end: The final radius of the spiral.
+      doc: Depth of cut, the change in radius every turn.
+      cw: Clockwise?
+    """
+    m.cut(archimedean_path(m.position, centre, radius_end, doc, cw, m.accuracy))
 
 
+@timed
 def helical_entry(
     m: Machine,
     centre: Vector,
@@ -81,6 +245,7 @@ def helical_entry(
     m.arc(z=final_height, i=centre.x, j=centre.y, p=loops, cw=cw)
 
 
+@timed
 def rect_in(
     m: Machine,
     centre: Vector = Vector(),
@@ -133,3 +298,411 @@ def rect_in(
             break
 
     m.comment("rect_in end")
+
+
+@timed
+def repeat(
+    m: Machine,
+    operation: Callable[..., Any],
+    starts: Sequence[Vector],
+    *args,
+    clearance: float,
+    name: Optional[str] = None,
+    **kwargs,
+):
+    """
+    Runs an operation at several places, writing it only once as a
+    subroutine, eg. the same pocket at every point of a grid:
+
+        repeat(m, spiral, starts, centre=starts[0] + offset, radius_end=5,
+               clearance=2)
+
+    Args:
+      m: Machine instance to act on.
+      operation: Called as operation(sub, *args, **kwargs) to write the
+        subroutine, starting from starts[0]. Coordinates in the arguments are
+        for that first place.
+      starts: Where to run the operation from. The machine rapids to each one
+        at the clearance height, then down, then calls the subroutine.
+      clearance: Height to rapid at between places.
+      name: Subroutine name, defaults to the name of operation.
+    """
+    if not starts:
+        return
+
+    name = name if name is not None else operation.__name__
+    with m.subroutine(name, origin=starts[0]) as sub:
+        operation(sub, *args, **kwargs)
+
+    for start in starts:
+        m.g0(z=clearance)
+        m.g0(start.x, start.y)
+        m.g0(z=start.z)
+        m.call(name)
+
+    m.g0(z=clearance)
+
+
+def _link(m: Machine, region: Region, end, tool_radius: float, clearance: float):
+    """
+    Moves to end at the current height, straight there if the tool stays
+    inside the region on the way, otherwise up to clearance and back down.
+    """
+    depth = m.position.z
+    start = np.array([m.position.x, m.position.y])
+    if np.hypot(*(end - start)) <= m.accuracy:
+        return
+    if region.clearance(start, end, tool_radius) >= tool_radius - m.accuracy:
+        m.g1(end[0], end[1])
+    else:
+        m.g0(z=clearance)
+        m.g0(end[0], end[1])
+        m.g1(z=depth)
+
+
+def _nearest_loop(m: Machine, loops: List[np.ndarray]) -> np.ndarray:
+    """
+    Takes the loop nearest the tool out of loops, starting at its nearest
+    corner.
+    """
+    here = np.array([m.position.x, m.position.y])
+    gaps = [np.hypot(*(loop - here).T) for loop in loops]
+    k = int(np.argmin([g.min() for g in gaps]))
+    return np.roll(loops.pop(k), -int(np.argmin(gaps[k])), axis=0)
+
+
+def _cut_loops(
+    m: Machine,
+    region: Region,
+    loops: List[np.ndarray],
+    tool_radius: float,
+    clearance: float,
+):
+    """
+    Cuts closed loops, nearest first, starting each one at its nearest corner.
+    """
+    remaining = list(loops)
+    while remaining:
+        loop = _nearest_loop(m, remaining)
+        _link(m, region, loop[0], tool_radius, clearance)
+        m.cut(loop_toolpath(loop, m.position.z, m.accuracy))
+
+
+def _cut_passes(
+    m: Machine,
+    region: Region,
+    passes: List[np.ndarray],
+    tool_radius: float,
+    clearance: float,
+):
+    """
+    Cuts straight passes, going to the nearest end of the nearest one next.
+    """
+    if not passes:
+        return
+    ends = np.array(passes)
+    remaining = np.ones(len(ends), dtype=bool)
+    while remaining.any():
+        here = np.array([m.position.x, m.position.y])
+        gaps = np.hypot(*(ends - here).transpose(2, 0, 1))
+        gaps[~remaining] = np.inf
+        k, side = np.unravel_index(int(np.argmin(gaps)), gaps.shape)
+        remaining[k] = False
+        start, end = ends[k, side], ends[k, 1 - side]
+        _link(m, region, start, tool_radius, clearance)
+        m.g1(end[0], end[1])
+
+
+@timed
+def pocket(
+    m: Machine,
+    outline: Contour,
+    tool_radius: float,
+    stepover: float,
+    islands: Sequence[Contour] = (),
+    *,
+    clearance: float,
+    pattern: str = "concentric",
+    angle: float = 0.0,
+    climb: bool = True,
+):
+    """
+    Clears the material inside a closed contour, leaving any islands.
+
+    The tool must already be inside the pocket at cutting depth. It moves
+    between passes at that depth where it can stay inside the pocket, and
+    goes up to clearance otherwise.
+
+    Args:
+      m: Machine instance to act on.
+      outline: Closed contour around the pocket, see gmcode.offset.contour.
+      tool_radius: Radius of the tool.
+      stepover: Largest width of cut.
+      islands: Closed contours inside the pocket to leave standing.
+      clearance: Height to move over islands at.
+      pattern: "concentric" follows the shape of the pocket, from the middle
+        out. "zigzag" goes back and forth in straight lines, then once
+        around the walls.
+      angle: Direction of the zigzag passes, anticlockwise from the X axis
+        in radians.
+      climb: Climb mill the walls (with a clockwise spindle), otherwise
+        conventional mill them.
+    """
+    region = Region(outline, islands, m.accuracy)
+    if pattern == "concentric":
+        levels = concentric_loops(region, tool_radius, stepover)
+    elif pattern == "zigzag":
+        _cut_passes(
+            m,
+            region,
+            zigzag_passes(region, tool_radius, stepover, angle),
+            tool_radius,
+            clearance,
+        )
+        levels = [region.offset(tool_radius)]
+    else:
+        raise ValueError(f"Unknown pocket pattern {pattern!r}")
+
+    for loops in levels:
+        if not climb:
+            loops = [loop[::-1] for loop in loops]
+        _cut_loops(m, region, loops, tool_radius, clearance)
+
+
+def _samples(start: np.ndarray, end: np.ndarray, spacing: float) -> np.ndarray:
+    """
+    Points along a line no more than spacing apart, including both ends.
+    """
+    n = max(ceil(float(np.hypot(*(end - start))) / spacing), 1)
+    return start + np.linspace(0, 1, n + 1)[:, None] * (end - start)
+
+
+def _circle_samples(
+    start: np.ndarray, centre: np.ndarray, cw: bool, spacing: float
+) -> np.ndarray:
+    """
+    Points once around a circle no more than spacing apart, including both
+    ends.
+    """
+    radius = float(np.hypot(*(start - centre)))
+    n = max(ceil(2 * pi * radius / spacing), 8)
+    a0 = atan2(start[1] - centre[1], start[0] - centre[0])
+    angles = a0 + np.linspace(0, -2 * pi if cw else 2 * pi, n + 1)
+    return centre + radius * np.stack([np.cos(angles), np.sin(angles)], axis=1)
+
+
+def _trochoidal(
+    m: Machine,
+    region: Region,
+    material: Material,
+    path: np.ndarray,
+    tool_radius: float,
+    loop_radius: float,
+    limit: float,
+    climb: bool,
+):
+    """
+    Follows a path of corners, N x 2, going around circles on the way that
+    take as big a bite as they can with the tool's engagement below limit.
+
+    The circles start and end on the path and are on the side of it that
+    has been cleared, the left side for climb milling. Where there is
+    nothing to cut there are no circles.
+    """
+    cw = not climb
+    side = 1 if climb else -1
+    spacing = material.resolution
+    edges = np.diff(path, axis=0)
+    lengths = np.hypot(*edges.T)
+    ends = np.cumsum(lengths)
+    total = float(ends[-1])
+    if total <= m.accuracy:
+        return
+    tangents = edges / lengths[:, None]
+    normals = side * np.stack([-tangents[:, 1], tangents[:, 0]], axis=1)
+
+    fractions = np.arange(1, 9) / 8
+
+    def place(distance, radius):
+        # the point distance along the path, and the centre and radius of
+        # the largest circle up to radius through it that fits in the region
+        k = min(int(np.searchsorted(ends, distance)), len(lengths) - 1)
+        point = path[k + 1] - (ends[k] - distance) * tangents[k]
+        radii = radius * fractions
+        centres = point + radii[:, None] * normals[k]
+        room = region.distances(centres, radius + tool_radius) - radii - tool_radius
+        fits = np.cumprod(room >= -m.accuracy).astype(bool)
+        radius = float(radii[fits][-1]) if fits.any() else 0.0
+        return point + radius * normals[k], radius, point
+
+    feed = m.snapshot().feedrate
+    here = np.array([m.position.x, m.position.y])
+    distance, radius, step = 0.0, 0.0, loop_radius
+    pending = None  # the end of straight moves that have not been written
+
+    def flush():
+        if pending is not None:
+            m.g1(pending[0], pending[1])
+
+    while distance < total:
+        largest = place(distance, loop_radius)[1]
+
+        def bite(step, most=loop_radius):
+            # first make the circles bigger, then move them along
+            grown = min(radius + step, max(largest, radius), most)
+            along = min(distance + step - max(grown - radius, 0), total)
+            centre, grown, start = place(along, grown)
+            points = _samples(here, start, spacing)
+            straight = len(points) - 1
+            circle = grown > m.accuracy
+            if circle:
+                points = np.vstack(
+                    [points, _circle_samples(start, centre, cw, spacing)[1:]]
+                )
+            engagement = material.engagement(points, tool_radius)
+            cutting = circle and bool(engagement[straight:].any())
+            return along, centre, grown, start, cutting, engagement.max(initial=0)
+
+        # the load changes slowly, so a bit more than the last step is tried
+        # first, then a smaller one is found by bisection down to a minimum
+        # so the tool always gets somewhere
+        step = min(2 * step, loop_radius)
+        move = bite(step)
+        if move[5] > limit and move[2] > m.accuracy:
+            lo, hi = spacing / 2, step
+            move = bite(lo)
+            for _ in range(4):
+                mid = (lo + hi) / 2
+                trial = bite(mid)
+                if trial[5] <= limit:
+                    lo, move = mid, trial
+                else:
+                    hi = mid
+            step = lo
+            # turning a corner the circles swing round, which small ones do
+            # with less of a bite
+            for most in (move[2] / 2, move[2] / 4, move[2] / 8, 0):
+                if move[5] <= limit:
+                    break
+                move = bite(lo, most)
+
+        distance, centre, radius, start, cutting, engagement = move
+        # where the bite is still too big the tool slows down to take about
+        # as much material a minute as it would at the limit
+        slow = feed is not None and engagement > limit
+        material.cut(np.array([here, start]), tool_radius)
+        if cutting or slow:
+            flush()
+            pending = None
+            if feed is not None and slow:
+                m.feedrate(feed * (1 - cos(limit)) / (1 - cos(engagement)))
+            m.g1(start[0], start[1])
+            if cutting:
+                m.arc(x=start[0], y=start[1], i=centre[0], j=centre[1], cw=cw)
+                material.cut_circle(centre, radius, tool_radius)
+            if feed is not None and slow:
+                m.feedrate(feed)
+        elif pending is not None:
+            # straight moves in the same direction are written as one
+            written = np.array([m.position.x, m.position.y])
+            u, v = pending - written, start - written
+            if abs(u[0] * v[1] - u[1] * v[0]) > m.accuracy * np.hypot(*v) or (
+                np.dot(u, v) <= 0
+            ):
+                flush()
+            pending = start
+        else:
+            pending = start
+        here = start
+
+    flush()
+
+
+@timed
+def adaptive(
+    m: Machine,
+    outline: Contour,
+    tool_radius: float,
+    stepover: float,
+    islands: Sequence[Contour] = (),
+    *,
+    clearance: float,
+    loop_radius: Optional[float] = None,
+    resolution: Optional[float] = None,
+    climb: bool = True,
+) -> Material:
+    """
+    Clears the material inside a closed contour, leaving any islands,
+    without ever loading the tool much more than a cut stepover wide along a
+    straight wall would.
+
+    The tool works out from the middle of the pocket along loops like
+    pocket's concentric ones. Where there is material to cut it goes around
+    circles of up to loop_radius on the way (trochoidal milling), each one
+    moved on as far as the material left allows, so corners and narrow
+    places get smaller bites instead of overloading the tool. Where there is
+    nothing to cut it moves straight, and where it can not help taking a
+    bigger bite, eg. going into a sharp corner, it slows down. The material
+    left is tracked on a raster of cells resolution wide.
+
+    The tool must already be inside the pocket at cutting depth, in a hole
+    at least as wide as the tool.
+
+    Args:
+      m: Machine instance to act on.
+      outline: Closed contour around the pocket, see gmcode.offset.contour.
+      tool_radius: Radius of the tool.
+      stepover: Width of cut off a straight wall that gives the largest
+        engagement allowed.
+      islands: Closed contours inside the pocket to leave standing.
+      clearance: Height to move over islands at.
+      loop_radius: Largest circle the tool goes around, and the distance
+        between loops. Defaults to tool_radius.
+      resolution: Width of the cells material is tracked in, defaults to an
+        eighth of tool_radius.
+      climb: Climb mill (with a clockwise spindle), otherwise conventional
+        mill.
+
+    Returns:
+      The material left, eg. to check there is nowhere the tool could not
+      reach.
+    """
+    if stepover <= 0:
+        raise ValueError("stepover must be positive")
+    loop_radius = tool_radius if loop_radius is None else loop_radius
+    if loop_radius <= 0:
+        raise ValueError("loop_radius must be positive")
+
+    region = Region(outline, islands, m.accuracy)
+    material = Material(region, tool_radius / 8 if resolution is None else resolution)
+    material.cut(np.array([[m.position.x, m.position.y]]), tool_radius)
+    limit = acos(1 - min(stepover, 2 * tool_radius) / tool_radius)
+
+    for loops in concentric_loops(region, tool_radius, loop_radius):
+        remaining = [loop if climb else loop[::-1] for loop in loops]
+        while remaining:
+            loop = _nearest_loop(m, remaining)
+            here = np.array([m.position.x, m.position.y])
+            if region.clearance(here, loop[0], tool_radius) >= (
+                tool_radius - m.accuracy
+            ):
+                # there can be material on the way, which is cut the same way
+                _trochoidal(
+                    m,
+                    region,
+                    material,
+                    np.array([here, loop[0]]),
+                    tool_radius,
+                    loop_radius,
+                    limit,
+                    climb,
+                )
+            else:
+                _link(m, region, loop[0], tool_radius, clearance)
+                material.cut(loop[:1], tool_radius)
+            path = np.vstack([loop, loop[:1]])
+            _trochoidal(
+                m, region, material, path, tool_radius, loop_radius, limit, climb
+            )
+
+    return material
@@ -1,6 +1,7 @@
 import attr
 import math
-from typing import Literal
+import numpy as np
+from typing import Iterable, Iterator, List, Literal, Union, overload
 
 
 TOLERANCE = 1e-6
@@ -73,6 +74,17 @@ class Vector:
 
         return self.__truediv__(length)
 
+    def isclose(self, o: "Vector", tolerance: float = TOLERANCE) -> bool:
+        """
+        Fast comparison, True if o is less than tolerance away.
+
+        Unlike ==, this does not allocate any Vectors or normalise anything.
+        """
+        dx = self.x - o.x
+        dy = self.y - o.y
+        dz = self.z - o.z
+        return dx * dx + dy * dy + dz * dz < tolerance * tolerance
+
     def __eq__(self, o):
 
         if all([abs(x) < TOLERANCE for x in [self, o]]):
@@ -89,6 +101,145 @@ class Vector:
         return True
 
 
+def _as_points(val) -> np.ndarray:
+    """
+    Converts val to a contiguous N x 3 float64 array.
+    """
+    arr = np.ascontiguousarray(val, dtype=np.float64)
+    if arr.size == 0:
+        arr = arr.reshape(0, 3)
+    if arr.ndim != 2 or arr.shape[1] != 3:
+        raise ValueError(f"Expected an N x 3 array, got shape {arr.shape}")
+    return arr
+
+
+@attr.s(auto_detect=True, frozen=True, slots=True, eq=False)  # type: ignore[call-overload]
+class VectorArray:
+    """
+    Many Vectors stored in an N x 3 NumPy array.
+
+    Behaves like a sequence of Vector, but arithmetic is done on the whole
+    array at once. Operations that return a single value per Vector (dot,
+    abs) return a NumPy array of length N.
+    """
+
+    data: np.ndarray = attr.ib(converter=_as_points)
+
+    @classmethod
+    def from_vectors(cls, vectors: Iterable[Vector]) -> "VectorArray":
+
+        return cls([(v.x, v.y, v.z) for v in vectors])
+
+    def to_vectors(self) -> List[Vector]:
+
+        return [Vector(*row) for row in self.data.tolist()]
+
+    @property
+    def x(self) -> np.ndarray:
+
+        return self.data[:, 0]
+
+    @property
+    def y(self) -> np.ndarray:
+
+        return self.data[:, 1]
+
+    @property
+    def z(self) -> np.ndarray:
+
+        return self.data[:, 2]
+
+    def __len__(self) -> int:
+
+        return self.data.shape[0]
+
+    def __iter__(self) -> Iterator[Vector]:
+
+        for row in self.data.tolist():
+            yield Vector(*row)
+
+    @overload
+    def __getitem__(self, idx: int) -> Vector: ...
+
+    @overload
+    def __getitem__(self, idx: Union[slice, np.ndarray]) -> "VectorArray": ...
+
+    def __getitem__(self, idx):
+
+        if isinstance(idx, (int, np.integer)):
+            return Vector(*self.data[idx].tolist())
+        return self.__class__(self.data[idx])
+
+    @staticmethod
+    def _operand(o) -> np.ndarray:
+        """
+        Returns an array that broadcasts against self.data.
+        """
+        if isinstance(o, VectorArray):
+            return o.data
+        if isinstance(o, Vector):
+            return np.array([o.x, o.y, o.z])
+        return np.asarray(o, dtype=np.float64)
+
+    @staticmethod
+    def _scalars(o) -> np.ndarray:
+        """
+        Returns o as a column, so each row can be scaled by a different value.
+        """
+        o = np.asarray(o, dtype=np.float64)
+        return o.reshape(-1, 1) if o.ndim == 1 else o
+
+    def __neg__(self) -> "VectorArray":
+
+        return self.__class__(-self.data)
+
+    def __add__(self, o: Union["VectorArray", Vector]) -> "VectorArray":
+
+        return self.__class__(self.data + self._operand(o))
+
+    def __sub__(self, o: Union["VectorArray", Vector]) -> "VectorArray":
+
+        return self.__class__(self.data - self._operand(o))
+
+    def __mul__(self, o: Union[float, np.ndarray]) -> "VectorArray":
+
+        return self.__class__(self.data * self._scalars(o))
+
+    def __rmul__(self, o: Union[float, np.ndarray]) -> "VectorArray":
+
+        return self.__mul__(o)
+
+    def __truediv__(self, o: Union[float, np.ndarray]) -> "VectorArray":
+
+        return self.__class__(self.data / self._scalars(o))
+
+    def __abs__(self) -> np.ndarray:
+
+        return np.sqrt(np.einsum("ij,ij->i", self.data, self.data))
+
+    def norm(self) -> np.ndarray:
+
+        return self.__abs__()
+
+    def cross(self, o: Union["VectorArray", Vector]) -> "VectorArray":
+
+        return self.__class__(np.cross(self.data, self._operand(o)))
+
+    def dot(self, o: Union["VectorArray", Vector]) -> np.ndarray:
+
+        return np.einsum(
+            "ij,ij->i", self.data, np.broadcast_to(self._operand(o), self.data.shape)
+        )
+
+    def unit_vector(self) -> "VectorArray":
+
+        length = abs(self)
+        if np.any(length < TOLERANCE):
+            raise ValueError("Can not get unit vector of 0 vector")
+
+        return self.__truediv__(length)
+
+
 @attr.s(auto_detect=True, frozen=True, slots=True)  # type: ignore[call-overload]
 class PathElement:
     start: Vector = attr.ib(Vector())
@@ -0,0 +1,256 @@
+"""
+Opt-in counters and timers for finding out where a Machine spends its time.
+
+Machine.instrument attaches an Instruments, which replaces the machine's hot
+methods (format, format_many, _xyz_to_command, write and _write_block) on
+that one instance with versions that time them and count what is written. Nothing is
+changed on the class, so a Machine without instruments runs exactly the same
+code as before. The operations in gmcode.functions are timed as well, they
+check whether the machine has instruments once per call.
+"""
+
+import attr
+import contextlib
+import functools
+import time
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, Iterator, List, Sequence
+
+# Machine methods that are timed
+TIMED_METHODS = (
+    "format",
+    "format_many",
+    "_xyz_to_command",
+    "write",
+    "_write_block",
+)
+# timed methods recorded under another name: batches of moves are formatted
+# with format_many, which counts as format
+_TIMED_AS = {"format_many": "format"}
+# the ones that write text, which is counted
+_WRITERS = ("write", "_write_block")
+
+
+def command_kind(line: str) -> str:
+    """
+    The type of command a line of g-code is, eg. "G1", "F", "T", "comment"
+    or "o" for an o-word.
+    """
+    words = line.split(None, 1)
+    if not words:
+        return "blank"
+    word = words[0]
+    if word[0] in "(;":
+        return "comment"
+    if word[0] in "FTSo":
+        return word[0]
+    return word
+
+
+class Hook:
+    """
+    Receives what Instruments measures as it happens. Subclasses override the
+    methods they need.
+    """
+
+    def line(self, kind: str, text: str):
+        """
+        Called for each line written, with its type, see command_kind.
+        """
+
+    def timed(self, name: str, seconds: float):
+        """
+        Called each time a timed method or operation returns.
+        """
+
+
+@attr.s(auto_detect=True, frozen=True, slots=True)  # type: ignore[call-overload]
+class Timing:
+    """
+    Attributes:
+      calls: Number of calls.
+      seconds: Total time spent in them.
+    """
+
+    calls: int = attr.ib(0)
+    seconds: float = attr.ib(0.0)
+
+
+@attr.s(auto_detect=True, frozen=True, slots=True)  # type: ignore[call-overload]
+class Report:
+    """
+    What Instruments has measured, see Instruments.report.
+
+    Attributes:
+      commands: Number of lines of each type, see command_kind.
+      bytes: UTF-8 bytes written.
+      timings: Calls to each timed method and gmcode.functions operation.
+        Times include the timed calls made inside them, eg. _xyz_to_command
+        includes format and an operation includes everything. Each batch
+        of numbers formatted by format_many is one call to format.
+    """
+
+    commands: Dict[str, int] = attr.ib(factory=dict)
+    bytes: int = attr.ib(0)
+    timings: Dict[str, Timing] = attr.ib(factory=dict)
+
+    @property
+    def lines(self) -> int:
+
+        return sum(self.commands.values())
+
+    def __str__(self) -> str:
+
+        out = [f"{self.lines} lines, {self.bytes} bytes"]
+        for kind, count in sorted(self.commands.items(), key=lambda kv: -kv[1]):
+            out.append(f"  {kind:<24} {count:>12}")
+        out.append("timings:")
+        for name, t in sorted(self.timings.items(), key=lambda kv: -kv[1].seconds):
+            out.append(f"  {name:<24} {t.calls:>12} calls {t.seconds:>12.6f} s")
+        return "\n".join(out)
+
+
+class Instruments:
+    """
+    Counts and times what the Machines it is attached to do.
+
+    Args:
+      hooks: Told about each line and timing as it happens.
+    """
+
+    def __init__(self, hooks: Sequence[Hook] = ()):
+        self.hooks = list(hooks)
+        self._machines: List[Any] = []
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Starts counting again from zero.
+        """
+        self._commands: Counter = Counter()
+        self._bytes = 0
+        self._calls: Counter = Counter()
+        self._seconds: Dict[str, float] = defaultdict(float)
+        self._writing = False
+
+    def attach(self, m):
+        """
+        Starts measuring m, see Machine.instrument.
+        """
+        for name in TIMED_METHODS:
+            method = getattr(m, name)
+            wrapped = (
+                self._writer(name, method)
+                if name in _WRITERS
+                else self._timer(_TIMED_AS.get(name, name), method)
+            )
+            setattr(m, name, wrapped)
+        m.instruments = self
+        self._machines.append(m)
+
+    def detach(self):
+        """
+        Stops measuring, putting every machine back how it was.
+        """
+        for m in self._machines:
+            for name in TIMED_METHODS:
+                vars(m).pop(name, None)
+            vars(m).pop("instruments", None)
+        self._machines = []
+
+    def _record(self, name: str, seconds: float):
+
+        self._calls[name] += 1
+        self._seconds[name] += seconds
+        for hook in self.hooks:
+            hook.timed(name, seconds)
+
+    def _timer(self, name: str, method: Callable) -> Callable:
+
+        clock = time.perf_counter
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._record(name, clock() - start)
+
+        return wrapper
+
+    def _writer(self, name: str, method: Callable) -> Callable:
+
+        clock = time.perf_counter
+
+        @functools.wraps(method)
+        def wrapper(text: str):
+            # some machines write blocks a line at a time, the text is only
+            # counted once
+            if self._writing:
+                return method(text)
+            self._writing = True
+            start = clock()
+            try:
+                method(text)
+            finally:
+                self._record(name, clock() - start)
+                self._writing = False
+            self._count(text if text.endswith("\n") else text + "\n")
+
+        return wrapper
+
+    def _count(self, text: str):
+
+        self._bytes += len(text.encode())
+        lines = text.split("\n")[:-1]
+        if not self.hooks:
+            self._commands.update(map(command_kind, lines))
+            return
+        for line in lines:
+            kind = command_kind(line)
+            self._commands[kind] += 1
+            for hook in self.hooks:
+                hook.line(kind, line)
+
+    @contextlib.contextmanager
+    def timing(self, name: str) -> Iterator[None]:
+        """
+        Times a block of code under name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, time.perf_counter() - start)
+
+    def report(self) -> Report:
+        """
+        Everything measured so far.
+        """
+        return Report(
+            commands=dict(self._commands),
+            bytes=self._bytes,
+            timings={
+                name: Timing(calls, self._seconds[name])
+                for name, calls in self._calls.items()
+            },
+        )
+
+
+def timed(func: Callable) -> Callable:
+    """
+    Times an operation that takes a Machine as its first argument, whenever
+    that machine has instruments attached.
+    """
+    name = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(m, *args, **kwargs):
+        instruments = getattr(m, "instruments", None)
+        if instruments is None:
+            return func(m, *args, **kwargs)
+        with instruments.timing(name):
+            return func(m, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,232 @@
+"""
+Generating the operations of a job in parallel.
+
+Each operation of a Job is rendered to text in a worker process, on a Machine
+that starts at the operation's entry point with the rest of its modal state
+unknown. An unknown feedrate, plane or path mode is always written when the
+operation sets it, so every fragment is correct whatever comes before it.
+The fragments are then written to the real Machine in order, with the same
+moves between them as gmcode.schedule.run, and the Machine's modal state is
+brought up to date after each one.
+
+Because a fragment only depends on its operation and the Machine's output
+options, fragments can be kept in a FragmentCache between builds. When one
+dimension of a job changes, only the operations whose inputs changed are
+generated again and the rest of the program is put together from the cache.
+"""
+
+import attr
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union, cast
+from gmcode.cache import LRUCache, digest
+from gmcode.machine import Machine, MachineState, _merge
+from gmcode.geom import Vector, PathElement
+from gmcode.toolpath import Toolpath
+from gmcode.schedule import Operation, approach, order
+
+
+@attr.s(auto_detect=True, frozen=True, slots=True)  # type: ignore[call-overload]
+class Call:
+    """
+    A picklable action for an Operation, calls func(m, *args, **kwargs).
+    """
+
+    func: Callable[..., Any] = attr.ib()
+    args: Tuple[Any, ...] = attr.ib(())
+    kwargs: Dict[str, Any] = attr.ib(factory=dict)
+
+    def __call__(self, m: Machine):
+
+        return self.func(m, *self.args, **self.kwargs)
+
+
+@attr.s(auto_detect=True, frozen=True, slots=True)  # type: ignore[call-overload]
+class Fragment:
+    """
+    The g-code of one operation, and the state of the Machine after it.
+    """
+
+    text: str = attr.ib()
+    state: MachineState = attr.ib()
+
+
+def _options(m: Machine) -> Dict[str, Any]:
+    """
+    Machine arguments that change the text it writes.
+    """
+    return {
+        "accuracy": m.accuracy,
+        "strip_zeros": m._strip_zeros,
+        "format_cache": m._format_cache,
+        "tolerance": m.tolerance,
+    }
+
+
+def render(op: Operation, options: Dict[str, Any]) -> Fragment:
+    """
+    Renders an operation on its own, starting at its entry point.
+
+    Args:
+      op: Operation to render. Its action has to be picklable to be sent to a
+        worker process, eg. a Call of a module level function.
+      options: Keyword arguments for Machine.
+    """
+    text = io.StringIO()
+    m = Machine(text, buffer_size=0, **options)
+    m.restore(
+        MachineState(position=op.entry, tool_number=op.tool, unitialised=frozenset())
+    )
+    op.action(m)
+    return Fragment(text.getvalue(), m.snapshot())
+
+
+def _render(item: Tuple[Operation, Dict[str, Any]]) -> Fragment:
+
+    return render(*item)
+
+
+def fingerprint(op: Operation, options: Dict[str, Any]) -> str:
+    """
+    A hash of everything that changes the fragment rendered for op: its
+    action and the action's arguments, entry point and tool, and the Machine
+    options. The exit point and name are written outside the fragment, so
+    they are not included.
+    """
+    return digest((op.action, op.entry, op.tool, options))
+
+
+class FragmentCache(LRUCache):
+    """
+    Fragments of operations that have been rendered before, by fingerprint.
+
+    Args:
+      maxsize: Number of fragments to keep, the least recently used one is
+        dropped first. None keeps them all.
+      path: File to keep fragments in between runs. It is read now, if it
+        exists, and written by save.
+    """
+
+    def __init__(
+        self,
+        maxsize: Optional[int] = None,
+        path: Union[None, str, os.PathLike] = None,
+    ):
+        super().__init__(maxsize, path)
+
+
+class Job:
+    """
+    A list of independent operations that are generated in parallel.
+
+    Operations should not change tools themselves, give the tool to add
+    instead so tool changes are only made when they are needed.
+
+    Args:
+      clearance: Height to rapid between operations at.
+      cache: Fragments kept from earlier builds. Only operations that are not
+        in it are rendered, and the new fragments are added to it.
+    """
+
+    def __init__(self, clearance: float, cache: Optional[FragmentCache] = None):
+        self.clearance = clearance
+        self.cache = cache
+        self.operations: List[Operation] = []
+
+    def add(
+        self,
+        func: Callable[..., Any],
+        entry: Vector,
+        *args,
+        exit: Optional[Vector] = None,
+        tool: Optional[int] = None,
+        name: str = "",
+        **kwargs,
+    ) -> Operation:
+        """
+        Adds an operation that calls func(m, *args, **kwargs) with the machine
+        at entry, eg.
+
+            job.add(functions.spiral, Vector(10, 10, -1), centre=..., ...)
+
+        func has to be defined at module level so it can be sent to worker
+        processes. See gmcode.schedule.Operation for the other arguments.
+        """
+        op = Operation(entry, Call(func, args, kwargs), exit, tool, name)
+        self.operations.append(op)
+        return op
+
+    def cut(
+        self,
+        paths: Union[List[PathElement], Toolpath],
+        tool: Optional[int] = None,
+        name: str = "",
+    ) -> Operation:
+        """
+        Adds an operation that cuts paths with Machine.cut, starting at the
+        start of the first one.
+        """
+        if isinstance(paths, Toolpath):
+            entry, exit = paths.start[0], paths.end[-1]
+        else:
+            entry, exit = paths[0].start, paths[-1].end
+        return self.add(Machine.cut, entry, paths, exit=exit, tool=tool, name=name)
+
+    def fragments(self, m: Machine, processes: Optional[int] = None) -> List[Fragment]:
+        """
+        Renders every operation with m's settings, or takes its fragment from
+        the cache.
+
+        Args:
+          m: Machine whose accuracy and formatting options are used.
+          processes: Number of worker processes, defaults to the number of
+            CPUs. 1 renders everything in this process.
+        """
+        options = _options(m)
+        fragments: List[Optional[Fragment]] = [None] * len(self.operations)
+        keys: List[str] = []
+        if self.cache is not None:
+            keys = [fingerprint(op, options) for op in self.operations]
+            fragments = [self.cache.get(key) for key in keys]
+        missing = [idx for idx, f in enumerate(fragments) if f is None]
+
+        items = [(self.operations[idx], options) for idx in missing]
+        if processes is None:
+            processes = os.cpu_count() or 1
+        processes = min(processes, len(items))
+        if processes <= 1:
+            rendered = [_render(item) for item in items]
+        else:
+            chunksize = max(1, len(items) // (4 * processes))
+            with ProcessPoolExecutor(processes) as executor:
+                rendered = list(executor.map(_render, items, chunksize=chunksize))
+
+        for idx, fragment in zip(missing, rendered):
+            fragments[idx] = fragment
+            if self.cache is not None:
+                self.cache.put(keys[idx], fragment)
+        return cast(List[Fragment], fragments)
+
+    def build(self, m: Machine, processes: Optional[int] = None, reorder: bool = False):
+        """
+        Generates every operation and writes them to m in order, moving
+        between them like gmcode.schedule.run does.
+
+        Args:
+          m: Machine to write to.
+          processes: See fragments.
+          reorder: Put the operations in an order with short rapid moves
+            first, see gmcode.schedule.order.
+        """
+        if reorder:
+            self.operations = order(
+                self.operations, start=m.position, tool=m.tool_number
+            )
+
+        for op, fragment in zip(self.operations, self.fragments(m, processes)):
+            approach(m, op, self.clearance)
+            m._write_block(fragment.text)
+            m.restore(_merge(m.snapshot(), fragment.state))
+
+        m.g0(z=self.clearance)
@@ -1,13 +1,91 @@
+import attr
+import contextlib
 import pathlib
 import math
-from typing import Optional, Dict, List, cast
-from gmcode.geom import Vector, Line, ArcXY, PathElement
+import re
+import numpy as np
+from typing import (
+    Any,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    Optional,
+    Dict,
+    List,
+    Tuple,
+    Union,
+    cast,
+)
+from gmcode.geom import Vector, VectorArray, Line, ArcXY, PathElement, TOLERANCE
+from gmcode.toolpath import Toolpath, ARC
+from gmcode.output import open_sink, DEFAULT_BUFFER_SIZE
+from gmcode.formatter import Formatter
+from gmcode.simplify import simplify as simplify_paths
+from gmcode.instrument import Hook, Instruments
 
 
 class MachineError(RuntimeError):
     pass
 
 
+@attr.s(auto_detect=True, frozen=True, slots=True)  # type: ignore[call-overload]
+class MachineState:
+    """
+    The modal state of a Machine, see Machine.snapshot.
+
+    Attributes:
+      position: Current position.
+      feedrate: Feedrate last written, None if it hasn't been.
+      plane: Plane command last written, eg. "G17".
+      tool_number: Tool in the machine.
+      path_mode: Path mode command last written, eg. "G64 P0.05".
+      unitialised: Axes that haven't been written yet.
+    """
+
+    position: Vector = attr.ib(Vector())
+    feedrate: Optional[float] = attr.ib(None)
+    plane: Optional[str] = attr.ib(None)
+    tool_number: Optional[int] = attr.ib(None)
+    path_mode: Optional[str] = attr.ib(None)
+    unitialised: FrozenSet[str] = attr.ib(frozenset("XYZ"))
+
+
+def _merge(before: MachineState, after: MachineState) -> MachineState:
+    """
+    State after running g-code written from an unknown state, keeping what it
+    didn't set.
+    """
+    return MachineState(
+        position=after.position,
+        feedrate=after.feedrate if after.feedrate is not None else before.feedrate,
+        plane=after.plane if after.plane is not None else before.plane,
+        tool_number=(
+            after.tool_number if after.tool_number is not None else before.tool_number
+        ),
+        path_mode=after.path_mode if after.path_mode is not None else before.path_mode,
+        unitialised=before.unitialised & after.unitialised,
+    )
+
+
+@attr.s(auto_detect=True, frozen=True, slots=True)  # type: ignore[call-overload]
+class Subroutine:
+    """
+    A subroutine written by Machine.subroutine.
+
+    Attributes:
+      name: Name used in the o-word, lower case.
+      displacement: How far the body moves the machine.
+      state: Modal state the body leaves behind, None for anything it
+        doesn't set.
+    """
+
+    name: str = attr.ib()
+    displacement: Vector = attr.ib()
+    state: MachineState = attr.ib()
+
+
+_SUBROUTINE_NAME = re.compile(r"[A-Za-z0-9_]+")
+
 PLANE_COMMANDS = {
     "XY": "G17",
     "ZX": "G18",
@@ -15,9 +93,107 @@ PLANE_COMMANDS = {
 }
 
 
+def _modal_changes(
+    values: np.ndarray,
+    current: float,
+    accuracy: float,
+    first: Optional[int],
+    reset: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, float]:
+    """
+    Works out which of a sequence of requested positions for one axis need to
+    be written out, following the same rules as Machine._xyz_to_command. An
+    axis word is only written when it moves more than accuracy away from the
+    last position written.
+
+    Args:
+      values: Requested positions, nan where there is no request.
+      current: Position before the first request.
+      accuracy: Smallest movement that gets written.
+      first: Index of a request that is always written (for an uninitialised
+        axis), or None.
+      reset: Requests that set the position whether or not they are written,
+        as arcs do.
+
+    Returns:
+      A mask of requests to write, the requests with nan filled in and the
+      position after the last request.
+    """
+    n = len(values)
+    if n == 0:
+        return np.zeros(0, dtype=bool), values, current
+
+    idx = np.arange(n)
+    last_known = np.maximum.accumulate(np.where(np.isnan(values), -1, idx))
+    filled = np.where(last_known >= 0, values[np.maximum(last_known, 0)], current)
+
+    # First guess: compare each request to the one before
+    previous = np.concatenate([[current], filled[:-1]])
+    changed = np.abs(filled - previous) > accuracy
+    if first is not None:
+        changed[first] = True
+
+    # The guess is right if it agrees with a comparison against the position
+    # the guess says was last written
+    updated = changed | reset
+    last_updated = np.maximum.accumulate(np.where(updated, idx, -1))
+    tracked = np.where(last_updated >= 0, filled[np.maximum(last_updated, 0)], current)
+    tracked_before = np.concatenate([[current], tracked[:-1]])
+    actual = np.abs(filled - tracked_before) > accuracy
+    if first is not None:
+        actual[first] = True
+
+    if np.array_equal(changed, actual):
+        return changed, filled, float(tracked[-1])
+
+    # Slow creeping moves, fall back to tracking the position one by one
+    position = current
+    for k, (val, is_reset) in enumerate(zip(values.tolist(), reset.tolist())):
+        if val != val:  # nan
+            val = position
+        if abs(val - position) > accuracy or k == first:
+            changed[k] = True
+            position = val
+        else:
+            changed[k] = False
+            if is_reset:
+                position = val
+
+    return changed, filled, position
+
+
 class Machine:
-    def __init__(self, outfile: pathlib.Path, accuracy=1e-4):
-        self.outfile = open(outfile, "w")
+    # set by instrument
+    instruments: Optional[Instruments] = None
+
+    def __init__(
+        self,
+        outfile: Union[pathlib.Path, Any],
+        accuracy=1e-4,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        strip_zeros: bool = False,
+        format_cache: int = 0,
+        tolerance: float = TOLERANCE,
+    ):
+        """
+        Args:
+          outfile: Where to write g-code. A path (.gz and .zst paths are
+            compressed), an open text or binary stream, a generator or
+            function that is sent each line, or a gmcode.output.Sink.
+          accuracy: Smallest distance that is written to the output.
+          buffer_size: Number of characters collected in memory before being
+            written to outfile. 0 writes every line straight away.
+          strip_zeros: Leave trailing zeros off numbers, eg. X10 instead of
+            X10.0000.
+          format_cache: Number of formatted numbers to remember, see
+            gmcode.formatter.Formatter.
+          tolerance: How far apart the end of one path element and the start
+            of the next can be in cut.
+        """
+        self.outfile = open_sink(outfile, buffer_size)
+        self._strip_zeros = strip_zeros
+        self._format_cache = format_cache
+        self.tolerance = tolerance
         self.position = Vector()
         self.accuracy = accuracy
         self._feedrate: Optional[float] = None
@@ -26,6 +202,7 @@ class Machine:
         self.tool_number: Optional[int] = None
         self._path_mode: Optional[str] = None
         self._unitialised: Dict[str, bool] = {"X": True, "Y": True, "Z": True}
+        self._subroutines: Dict[str, Subroutine] = {}
 
     @property
     def accuracy(self):
@@ -35,6 +212,9 @@ class Machine:
     def accuracy(self, val: float):
         self.places = math.ceil(-math.log10(val))
         self._accuracy = val
+        self.formatter = Formatter(
+            self.places, strip_zeros=self._strip_zeros, cache_size=self._format_cache
+        )
 
     def _queue_state(
         self,
@@ -165,6 +345,42 @@ class Machine:
         if len(strings) > 1:  # ie. don't write an empty command
             self.write(" ".join(strings))
 
+    def _many(self, code: str, points: Union[VectorArray, np.ndarray]):
+
+        if isinstance(points, VectorArray):
+            points = points.data
+        points = np.asarray(points, dtype=np.float64)
+        if points.size == 0:
+            return
+        if points.ndim != 2 or points.shape[1] != 3:
+            raise MachineError(f"Expected an N x 3 array, got shape {points.shape}")
+
+        n = len(points)
+        codes = np.full(n, code, dtype=object)
+        self._emit(codes, points, np.zeros(n, dtype=bool))
+
+    def g0_many(self, points: Union[VectorArray, np.ndarray]):
+        """
+        Rapid moves to each point in turn, written in one batch. Produces the
+        same output as calling g0 for each point.
+
+        Args:
+          points: N x 3 array of absolute coords. nan leaves that axis where
+            it is, like passing None to g0.
+        """
+        self._many("G0", points)
+
+    def g1_many(self, points: Union[VectorArray, np.ndarray]):
+        """
+        Linear moves to each point in turn, written in one batch. Produces the
+        same output as calling g1 for each point.
+
+        Args:
+          points: N x 3 array of absolute coords. nan leaves that axis where
+            it is, like passing None to g1.
+        """
+        self._many("G1", points)
+
     def arc(
         self,
         x: Optional[float] = None,
@@ -213,19 +429,105 @@ class Machine:
             f"J{self.format(j)}",
             f"P{p}" if p != 1 else "",
         ]
-        command = " ".join(command_elms)
+        command = " ".join(e for e in command_elms if e)
         self.write(command)
         self.position = Vector(x, y, z)
 
-    def cut(self, paths: List[PathElement]):
+    def _emit(
+        self,
+        codes: np.ndarray,
+        ends: np.ndarray,
+        is_arc: np.ndarray,
+        centres: Optional[np.ndarray] = None,
+        feeds: Optional[np.ndarray] = None,
+    ):
+        """
+        Writes a batch of moves in one go. Produces the same output as calling
+        feedrate, g0, g1 and arc for each move.
+
+        Args:
+          codes: Object array of "G0", "G1", "G2" or "G3" for each move.
+          ends: N x 3 array of end points, nan for an unchanged axis in a G0
+            or G1.
+          is_arc: Mask of G2 and G3 moves.
+          centres: N x 3 array of arc centres.
+          feeds: Feedrate to set before each move, nan to leave it unchanged.
+        """
+        n = len(codes)
+        if n == 0:
+            return
+
+        fmt = self.format_many
+        no_reset = np.zeros(n, dtype=bool)
+        prefix: Union[str, np.ndarray] = ""
+        if feeds is not None and not np.all(np.isnan(feeds)):
+            first = None
+            current = self._feedrate
+            if current is None:
+                first = int(np.flatnonzero(~np.isnan(feeds))[0])
+                current = float(feeds[first])
+            changed, filled, self._feedrate = _modal_changes(
+                feeds, current, self.accuracy, first, no_reset
+            )
+            prefix = np.full(n, "", dtype=object)
+            prefix[changed] = [f"F{s}\n" for s in fmt(filled[changed].tolist())]
+
+        words = codes.astype(object)
+        has_words = is_arc.copy()
+        not_arc = np.flatnonzero(~is_arc)
+        position = list(self.position)
+        for k, axis in enumerate(["X", "Y", "Z"]):
+            first = None
+            if self._unitialised[axis] and not_arc.size:
+                first = int(not_arc[0])
+                self._unitialised[axis] = False
+
+            changed, filled, position[k] = _modal_changes(
+                ends[:, k], position[k], self.accuracy, first, is_arc
+            )
+            if axis != "Z":
+                changed = changed | is_arc
+            if changed.any():
+                axis_words = np.full(n, "", dtype=object)
+                axis_words[changed] = [
+                    f" {axis}{s}" for s in fmt(filled[changed].tolist())
+                ]
+                words = words + axis_words
+                has_words |= changed
+
+        if centres is not None and is_arc.any():
+            for k, axis in enumerate(["I", "J"]):
+                axis_words = np.full(n, "", dtype=object)
+                axis_words[is_arc] = [
+                    f" {axis}{s}" for s in fmt(centres[is_arc, k].tolist())
+                ]
+                words = words + axis_words
+
+        lines = words + "\n"
+        lines[~has_words] = ""
+        self._write_block("".join((prefix + lines).tolist()))
+        self.position = Vector(*position)
+
+    def cut(self, paths: Union[List[PathElement], Toolpath], simplify: bool = False):
         """
         Cuts a series of lines or arcs (subclasses of PathElement).
 
         Args:
-          paths: A list of paths to cut
+          paths: A list of paths to cut, or a Toolpath. A Toolpath is written
+            out in one batch, and is checked for continuity before anything
+            is written.
+          simplify: Merge runs of lines that are within accuracy of a
+            straight line, see gmcode.simplify.
         """
+        if simplify:
+            paths = simplify_paths(paths, self.accuracy)
+
+        if isinstance(paths, Toolpath):
+            self._cut_toolpath(paths)
+            return
+
         for p in paths:
-            if self.position != p.start:
+            if not self.position.isclose(p.start, self.tolerance):
                 raise MachineError(
                     f"Current position ({self.position}) is not equal to path start position ({p.start})"
                 )
@@ -238,11 +540,141 @@ class Machine:
                     f"cut method does not know how to handle type {type(p)}"
                 )
 
+    def _cut_toolpath(self, path: Toolpath):
+
+        gaps = path.gaps(self.position, self.tolerance)
+        if gaps.size:
+            idx = gaps[0]
+            previous = self.position if idx == 0 else path.end[idx - 1]
+            raise MachineError(
+                f"Toolpath element {idx} starts at {path.start[idx]}, not at {previous}"
+            )
+
+        is_arc = path.kind == ARC
+        codes = np.where(is_arc, np.where(path.cw, "G2", "G3"), "G1")
+        self._emit(codes, path.end.data, is_arc, path.centre.data, path.feed)
+
+    def snapshot(self) -> MachineState:
+        """
+        Returns the current modal state, which can be given to restore.
+        """
+        return MachineState(
+            position=self.position,
+            feedrate=self._feedrate,
+            plane=self._plane,
+            tool_number=self.tool_number,
+            path_mode=self._path_mode,
+            unitialised=frozenset(k for k, v in self._unitialised.items() if v),
+        )
+
+    def restore(self, state: MachineState):
+        """
+        Sets the modal state without writing anything, eg. after g-code for
+        this state has been written some other way.
+        """
+        self.position = state.position
+        self._feedrate = state.feedrate
+        self._plane = state.plane
+        self.tool_number = state.tool_number
+        self._path_mode = state.path_mode
+        self._unitialised = {k: k in state.unitialised for k in "XYZ"}
+
+    @contextlib.contextmanager
+    def subroutine(
+        self, name: str, origin: Optional[Vector] = None
+    ) -> Iterator["Machine"]:
+        """
+        Writes a LinuxCNC o-word subroutine, to be run with call, eg.
+
+            with m.subroutine("hole") as sub:
+                functions.helical_entry(sub, centre, final_height=-3)
+            m.call("hole")
+
+        The body is written with incremental (G91) moves, so calling it
+        somewhere else does the same thing shifted there. Nothing is run
+        until it is called.
+
+        Args:
+          name: Subroutine name, letters, digits and underscores.
+          origin: Position the body is written from, defaults to the current
+            position.
+
+        Yields:
+          A Machine to write the body with. Its feedrate, plane and path mode
+          start unknown, so they are written whenever the body sets them.
+        """
+        if not _SUBROUTINE_NAME.fullmatch(name):
+            raise MachineError(f"{name!r} is not a valid subroutine name")
+        key = name.lower()
+        if key in self._subroutines:
+            raise MachineError(f"Subroutine {name} is already defined")
+
+        body = _IncrementalMachine(
+            self, origin if origin is not None else self.position
+        )
+        if self.instruments is not None:
+            self.instruments.attach(body)
+        self.write(f"o<{key}> sub")
+        body.incremental()
+        yield body
+
+        self.write("G90 ; absolute distance mode")
+        self.write("G90.1 ; arc centre absolute distance mode")
+        self.write(f"o<{key}> endsub")
+        self._subroutines[key] = Subroutine(key, body.displacement(), body.snapshot())
+
+    def call(self, name: str):
+        """
+        Runs a subroutine written by subroutine from the current position.
+        The position and modal state are updated to what the body leaves.
+        """
+        sub = self._subroutines.get(name.lower())
+        if sub is None:
+            raise MachineError(f"Subroutine {name} is not defined")
+        if any(self._unitialised.values()):
+            raise MachineError("The position must be written before a subroutine call")
+
+        self.write(f"o<{sub.name}> call")
+        state = _merge(self.snapshot(), sub.state)
+        self.restore(attr.evolve(state, position=self.position + sub.displacement))
+
+    def instrument(self, *hooks: Hook) -> Instruments:
+        """
+        Starts counting the commands and bytes written, and timing format,
+        _xyz_to_command, write and the operations in gmcode.functions, eg.
+
+            instruments = m.instrument()
+            functions.spiral(m, ...)
+            print(instruments.report())
+            instruments.detach()
+
+        Until this is called nothing is measured and nothing costs any
+        extra. Subroutine bodies are measured along with the machine.
+
+        Args:
+          hooks: Told about each line and timing as it happens, see
+            gmcode.instrument.Hook.
+
+        Returns:
+          The Instruments, with report and detach methods.
+        """
+        if self.instruments is not None:
+            raise MachineError("Machine is already instrumented")
+        instruments = Instruments(hooks)
+        instruments.attach(self)
+        return instruments
+
     def format(self, num: float) -> str:
         """
         Formats a number for gcode output.
         """
-        return f"{num:.{self.places}f}"
+        return self.formatter(num)
+
+    def format_many(self, nums: Iterable[float]) -> List[str]:
+        """
+        Formats many numbers at once, the same as format does each of them.
+        """
+        return self.formatter.many(nums)
 
     def plane(self, plane: str):
         """
@@ -277,6 +709,12 @@ class Machine:
             line += "\n"
         self.outfile.write(line)
 
+    def _write_block(self, text: str):
+        """
+        Writes many lines at once, text must already end in a newline.
+        """
+        self.outfile.write(text)
+
     def comment(self, line: str):
 
         if line.endswith("\n"):
@@ -339,6 +777,150 @@ class Machine:
         """
         self.write("M2")
 
+    def flush(self):
+        """
+        Writes any buffered output through to outfile.
+        """
+        self.outfile.flush()
+
     def close(self):
         self.outfile.close()
         self.outfile = None
+
+    def __enter__(self) -> "Machine":
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        self.close()
+
+
+class _IncrementalMachine(Machine):
+    """
+    Writes the body of a subroutine with incremental moves and arc centres,
+    see Machine.subroutine.
+
+    Positions are still absolute as far as the methods are concerned. Each
+    move is written as the difference between rounded positions, so the
+    rounding errors don't add up however long the body is.
+    """
+
+    def __init__(self, parent: Machine, origin: Vector):
+        super().__init__(
+            parent.outfile,
+            accuracy=parent.accuracy,
+            buffer_size=0,
+            strip_zeros=parent._strip_zeros,
+            format_cache=parent._format_cache,
+            tolerance=parent.tolerance,
+        )
+        self._subroutines = parent._subroutines
+        self.restore(MachineState(position=origin, unitialised=frozenset()))
+        self._origin = self._rounded(origin)
+        self._written = self._origin
+
+    def _rounded(self, v: Vector) -> Vector:
+
+        return Vector(*(float(self.format(c)) for c in v))
+
+    def incremental(self):
+
+        self.write("G91 ; incremental distance mode")
+        self.write("G91.1 ; arc centre incremental distance mode")
+
+    def displacement(self) -> Vector:
+        """
+        How far the body has moved the machine, in rounded coordinates.
+        """
+        return self._rounded(self._written - self._origin)
+
+    def _xyz_to_command(
+        self,
+        x: Optional[float] = None,
+        y: Optional[float] = None,
+        z: Optional[float] = None,
+    ):
+        previous = self._written
+        super()._xyz_to_command(x, y, z)
+        self._written = self._rounded(self.position)
+        return [
+            f"{axis}{self.format(b - a)}"
+            for axis, a, b in zip("XYZ", previous, self._written)
+            if b != a
+        ]
+
+    def arc(
+        self,
+        x: Optional[float] = None,
+        y: Optional[float] = None,
+        z: Optional[float] = None,
+        i: Optional[float] = None,
+        j: Optional[float] = None,
+        cw: bool = True,
+        p: int = 1,
+    ):
+        if i is None or j is None:
+            raise MachineError("arc centre must be specified")
+
+        end = Vector(
+            self.position.x if x is None else x,
+            self.position.y if y is None else y,
+            self.position.z if z is None else z,
+        )
+        start = self._written
+        written = self._rounded(end)
+        command_elms = [
+            "G2" if cw else "G3",
+            f"X{self.format(written.x - start.x)}",
+            f"Y{self.format(written.y - start.y)}",
+            (
+                f"Z{self.format(written.z - start.z)}"
+                if abs(end.z - self.position.z) > self.accuracy
+                else ""
+            ),
+            f"I{self.format(i - start.x)}",
+            f"J{self.format(j - start.y)}",
+            f"P{p}" if p != 1 else "",
+        ]
+        self.write(" ".join(e for e in command_elms if e))
+        self.position = end
+        self._written = written
+
+    def _emit(
+        self,
+        codes: np.ndarray,
+        ends: np.ndarray,
+        is_arc: np.ndarray,
+        centres: Optional[np.ndarray] = None,
+        feeds: Optional[np.ndarray] = None,
+    ):
+        # each move depends on the rounded position before it, so they are
+        # written one at a time
+        for k, code in enumerate(codes.tolist()):
+            if feeds is not None and not math.isnan(feeds[k]):
+                self.feedrate(float(feeds[k]))
+            x, y, z = (None if math.isnan(v) else v for v in ends[k].tolist())
+            if is_arc[k]:
+                centre = cast(np.ndarray, centres)[k]
+                self.arc(x, y, z, i=centre[0], j=centre[1], cw=code == "G2")
+            elif code == "G0":
+                self.g0(x, y, z)
+            else:
+                self.g1(x, y, z)
+
+    def subroutine(self, name: str, origin: Optional[Vector] = None):
+
+        raise MachineError("Subroutines can not be defined inside a subroutine")
+
+    def call(self, name: str):
+
+        super().call(name)
+        self._written = self._rounded(
+            self._written + self._subroutines[name.lower()].displacement
+        )
+        self.incremental()  # the subroutine ends in absolute mode
+
+    def close(self):
+
+        pass
@@ -0,0 +1,196 @@
+"""
+The material left in a pocket as it is cleared.
+
+Material is a raster of square cells over a region, each one either full of
+material or cleared. Cutting clears the cells whose centres a tool passes
+over, and engagement looks up how much of the edge of a moving tool is in
+material, which is what adaptive clearing needs to keep the load on a tool
+even. Every lookup only touches the cells near the tool, so the cost of a
+move does not depend on the size of the pocket.
+"""
+
+import math
+import numpy as np
+from typing import Sequence, Tuple
+from gmcode.offset import Region
+
+# points around the front half of a tool that engagement looks at
+_EDGE_POINTS = 24
+# earlier points of a move, every other one, that engagement checks the tool
+# has passed over
+_LOOK_BACK = 32
+# cell and segment pairs that cut measures at once
+_CUT_BATCH = 1 << 18
+
+
+def _inside(
+    loops: Sequence[np.ndarray], origin: np.ndarray, resolution: float, shape: tuple
+) -> np.ndarray:
+    """
+    Which cell centres are inside the loops, by the even-odd rule.
+    """
+    rows, cols = shape
+    a = np.vstack(loops)
+    b = np.vstack([np.roll(loop, -1, axis=0) for loop in loops])
+
+    # each edge crosses the rows with centres in [low y, high y)
+    first = np.ceil((np.minimum(a[:, 1], b[:, 1]) - origin[1]) / resolution - 0.5)
+    last = np.ceil((np.maximum(a[:, 1], b[:, 1]) - origin[1]) / resolution - 0.5)
+    count = (last - first).astype(np.intp)
+    edge = np.repeat(np.arange(len(a)), count)
+    row = np.repeat(first.astype(np.intp), count) + (
+        np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+    )
+    y = origin[1] + (row + 0.5) * resolution
+    t = (y - a[edge, 1]) / (b[edge, 1] - a[edge, 1])
+    x = a[edge, 0] + t * (b[edge, 0] - a[edge, 0])
+
+    # crossings pair up along each row, the cells between a pair are inside
+    order = np.lexsort((x, row))
+    row, x = row[order], x[order]
+    col = np.ceil((x - origin[0]) / resolution - 0.5).astype(np.intp)
+    fill = np.zeros((rows, cols + 1), dtype=np.int32)
+    np.add.at(fill, (row[0::2], col[0::2]), 1)
+    np.add.at(fill, (row[1::2], col[1::2]), -1)
+    return np.cumsum(fill, axis=1)[:, :cols] > 0
+
+
+class Material:
+    """
+    The material left inside a region, as a raster of cells.
+
+    Args:
+      region: Area that starts out full of material.
+      resolution: Width of the cells.
+    """
+
+    def __init__(self, region: Region, resolution: float):
+        if resolution <= 0:
+            raise ValueError("resolution must be positive")
+
+        self.resolution = resolution
+        if region.loops:
+            corners = np.vstack(region.loops)
+            lo, hi = corners.min(axis=0), corners.max(axis=0)
+        else:
+            lo = hi = np.zeros(2)
+        self.origin = lo - resolution
+        cols, rows = np.ceil((hi - lo) / resolution).astype(np.intp) + 2
+        self.cells = (
+            _inside(region.loops, self.origin, resolution, (rows, cols))
+            if region.loops
+            else np.zeros((rows, cols), dtype=bool)
+        )
+        self.initial = self.area
+
+    @property
+    def area(self) -> float:
+        """
+        Area of the material left.
+        """
+        return float(np.count_nonzero(self.cells)) * self.resolution**2
+
+    def _window(
+        self, lo: np.ndarray, hi: np.ndarray
+    ) -> Tuple[slice, slice, np.ndarray, np.ndarray]:
+        """
+        The cells with centres between lo and hi, and their centres.
+        """
+        start = np.ceil((lo - self.origin) / self.resolution - 0.5).astype(np.intp)
+        stop = np.floor((hi - self.origin) / self.resolution - 0.5).astype(np.intp) + 1
+        start = np.clip(start, 0, self.cells.shape[::-1])
+        stop = np.clip(stop, 0, self.cells.shape[::-1])
+        xs = self.origin[0] + (np.arange(start[0], stop[0]) + 0.5) * self.resolution
+        ys = self.origin[1] + (np.arange(start[1], stop[1]) + 0.5) * self.resolution
+        return slice(start[1], stop[1]), slice(start[0], stop[0]), xs, ys
+
+    def present(self, points: np.ndarray) -> np.ndarray:
+        """
+        Whether there is material at each point, N x 2.
+        """
+        points = np.asarray(points, dtype=np.float64)
+        index = np.floor((points - self.origin) / self.resolution).astype(np.intp)
+        col, row = index[..., 0], index[..., 1]
+        rows, cols = self.cells.shape
+        valid = (row >= 0) & (row < rows) & (col >= 0) & (col < cols)
+        out = np.zeros(points.shape[:-1], dtype=bool)
+        out[valid] = self.cells[row[valid], col[valid]]
+        return out
+
+    def cut(self, points: np.ndarray, tool_radius: float):
+        """
+        Clears the material a tool of tool_radius removes moving along
+        straight lines through points, N x 2.
+        """
+        points = np.asarray(points, dtype=np.float64)[:, :2]
+        rows, cols, xs, ys = self._window(
+            points.min(axis=0) - tool_radius, points.max(axis=0) + tool_radius
+        )
+        if not len(xs) or not len(ys):
+            return
+        x, y = np.meshgrid(xs, ys)
+        cells = np.stack([x.ravel(), y.ravel()], axis=1)[self.cells[rows, cols].ravel()]
+        if not len(cells):
+            return
+
+        a = points[:-1] if len(points) > 1 else points
+        ab = points[1:] - a if len(points) > 1 else np.zeros((1, 2))
+        length = np.maximum(np.sum(ab * ab, axis=1), 1e-300)
+        cleared = np.zeros(len(cells), dtype=bool)
+        batch = max(_CUT_BATCH // len(cells), 1)
+        for first in range(0, len(a), batch):
+            ap = cells[:, None, :] - a[None, first : first + batch]
+            t = np.sum(ap * ab[None, first : first + batch], axis=2)
+            t = np.clip(t / length[first : first + batch], 0, 1)
+            gap = ap - t[:, :, None] * ab[None, first : first + batch]
+            cleared |= np.any(
+                gap[..., 0] ** 2 + gap[..., 1] ** 2 <= tool_radius**2, axis=1
+            )
+
+        window = self.cells[rows, cols]  # a view, so this clears the cells
+        window[window] = ~cleared
+
+    def cut_circle(self, centre: np.ndarray, radius: float, tool_radius: float):
+        """
+        Clears the material a tool of tool_radius removes going once around a
+        circle.
+        """
+        centre = np.asarray(centre, dtype=np.float64)[:2]
+        reach = radius + tool_radius
+        rows, cols, xs, ys = self._window(centre - reach, centre + reach)
+        if not len(xs) or not len(ys):
+            return
+        distance = np.hypot(xs[None, :] - centre[0], ys[:, None] - centre[1])
+        inside = (distance <= reach) & (distance >= radius - tool_radius)
+        self.cells[rows, cols] &= ~inside
+
+    def engagement(self, points: np.ndarray, tool_radius: float) -> np.ndarray:
+        """
+        How much of a tool is in material as it moves through points, N x 2,
+        in small steps. Nothing is cut.
+
+        Returns:
+          For each step, the angle of the front of the tool that is cutting,
+          in radians: 0 in air, pi in a full width slot and
+          acos(1 - w / tool_radius) taking a cut w wide off a straight wall.
+        """
+        points = np.asarray(points, dtype=np.float64)[:, :2]
+        if len(points) < 2:
+            return np.zeros(0)
+        heading = points[1:] - points[:-1]
+        heading = np.arctan2(heading[:, 1], heading[:, 0])
+        phi = (np.arange(_EDGE_POINTS) + 0.5) / _EDGE_POINTS * math.pi - math.pi / 2
+        angles = heading[:, None] + phi[None, :]
+        reach = tool_radius - self.resolution / 2
+        edge = points[1:, None, :] + reach * np.stack(
+            [np.cos(angles), np.sin(angles)], axis=2
+        )
+
+        # material the tool has already passed over on the way is not there
+        # any more, so only the edge outside its earlier positions is cutting
+        step, k = np.nonzero(self.present(edge))
+        before = step[:, None] - 2 * np.arange(_LOOK_BACK)[None, :]
+        gap = edge[step, k, None, :] - points[np.maximum(before, 0)]
+        fresh = np.all(gap[..., 0] ** 2 + gap[..., 1] ** 2 > reach**2, axis=1)
+        count = np.bincount(step[fresh], minlength=len(edge))
+        return math.pi * count / _EDGE_POINTS
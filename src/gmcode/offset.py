@@ -0,0 +1,731 @@
+"""
+Offsetting closed XY contours.
+
+Contours are handled as polygons: arcs are split into lines within a
+tolerance first, and offsets can be turned back into arcs with gmcode.fit. A
+region is an outline and any number of islands inside it, and offsetting it
+moves every boundary at once, so islands grow as the outline shrinks.
+
+An offset is made the usual way. Every edge is moved sideways by the offset
+distance, with round joins where neighbouring edges move apart, and
+neighbouring edges that overlap are cut back to where they cross. That raw
+curve loops back over itself at corners and narrow places, so it is split
+wherever it crosses itself, every piece that is closer to the region's
+boundary than the offset distance is thrown away, and the rest are joined
+back up into loops. A grid of cells over the edges is used to find the
+crossings and distances, so only nearby edges are ever compared and
+contours with thousands of elements offset quickly.
+"""
+
+import math
+import numpy as np
+from typing import Dict, List, Sequence, Tuple, Union
+from gmcode.geom import Line, ArcXY, PathElement, VectorArray
+from gmcode.toolpath import Toolpath
+from gmcode.fit import fit_points
+
+Contour = Union[Toolpath, Sequence[PathElement], VectorArray, np.ndarray]
+
+
+def _arc_points(element: ArcXY, tolerance: float) -> np.ndarray:
+    """
+    Points along an arc, not including its start, with lines between them
+    within tolerance of it.
+    """
+    centre = np.array([element.centre.x, element.centre.y])
+    start = np.array([element.start.x, element.start.y]) - centre
+    end = np.array([element.end.x, element.end.y]) - centre
+    radius = element.radius()
+    if radius < tolerance:
+        return end[None, :] + centre
+
+    a0 = math.atan2(start[1], start[0])
+    a1 = math.atan2(end[1], end[0])
+    if element.cw:
+        sweep = -((a0 - a1) % (2 * math.pi)) or -2 * math.pi
+    else:
+        sweep = (a1 - a0) % (2 * math.pi) or 2 * math.pi
+
+    step = 2 * math.acos(max(1 - tolerance / radius, -1))
+    n = max(math.ceil(abs(sweep) / step), 1)
+    angles = a0 + sweep * np.arange(1, n + 1) / n
+    points = centre + radius * np.stack([np.cos(angles), np.sin(angles)], axis=1)
+    points[-1] = end + centre
+    return points
+
+
+def contour(paths: Contour, tolerance: float = 1e-4) -> np.ndarray:
+    """
+    The corners of a closed contour as a polygon.
+
+    Args:
+      paths: A closed loop of Lines and ArcXYs, a Toolpath, or an N x 2 or
+        N x 3 array of corners. Z is ignored.
+      tolerance: Largest allowable distance between an arc and the lines
+        that replace it.
+
+    Returns:
+      An N x 2 array of corners, without the first one repeated at the end.
+    """
+    if isinstance(paths, Toolpath):
+        paths = paths.to_elements()
+    if isinstance(paths, VectorArray):
+        paths = paths.data
+
+    if isinstance(paths, np.ndarray):
+        points = np.asarray(paths, dtype=np.float64)[:, :2]
+    else:
+        pieces = []
+        for element in paths:
+            if isinstance(element, ArcXY):
+                pieces.append(_arc_points(element, tolerance))
+            elif isinstance(element, Line):
+                pieces.append(np.array([[element.end.x, element.end.y]]))
+            else:
+                raise TypeError(f"Can not offset {type(element)}")
+        points = np.vstack(pieces) if pieces else np.zeros((0, 2))
+
+    if len(points):
+        # corners that are on top of the one before don't go anywhere
+        moved = np.hypot(*(points - np.roll(points, 1, axis=0)).T) > tolerance / 100
+        points = points[moved] if moved.any() else points[:1]
+    return points
+
+
+def _signed_area(points: np.ndarray) -> float:
+
+    x, y = points[:, 0], points[:, 1]
+    return float(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y)) / 2
+
+
+def _oriented(points: np.ndarray, ccw: bool) -> np.ndarray:
+
+    return points if (_signed_area(points) > 0) == ccw else points[::-1]
+
+
+def _cross(u: np.ndarray, v: np.ndarray) -> np.ndarray:
+
+    return u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]
+
+
+def _point_segment_distances(p: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Distances from rows of points to rows of segments.
+    """
+    ab = b - a
+    length2 = np.einsum("ij,ij->i", ab, ab)
+    t = np.einsum("ij,ij->i", p - a, ab) / np.where(length2 > 0, length2, 1)
+    nearest = a + np.clip(t, 0, 1)[:, None] * ab
+    return np.hypot(*(p - nearest).T)
+
+
+def _segment_distances(
+    a: np.ndarray, b: np.ndarray, c: np.ndarray, d: np.ndarray
+) -> np.ndarray:
+    """
+    Distances between rows of segments a-b and c-d.
+    """
+    ends = np.minimum.reduce(
+        [
+            _point_segment_distances(a, c, d),
+            _point_segment_distances(b, c, d),
+            _point_segment_distances(c, a, b),
+            _point_segment_distances(d, a, b),
+        ]
+    )
+    r = b - a
+    s = d - c
+    denom = _cross(r, s)
+    safe = np.where(denom != 0, denom, 1)
+    t = _cross(c - a, s) / safe
+    u = _cross(c - a, r) / safe
+    crossing = (denom != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+    return np.where(crossing, 0.0, ends)
+
+
+class _SegmentGrid:
+    """
+    A uniform grid of cells, each listing the segments whose bounding boxes
+    touch it.
+
+    Args:
+      a: Start of each segment, N x 2.
+      b: End of each segment, N x 2.
+      cell: Cell size.
+    """
+
+    def __init__(self, a: np.ndarray, b: np.ndarray, cell: float):
+        self.a = a
+        self.b = b
+        self.cell = cell
+        self.origin = np.minimum(a, b).min(axis=0) if len(a) else np.zeros(2)
+        c0 = self._cells(np.minimum(a, b))
+        c1 = self._cells(np.maximum(a, b))
+        self.shape = c1.max(axis=0) + 1 if len(a) else np.ones(2, dtype=np.intp)
+        segment, cells = self._expand(c0, c1)
+        order = np.argsort(cells, kind="stable")
+        self.cells = cells[order]
+        self.segments = segment[order]
+
+    def _cells(self, points: np.ndarray) -> np.ndarray:
+
+        return np.floor((points - self.origin) / self.cell).astype(np.intp)
+
+    def _expand(self, c0: np.ndarray, c1: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Every (item, cell id) for items covering the boxes of cells c0 to c1.
+        """
+        c0 = np.clip(c0, 0, self.shape - 1)
+        c1 = np.clip(c1, 0, self.shape - 1)
+        size = c1 - c0 + 1
+        counts = size[:, 0] * size[:, 1]
+        item = np.repeat(np.arange(len(c0)), counts)
+        local = np.arange(len(item)) - np.repeat(np.cumsum(counts) - counts, counts)
+        width = size[item, 0]
+        x = c0[item, 0] + local % width
+        y = c0[item, 1] + local // width
+        return item, x * self.shape[1] + y
+
+    def pairs(self) -> np.ndarray:
+        """
+        Pairs of segments (i < j) that share a cell, M x 2.
+        """
+        found = [np.zeros((0, 2), dtype=np.intp)]
+        k = 1
+        while k < len(self.cells):
+            same = self.cells[k:] == self.cells[:-k]
+            if not same.any():
+                break
+            found.append(
+                np.stack([self.segments[:-k][same], self.segments[k:][same]], axis=1)
+            )
+            k += 1
+
+        pairs = np.sort(np.vstack(found), axis=1)
+        pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+        return np.unique(pairs, axis=0)
+
+    def near(self, lo: np.ndarray, hi: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Candidate (box, segment) pairs for boxes from lo to hi, M x 2 each.
+        Every segment that touches a box is included, and some that don't.
+        """
+        if len(self.cells) == 0:
+            empty = np.zeros(0, dtype=np.intp)
+            return empty, empty
+
+        c0 = self._cells(lo)
+        c1 = self._cells(hi)
+        outside = np.any((c1 < 0) | (c0 >= self.shape), axis=1)
+        box, cells = self._expand(c0, c1)
+        keep = ~outside[box]
+        return self._lookup(box[keep], cells[keep])
+
+    def _lookup(
+        self, box: np.ndarray, cells: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Every (box, segment) for the segments listed in each of cells.
+        """
+        first = np.searchsorted(self.cells, cells, side="left")
+        last = np.searchsorted(self.cells, cells, side="right")
+        counts = last - first
+        box = np.repeat(box, counts)
+        index = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(
+            counts.sum()
+        )
+        return box, self.segments[index]
+
+    def distances(self, points: np.ndarray, radius: float) -> np.ndarray:
+        """
+        Distance from each point to the nearest segment, or inf if that is
+        more than radius.
+        """
+        out = np.full(len(points), np.inf)
+        for first in range(0, len(points), _CHUNK):
+            chunk = points[first : first + _CHUNK]
+            box, segment = self.near(chunk - radius, chunk + radius)
+            found = _point_segment_distances(
+                chunk[box], self.a[segment], self.b[segment]
+            )
+            np.minimum.at(out, box + first, found)
+        out[out > radius] = np.inf
+        return out
+
+    def segment_distance(self, a: np.ndarray, b: np.ndarray, radius: float) -> float:
+        """
+        Distance from segment a-b to the nearest segment, or inf if that is
+        more than radius.
+        """
+        box, segment = self.near(
+            np.minimum(a, b)[None, :] - radius, np.maximum(a, b)[None, :] + radius
+        )
+        if len(segment) == 0:
+            return math.inf
+        n = len(segment)
+        found = _segment_distances(
+            np.broadcast_to(a, (n, 2)),
+            np.broadcast_to(b, (n, 2)),
+            self.a[segment],
+            self.b[segment],
+        )
+        return float(found.min())
+
+
+_CHUNK = 1024  # points looked up at once, to limit memory use
+_GROUP = 16  # consecutive segments looked up together by Region.within
+
+
+def _cell_size(a: np.ndarray, b: np.ndarray, minimum: float) -> float:
+
+    lengths = np.hypot(*(b - a).T)
+    return max(float(np.median(lengths)) if len(lengths) else 0.0, minimum)
+
+
+class Region:
+    """
+    An area bounded by an outline, with holes for any islands.
+
+    Args:
+      outline: Closed contour around the region, see contour.
+      islands: Closed contours inside the outline.
+      tolerance: Largest allowable distance between arcs and the lines that
+        replace them, and between offsets and their exact positions.
+    """
+
+    def __init__(
+        self,
+        outline: Contour,
+        islands: Sequence[Contour] = (),
+        tolerance: float = 1e-4,
+    ):
+        self.tolerance = tolerance
+        # the region is always on the left of its boundaries
+        self.loops = [_oriented(contour(outline, tolerance / 2), ccw=True)]
+        self.loops += [
+            _oriented(contour(island, tolerance / 2), ccw=False) for island in islands
+        ]
+        self.loops = [loop for loop in self.loops if len(loop) >= 3]
+        self._a, self._b = self._segments(self.loops)
+        self._cell = _cell_size(self._a, self._b, tolerance)
+        self._grids: Dict[Tuple[float, bool], _SegmentGrid] = {}
+
+    @staticmethod
+    def _segments(loops: Sequence[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+
+        if not loops:
+            return np.zeros((0, 2)), np.zeros((0, 2))
+        a = np.vstack(loops)
+        b = np.vstack([np.roll(loop, -1, axis=0) for loop in loops])
+        return a, b
+
+    def _grid(self, radius: float, grouped: bool = False) -> _SegmentGrid:
+        """
+        A grid over the boundary with cells not much smaller than radius.
+        If grouped, it lists runs of _GROUP segments by the boxes around
+        them in place of single segments.
+        """
+        scale = 2 ** max(math.ceil(math.log2(radius / 2 / self._cell)), 0)
+        cell = self._cell * scale
+        if (cell, grouped) not in self._grids:
+            if grouped:
+                starts = np.arange(0, len(self._a), _GROUP)
+                lo = np.minimum.reduceat(np.minimum(self._a, self._b), starts)
+                hi = np.maximum.reduceat(np.maximum(self._a, self._b), starts)
+                grid = _SegmentGrid(lo, hi, cell)
+            else:
+                grid = _SegmentGrid(self._a, self._b, cell)
+            self._grids[cell, grouped] = grid
+        return self._grids[cell, grouped]
+
+    def distances(self, points: np.ndarray, radius: float) -> np.ndarray:
+        """
+        Distance from each point to the boundary, inf where it is more than
+        radius.
+
+        Points are looked up within a small radius first, which is enough for
+        the ones close to the boundary, and the radius is doubled for the
+        rest, so there are never many segments to compare each point to.
+        """
+        points = np.asarray(points, dtype=np.float64)
+        out = np.full(len(points), np.inf)
+        todo = np.arange(len(points))
+        search = min(radius, 4 * self._cell)
+        while len(todo):
+            found = self._grid(search).distances(points[todo], search)
+            out[todo] = found
+            if search >= radius:
+                break
+            todo = todo[np.isinf(found)]
+            search = min(2 * search, radius)
+        return out
+
+    def within(self, points: np.ndarray, limit: Union[float, np.ndarray]) -> np.ndarray:
+        """
+        Whether each point is closer than limit to the boundary, with limit
+        either one distance or one for each point.
+
+        Runs of _GROUP segments are looked up in place of single segments. A
+        run with a corner closer than the limit settles the point without
+        looking further, a run whose box is no closer is skipped, and only
+        the rest are compared segment by segment. Like distances, the search
+        starts small and grows for the points that aren't settled yet.
+        """
+        points = np.asarray(points, dtype=np.float64)
+        limit = np.broadcast_to(np.asarray(limit, dtype=np.float64), len(points))
+        out = np.zeros(len(points), dtype=bool)
+        todo = np.flatnonzero(limit > 0) if len(self._a) else np.zeros(0, np.intp)
+        search = 4 * self._cell
+        while len(todo):
+            grid = self._grid(search, grouped=True)
+            for first in range(0, len(todo), _CHUNK):
+                index = todo[first : first + _CHUNK]
+                self._within(grid, search, index, points, limit, out)
+            todo = todo[~out[todo] & (limit[todo] > search)]
+            search *= 2
+        return out
+
+    def _within(
+        self,
+        grid: _SegmentGrid,
+        search: float,
+        index: np.ndarray,
+        points: np.ndarray,
+        limit: np.ndarray,
+        out: np.ndarray,
+    ) -> None:
+        """
+        Mark the points at index that are closer than their limits to a run
+        of segments from grid no further than search away.
+        """
+        chunk, close = points[index], limit[index]
+        reach = np.minimum(close, search)[:, None]
+        box, run = grid.near(chunk - reach, chunk + reach)
+        p, bound = chunk[box], close[box]
+        corner = np.hypot(*(p - self._a[run * _GROUP]).T) < bound
+        out[index[box[corner]]] = True
+
+        gap = np.maximum(np.maximum(grid.a[run] - p, p - grid.b[run]), 0)
+        unsure = (np.hypot(*gap.T) < bound) & ~out[index[box]]
+        box = np.repeat(box[unsure], _GROUP)
+        segment = np.repeat(run[unsure] * _GROUP, _GROUP) + np.tile(
+            np.arange(_GROUP), unsure.sum()
+        )
+        real = segment < len(self._a)
+        box, segment = box[real], segment[real]
+        found = _point_segment_distances(chunk[box], self._a[segment], self._b[segment])
+        out[index[box[found < close[box]]]] = True
+
+    def clearance(self, a: np.ndarray, b: np.ndarray, radius: float) -> float:
+        """
+        Distance from the segment a-b to the boundary, inf if it is more
+        than radius.
+        """
+        return self._grid(radius).segment_distance(
+            np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64), radius
+        )
+
+    def _raw(self, loop: np.ndarray, distance: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The corners of loop moved left by distance, with joins.
+
+        Returns:
+          The corners, N x 2, and for the segment from each corner to the
+          next the corner of loop it goes around if it is part of a round
+          join, or NaN.
+        """
+        following_corners = np.roll(loop, -1, axis=0)
+        edges = following_corners - loop
+        lengths = np.hypot(*edges.T)
+        tangents = edges / lengths[:, None]
+        normals = np.stack([-tangents[:, 1], tangents[:, 0]], axis=1)
+        starts = loop + distance * normals
+        ends = following_corners + distance * normals
+
+        # join edge i to edge i + 1 around corner i + 1
+        following = np.roll(normals, -1, axis=0)
+        cos = np.sum(normals * following, 1)
+        sweep = np.arctan2(_cross(normals, following), cos)
+        radius = abs(distance)
+        step = 2 * math.acos(max(1 - self.tolerance / 2 / radius, -1))
+        outside = sweep * distance < 0
+        round_join = outside & (np.abs(sweep) > step / 2)
+        steps = np.where(round_join, np.ceil(np.abs(sweep) / step), 1).astype(np.intp)
+
+        # where the offset edges overlap they are cut back to the point where
+        # they cross, if neither is cut back past its other end
+        with np.errstate(divide="ignore", invalid="ignore"):
+            back = np.where(outside, 0, radius * np.tan(np.abs(sweep) / 2))
+            room = np.roll(back, 1) + back <= lengths
+            mitre = ~outside & room & np.roll(room, -1)
+            mitres = (
+                following_corners[mitre]
+                + distance
+                * (normals[mitre] + following[mitre])
+                / (1 + cos[mitre])[:, None]
+            )
+        ends[mitre] = mitres
+        starts[(np.flatnonzero(mitre) + 1) % len(loop)] = mitres
+
+        # each edge is its start, its end, then the inside of its join
+        sizes = steps + 1
+        offsets = np.cumsum(sizes) - sizes
+        out = np.empty((int(sizes.sum()), 2))
+        around = np.full_like(out, np.nan)
+        out[offsets] = starts
+        out[offsets + 1] = ends
+        around[offsets[outside] + 1] = following_corners[outside]
+        edge = np.repeat(np.arange(len(loop)), steps - 1)
+        if len(edge):
+            k = np.arange(len(edge)) - np.repeat(
+                np.cumsum(steps - 1) - (steps - 1), steps - 1
+            )
+            angle = np.arctan2(normals[edge, 1], normals[edge, 0])
+            angle += sweep[edge] * (k + 1) / steps[edge]
+            centre = following_corners[edge]
+            out[offsets[edge] + 2 + k] = centre + distance * np.stack(
+                [np.cos(angle), np.sin(angle)], axis=1
+            )
+            around[offsets[edge] + 2 + k] = centre
+
+        apart = np.any(out != np.roll(out, 1, axis=0), axis=1)
+        if not apart.any():
+            apart[0] = True
+        return out[apart], around[apart]
+
+    def offset(self, distance: float) -> List[np.ndarray]:
+        """
+        The boundaries of the region shrunk by distance, or grown if it is
+        negative.
+
+        Returns:
+          Corners of each loop, N x 2, in the same form as Region.loops:
+          outlines anticlockwise and islands clockwise.
+        """
+        if distance == 0:
+            return [loop.copy() for loop in self.loops]
+        if not self.loops:
+            return []
+
+        raws = [self._raw(loop, distance) for loop in self.loops]
+        sizes = np.array([len(raw) for raw, _ in raws])
+        first = np.repeat(np.cumsum(sizes) - sizes, sizes)
+        index = np.arange(sizes.sum())
+        following = np.where(
+            index + 1 - first == np.repeat(sizes, sizes), first, index + 1
+        )
+        points = np.vstack([raw for raw, _ in raws])
+        around = np.vstack([centres for _, centres in raws])
+        a, b = points, points[following]
+
+        # segments that are too close to the boundary all the way along can
+        # only give pieces that are thrown away
+        half = np.hypot(*(b - a).T) / 2
+        keep = ~self.within((a + b) / 2, abs(distance) - self.tolerance - half)
+        if not keep.any():
+            return []
+        a, b, around = a[keep], b[keep], around[keep]
+        renumber = np.full(len(keep), -1)
+        renumber[keep] = np.arange(len(a))
+        following = renumber[following[keep]]
+        index = np.arange(len(a))
+
+        # split the raw curve where it crosses itself
+        grid = _SegmentGrid(a, b, _cell_size(a, b, abs(distance) / 4))
+        pairs = grid.pairs()
+        i, j = pairs[:, 0], pairs[:, 1]
+        neighbours = (following[i] == j) | (following[j] == i)
+        i, j = i[~neighbours], j[~neighbours]
+        r = b[i] - a[i]
+        s = b[j] - a[j]
+        denom = _cross(r, s)
+        safe = np.where(denom != 0, denom, 1)
+        t = _cross(a[j] - a[i], s) / safe
+        u = _cross(a[j] - a[i], r) / safe
+        crossing = (denom != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+        i, j, t, u = i[crossing], j[crossing], t[crossing], u[crossing]
+        at = a[i] + t[:, None] * r[crossing]
+
+        segment = np.concatenate([index, i, j, index])
+        position = np.concatenate([np.full(len(a), -1.0), t, u, np.full(len(a), 2.0)])
+        split = np.vstack([a, at, at, b])
+        order = np.lexsort((position, segment))
+        segment, split = segment[order], split[order]
+        same = segment[:-1] == segment[1:]
+        starts, ends = split[:-1][same], split[1:][same]
+        moved = np.any(starts != ends, axis=1)
+        starts, ends = starts[moved], ends[moved]
+        centres = around[segment[:-1][same][moved]]
+
+        # keep the pieces that are as far from the boundary as they should
+        # be, judging pieces of round joins by the arc they stand in for
+        middles = (starts + ends) / 2
+        joins = ~np.isnan(centres[:, 0])
+        outward = middles[joins] - centres[joins]
+        middles[joins] = centres[joins] + abs(distance) * (
+            outward / np.hypot(*outward.T)[:, None]
+        )
+        keep = ~self.within(middles, abs(distance) - 1e-3 * self.tolerance)
+        return self._join(starts[keep], ends[keep])
+
+    def _join(self, starts: np.ndarray, ends: np.ndarray) -> List[np.ndarray]:
+        """
+        Links pieces end to start into closed loops.
+        """
+        following: Dict[Tuple[float, float], List[int]] = {}
+        for k, point in enumerate(map(tuple, starts.tolist())):
+            following.setdefault(point, []).append(k)
+
+        used = np.zeros(len(starts), dtype=bool)
+        loops = []
+        for first in range(len(starts)):
+            if used[first]:
+                continue
+            chain = [first]
+            used[first] = True
+            current = first
+            while True:
+                candidates = following.get(tuple(ends[current].tolist()), [])
+                nxt = next((k for k in candidates if not used[k] or k == first), None)
+                if nxt is None:
+                    # rounding can leave a crossing split into two points
+                    gap = np.hypot(*(starts - ends[current]).T)
+                    gap[used & (np.arange(len(starts)) != first)] = np.inf
+                    nearest = int(np.argmin(gap))
+                    if gap[nearest] > self.tolerance:
+                        break
+                    nxt = nearest
+                if nxt == first:
+                    loop = starts[chain]
+                    apart = np.hypot(*(loop - np.roll(loop, 1, axis=0)).T)
+                    loop = loop[apart > self.tolerance / 4]
+                    if len(loop) >= 3 and abs(_signed_area(loop)) > self.tolerance**2:
+                        loops.append(loop)
+                    break
+                chain.append(nxt)
+                used[nxt] = True
+                current = nxt
+
+        return loops
+
+
+def offset(
+    outline: Contour,
+    distance: float,
+    islands: Sequence[Contour] = (),
+    tolerance: float = 1e-4,
+) -> List[np.ndarray]:
+    """
+    Offsets a region's boundaries, see Region.offset.
+
+    Args:
+      outline: Closed contour around the region.
+      distance: How far to move the boundaries into the region, negative to
+        move them out.
+      islands: Closed contours inside the outline.
+      tolerance: Accuracy of the result.
+
+    Returns:
+      The corners of each loop, outlines anticlockwise and islands clockwise.
+    """
+    return Region(outline, islands, tolerance).offset(distance)
+
+
+def loop_toolpath(loop: np.ndarray, z: float, tolerance: float = 1e-4) -> Toolpath:
+    """
+    A closed loop of corners as lines and arcs at height z, starting and
+    ending at its first corner.
+    """
+    points = np.vstack([loop, loop[:1]])
+    points = np.hstack([points, np.full((len(points), 1), z)])
+    # in two halves, so a circle is not one arc short of a full turn
+    half = len(loop) // 2
+    return fit_points(points[: half + 1], tolerance) + fit_points(
+        points[half:], tolerance
+    )
+
+
+def concentric_loops(
+    region: Region, tool_radius: float, stepover: float
+) -> List[List[np.ndarray]]:
+    """
+    Loops for a tool to follow to clear a region, each one stepover further
+    from the boundary than the last.
+
+    Returns:
+      The loops at each distance from the boundary, the furthest first.
+    """
+    if stepover <= 0:
+        raise ValueError("stepover must be positive")
+
+    levels = []
+    distance = tool_radius
+    while True:
+        loops = region.offset(distance)
+        if not loops:
+            break
+        levels.append(loops)
+        distance += stepover
+    return levels[::-1]
+
+
+def zigzag_passes(
+    region: Region, tool_radius: float, stepover: float, angle: float = 0.0
+) -> List[np.ndarray]:
+    """
+    Parallel straight passes across a region, no more than stepover apart,
+    that keep a tool of tool_radius inside it.
+
+    Args:
+      region: Region to clear.
+      tool_radius: Radius of the tool.
+      stepover: Largest distance between passes.
+      angle: Direction of the passes, anticlockwise from the X axis in
+        radians.
+
+    Returns:
+      Start and end of each pass, 2 x 2, in no particular order.
+    """
+    if stepover <= 0:
+        raise ValueError("stepover must be positive")
+
+    loops = region.offset(tool_radius)
+    if not loops:
+        return []
+
+    c, s = math.cos(angle), math.sin(angle)
+    rotation = np.array([[c, -s], [s, c]])
+    a = np.vstack(loops) @ rotation  # rotated by -angle
+    b = np.vstack([np.roll(loop, -1, axis=0) for loop in loops]) @ rotation
+
+    # lines across at heights lo + (k + 0.5) * spacing
+    lo, hi = a[:, 1].min(), a[:, 1].max()
+    n = math.ceil((hi - lo) / stepover)
+    if n == 0:
+        return []
+    spacing = (hi - lo) / n
+
+    # every edge crosses the lines from its lower end up to, but not
+    # including, its upper end
+    y0 = np.minimum(a[:, 1], b[:, 1])
+    y1 = np.maximum(a[:, 1], b[:, 1])
+    first = np.ceil((y0 - lo) / spacing - 0.5).astype(np.intp)
+    last = np.ceil((y1 - lo) / spacing - 0.5).astype(np.intp) - 1
+    counts = np.maximum(last - first + 1, 0)
+    edge = np.repeat(np.arange(len(a)), counts)
+    line = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(
+        counts.sum()
+    )
+    y = lo + (line + 0.5) * spacing
+    t = (y - a[edge, 1]) / (b[edge, 1] - a[edge, 1])
+    x = a[edge, 0] + t * (b[edge, 0] - a[edge, 0])
+
+    # crossings pair up along each line, going into the region then out
+    order = np.lexsort((x, line))
+    x, y = x[order], y[order]
+    passes = np.stack(
+        [np.stack([x[0::2], y[0::2]], axis=1), np.stack([x[1::2], y[1::2]], axis=1)],
+        axis=1,
+    )
+    passes = passes[passes[:, 1, 0] - passes[:, 0, 0] > region.tolerance]
+    return list(passes @ rotation.T)
@@ -0,0 +1,257 @@
+"""
+Output sinks that Machine writes g-code text to.
+"""
+
+import gzip
+import io
+import os
+import pathlib
+import types
+import weakref
+from typing import Callable, Generator, List, Union
+
+DEFAULT_BUFFER_SIZE = 1 << 16  # characters
+
+COMPRESSION_SUFFIXES = {
+    ".gz": "gzip",
+    ".zst": "zstd",
+}
+
+
+class Sink:
+    """
+    Somewhere to send g-code text.
+
+    Subclasses only need to implement write. Sinks can be used as context
+    managers, which closes them on exit.
+    """
+
+    def write(self, text: str):
+
+        raise NotImplementedError()
+
+    def flush(self):
+
+        pass
+
+    def close(self):
+
+        self.flush()
+
+    def __enter__(self) -> "Sink":
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        self.close()
+
+
+class FileSink(Sink):
+    """
+    Writes to a plain text file.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike]):
+        self.file = open(path, "w")
+
+    def write(self, text: str):
+
+        self.file.write(text)
+
+    def flush(self):
+
+        self.file.flush()
+
+    def close(self):
+
+        self.file.close()
+
+
+class CompressedFileSink(Sink):
+    """
+    Writes to a gzip (.gz) or zstandard (.zst) compressed text file.
+
+    zstandard compression needs the optional zstandard package.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike], compression: str = "gzip"):
+        if compression == "gzip":
+            self.file = gzip.open(path, "wt")
+        elif compression == "zstd":
+            try:
+                import zstandard  # type: ignore[import-not-found]
+            except ImportError as e:
+                raise ImportError("zstd output requires the zstandard package") from e
+
+            self.file = zstandard.open(path, "wt")
+        else:
+            raise ValueError(f"Unknown compression {compression}")
+
+    def write(self, text: str):
+
+        self.file.write(text)
+
+    def flush(self):
+
+        self.file.flush()
+
+    def close(self):
+
+        self.file.close()
+
+
+class StreamSink(Sink):
+    """
+    Writes to an already open file-like object, such as an io.StringIO,
+    io.BytesIO or a socket's makefile().
+
+    Binary streams are sent UTF-8 encoded text. The stream is left open when
+    the sink is closed, so in memory buffers can still be read.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.binary = isinstance(stream, (io.RawIOBase, io.BufferedIOBase))
+
+    def write(self, text: str):
+
+        self.stream.write(text.encode() if self.binary else text)
+
+    def flush(self):
+
+        self.stream.flush()
+
+
+class CallbackSink(Sink):
+    """
+    Calls a function with each line of g-code as it reaches the sink.
+    """
+
+    def __init__(self, func: Callable[[str], object]):
+        self.func = func
+
+    def write(self, text: str):
+
+        # only newlines end lines, comments can contain other line breaks
+        lines = text.split("\n")
+        for line in lines[:-1]:
+            self.func(line + "\n")
+        if lines[-1]:
+            self.func(lines[-1])
+
+
+class GeneratorSink(CallbackSink):
+    """
+    Sends each line of g-code into a generator, eg.
+
+        def upload(sock):
+            while True:
+                line = yield
+                sock.sendall(line.encode())
+
+    The generator is started when the sink is created and closed along with
+    the sink.
+    """
+
+    def __init__(self, gen: Generator[object, str, object]):
+        next(gen)
+        self.gen = gen
+        super().__init__(gen.send)
+
+    def close(self):
+
+        self.gen.close()
+
+
+def _write_chunks(sink: Sink, chunks: List[str]):
+
+    if chunks:
+        sink.write("".join(chunks))
+        chunks.clear()
+
+
+def _drain_at_exit(sink: Sink, chunks: List[str]):
+
+    _write_chunks(sink, chunks)
+    sink.flush()
+
+
+class BufferedSink(Sink):
+    """
+    Collects text in memory and passes it on to another sink in large chunks.
+
+    Anything still in the buffer when the sink is garbage collected, or when
+    the interpreter exits, is written out then, like an unclosed file.
+
+    Args:
+      sink: Where the chunks end up.
+      size: Number of characters to collect before passing them on.
+    """
+
+    def __init__(self, sink: Sink, size: int = DEFAULT_BUFFER_SIZE):
+        self.sink = sink
+        self.size = size
+        self._chunks: List[str] = []
+        self._length = 0
+        self._finalizer = weakref.finalize(self, _drain_at_exit, sink, self._chunks)
+
+    def write(self, text: str):
+
+        self._chunks.append(text)
+        self._length += len(text)
+        if self._length >= self.size:
+            self._drain()
+
+    def _drain(self):
+        """
+        Hands everything in the buffer to the wrapped sink as one block.
+        """
+        _write_chunks(self.sink, self._chunks)
+        self._length = 0
+
+    def flush(self):
+
+        self._drain()
+        self.sink.flush()
+
+    def close(self):
+
+        self._finalizer.detach()
+        self._drain()
+        self.sink.close()
+
+
+def open_sink(target, buffer_size: int = DEFAULT_BUFFER_SIZE) -> Sink:
+    """
+    Turns target into a Sink.
+
+    Args:
+      target: A Sink, a path to a file, an open file-like object, a generator
+        or a function that accepts a line. Paths ending in .gz or .zst are
+        compressed.
+      buffer_size: Characters to buffer before writing to target. 0 disables
+        buffering.
+    """
+    sink: Sink
+    if isinstance(target, Sink):
+        sink = target
+    elif isinstance(target, (str, os.PathLike)):
+        suffix = pathlib.Path(target).suffix
+        if suffix in COMPRESSION_SUFFIXES:
+            sink = CompressedFileSink(target, COMPRESSION_SUFFIXES[suffix])
+        else:
+            sink = FileSink(target)
+    elif isinstance(target, types.GeneratorType):
+        sink = GeneratorSink(target)
+    elif hasattr(target, "write"):
+        sink = StreamSink(target)
+    elif callable(target):
+        sink = CallbackSink(target)
+    else:
+        raise TypeError(f"Can not write g-code to {target!r}")
+
+    if buffer_size > 0:
+        sink = BufferedSink(sink, buffer_size)
+
+    return sink
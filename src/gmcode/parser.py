@@ -0,0 +1,475 @@
+"""
+Streaming g-code reader.
+
+Reads g-code one line at a time, tracks modal state the way LinuxCNC does and
+yields a compact Move record for every motion, dwell, pause and tool change.
+Memory use does not depend on the length of the program, apart from the text
+of o-word subroutines, which are expanded where they are called.
+"""
+
+import attr
+import gzip
+import math
+import mmap
+import os
+import pathlib
+import re
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+# Move kinds. Motion kinds share their number with their G code.
+RAPID = 0
+LINEAR = 1
+ARC_CW = 2
+ARC_CCW = 3
+DWELL = 4
+PAUSE = 5
+END = 6
+TOOLCHANGE = 7
+
+MOTION_KINDS = (RAPID, LINEAR, ARC_CW, ARC_CCW)
+
+Point = Tuple[float, float, float]
+
+# axis index pairs for the arc plane, and the axis normal to it
+PLANE_AXES = {
+    "XY": (0, 1, 2),
+    "ZX": (2, 0, 1),
+    "YZ": (1, 2, 0),
+}
+
+_PLANES = {"17": "XY", "18": "ZX", "19": "YZ"}
+
+_WORD = re.compile(r"([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))")
+
+_OWORD = re.compile(r"\s*O\s*(?:<\s*(\w+)\s*>|(\d+))\s*([A-Z]*)", re.IGNORECASE)
+
+# a line of only G, N, F and axis words, which Parser.scan_line reads itself
+_PLAIN = re.compile(r"(?:\s*[GNFXYZ]\s*[-+]?(?:\d+\.?\d*|\.\d+))+\s*", re.IGNORECASE)
+
+
+class ParseError(ValueError):
+    pass
+
+
+class Move(NamedTuple):
+    """
+    One thing the machine does.
+
+    Attributes:
+      kind: RAPID, LINEAR, ARC_CW, ARC_CCW, DWELL, PAUSE, END or TOOLCHANGE.
+      start: Position before the move.
+      end: Position after the move.
+      centre: Arc centre, None for everything else.
+      turns: Number of turns for arcs (the P word), 1 otherwise.
+      feed: Feedrate in force, None if it has not been set.
+      value: Seconds for a dwell, tool number for a tool change, else 0.
+      blend: Path blending tolerance, the P of G64. 0 for exact path/stop
+        modes, inf for G64 without a tolerance.
+      plane: Arc plane, "XY", "ZX" or "YZ".
+      line: Line number the move came from, counting from 1.
+    """
+
+    kind: int
+    start: Point
+    end: Point
+    centre: Optional[Point] = None
+    turns: int = 1
+    feed: Optional[float] = None
+    value: float = 0.0
+    blend: float = math.inf
+    plane: str = "XY"
+    line: int = 0
+
+
+@attr.s(auto_detect=True, slots=True)  # type: ignore[call-overload]
+class ParserState:
+    """
+    Modal state of the machine.
+    """
+
+    position: List[float] = attr.ib(factory=lambda: [0.0, 0.0, 0.0])
+    motion: Optional[int] = attr.ib(None)
+    plane: str = attr.ib("XY")
+    absolute: bool = attr.ib(True)
+    arc_absolute: bool = attr.ib(False)
+    feed: Optional[float] = attr.ib(None)
+    tool: Optional[int] = attr.ib(None)
+    next_tool: Optional[int] = attr.ib(None)
+    blend: float = attr.ib(math.inf)
+    units: str = attr.ib("mm")
+
+    def copy(self) -> "ParserState":
+
+        return attr.evolve(self, position=list(self.position))
+
+
+def _point(p: List[float]) -> Point:
+
+    return (p[0], p[1], p[2])
+
+
+def tokenise(text: str) -> List[Tuple[str, str]]:
+    """
+    Splits a line of g-code into (letter, number) words, with comments
+    removed. Letters are upper case, numbers are left as strings.
+    """
+    # parenthesised comments can have semicolons in them, a semicolon outside
+    # them comments out the rest of the line
+    words = []
+    rest = text
+    while True:
+        start = rest.find("(")
+        semicolon = rest.find(";")
+        if semicolon >= 0 and (start < 0 or semicolon < start):
+            words.append(rest[:semicolon])
+            break
+        if start < 0:
+            words.append(rest)
+            break
+        end = rest.find(")", start)
+        if end < 0:
+            raise ParseError(f"Unclosed comment in {text!r}")
+        words.append(rest[:start])
+        rest = rest[end + 1 :]
+
+    return _WORD.findall(" ".join(words).upper())
+
+
+class Parser:
+    """
+    Turns lines of g-code into Move records.
+
+    Args:
+      state: Starting modal state. Defaults to LinuxCNC's power on state,
+        which includes G91.1 incremental arc centres.
+    """
+
+    def __init__(self, state: Optional[ParserState] = None):
+        self.state = state if state is not None else ParserState()
+        self.subroutines: Dict[str, List[str]] = {}
+        self._defining: Optional[str] = None
+
+    def copy(self) -> "Parser":
+        """
+        A parser in the same state, that carries on independently.
+        """
+        other = Parser(self.state.copy())
+        other.subroutines = {k: list(v) for k, v in self.subroutines.items()}
+        other._defining = self._defining
+        return other
+
+    def parse(self, lines: Iterable[Union[str, bytes]]) -> Iterator[Move]:
+        """
+        Parses lines lazily, yielding moves as they are found.
+        """
+        for number, text in enumerate(lines, 1):
+            if isinstance(text, bytes):
+                text = text.decode("utf-8")
+            yield from self.parse_line(text, number)
+
+    def parse_line(self, text: str, number: int = 0) -> List[Move]:
+        """
+        Parses one line of g-code, updating self.state.
+
+        Returns:
+          The moves on this line, usually zero or one, or the moves of a
+          subroutine call.
+        """
+        oword = _OWORD.match(text)
+        if self._defining is not None:
+            if oword and oword.group(3).lower() == "endsub":
+                self._defining = None
+            else:
+                self.subroutines[self._defining].append(text)
+            return []
+        if oword:
+            return self._oword(oword, number)
+
+        words = tokenise(text)
+        if not words:
+            return []
+
+        state = self.state
+        gcodes: List[str] = []
+        mcodes: List[str] = []
+        params: Dict[str, float] = {}
+        for letter, num in words:
+            if letter == "G":
+                gcodes.append(num.lstrip("0") or "0")
+            elif letter == "M":
+                mcodes.append(num.lstrip("0") or "0")
+            elif letter == "N":
+                pass
+            else:
+                params[letter] = float(num)
+
+        moves: List[Move] = []
+        position = state.position  # replaced, not changed, by a motion
+
+        if "F" in params:
+            state.feed = params["F"]
+
+        if "T" in params:
+            state.next_tool = int(params["T"])
+
+        if "6" in mcodes:
+            state.tool = state.next_tool
+            moves.append(
+                Move(
+                    TOOLCHANGE,
+                    _point(position),
+                    _point(position),
+                    feed=state.feed,
+                    value=state.tool if state.tool is not None else 0,
+                    blend=state.blend,
+                    plane=state.plane,
+                    line=number,
+                )
+            )
+
+        motion = None
+        for g in gcodes:
+            if g in ("0", "1", "2", "3"):
+                motion = int(g)
+            elif g in _PLANES:
+                state.plane = _PLANES[g]
+            elif g == "90":
+                state.absolute = True
+            elif g == "91":
+                state.absolute = False
+            elif g == "90.1":
+                state.arc_absolute = True
+            elif g == "91.1":
+                state.arc_absolute = False
+            elif g == "20":
+                state.units = "inch"
+            elif g == "21":
+                state.units = "mm"
+            elif g in ("61", "61.1"):
+                state.blend = 0.0
+            elif g == "64":
+                state.blend = params.get("P", math.inf)
+            elif g == "4":
+                moves.append(
+                    Move(
+                        DWELL,
+                        _point(position),
+                        _point(position),
+                        feed=state.feed,
+                        value=params.get("P", 0.0),
+                        blend=state.blend,
+                        plane=state.plane,
+                        line=number,
+                    )
+                )
+
+        if motion is not None:
+            state.motion = motion
+
+        has_axes = "X" in params or "Y" in params or "Z" in params
+        if (motion is not None or has_axes) and not ("4" in gcodes or "92" in gcodes):
+            if state.motion is None:
+                raise ParseError(f"Line {number}: axis words without a motion mode")
+            move = self._motion(state.motion, params, number)
+            if move is not None:
+                moves.append(move)
+
+        position = state.position
+        for m in mcodes:
+            kind = None
+            if m in ("0", "1"):
+                kind = PAUSE
+            elif m in ("2", "30"):
+                kind = END
+            if kind is not None:
+                moves.append(
+                    Move(
+                        kind,
+                        _point(position),
+                        _point(position),
+                        feed=state.feed,
+                        blend=state.blend,
+                        plane=state.plane,
+                        line=number,
+                    )
+                )
+
+        return moves
+
+    def scan_line(self, text: str, number: int = 0) -> int:
+        """
+        Updates self.state for one line the same way parse_line does, but
+        only counts its moves. Straight moves are read without making Move
+        records, anything else is handed to parse_line.
+
+        Returns:
+          The number of moves parse_line would have returned.
+        """
+        state = self.state
+        if self._defining is not None or not _PLAIN.fullmatch(text):
+            return len(self.parse_line(text, number))
+
+        words = _WORD.findall(text.upper())
+        motion = None
+        params: Dict[str, float] = {}
+        for letter, num in words:
+            if letter == "G":
+                g = num.lstrip("0") or "0"
+                if g not in ("0", "1"):
+                    return len(self.parse_line(text, number))
+                motion = int(g)
+            elif letter != "N":
+                params[letter] = float(num)
+        has_axes = "X" in params or "Y" in params or "Z" in params
+        if motion is None and (not has_axes or state.motion not in (RAPID, LINEAR)):
+            return len(self.parse_line(text, number))
+
+        if "F" in params:
+            state.feed = params["F"]
+        if motion is not None:
+            state.motion = motion
+        start = state.position
+        end = list(start)
+        for idx, axis in enumerate("XYZ"):
+            if axis in params:
+                end[idx] = params[axis] if state.absolute else start[idx] + params[axis]
+        if end == start:
+            return 0
+        state.position = end
+        return 1
+
+    def _oword(self, oword: "re.Match[str]", number: int) -> List[Move]:
+        """
+        Handles o-word subroutines. Calls are expanded, giving the moves of
+        the body with the line number of the call.
+        """
+        name = (oword.group(1) or oword.group(2)).lower()
+        keyword = oword.group(3).lower()
+        if keyword == "sub":
+            self.subroutines[name] = []
+            self._defining = name
+            return []
+        if keyword == "call":
+            body = self.subroutines.get(name)
+            if body is None:
+                raise ParseError(f"Line {number}: subroutine {name} is not defined")
+            moves: List[Move] = []
+            for text in body:
+                inner = _OWORD.match(text)
+                if inner and inner.group(3).lower() == "return":
+                    break
+                moves.extend(self.parse_line(text, number))
+            return moves
+
+        raise ParseError(f"Line {number}: o-word {keyword!r} is not supported")
+
+    def _motion(self, kind: int, params: Dict[str, float], number: int):
+
+        state = self.state
+        start = state.position
+        end = list(start)
+        for idx, axis in enumerate("XYZ"):
+            if axis in params:
+                end[idx] = params[axis] if state.absolute else start[idx] + params[axis]
+
+        centre = None
+        turns = 1
+        if kind in (ARC_CW, ARC_CCW):
+            if "R" in params:
+                raise ParseError(f"Line {number}: radius format arcs are not supported")
+            a0, a1, normal = PLANE_AXES[state.plane]
+            offset_words = "IJK"
+            c = list(start)
+            for k in (a0, a1):
+                word = offset_words[k]
+                val = params.get(word)
+                if state.arc_absolute:
+                    if val is None:
+                        raise ParseError(f"Line {number}: arc is missing {word}")
+                    c[k] = val
+                else:
+                    c[k] = start[k] + (val or 0.0)
+            c[normal] = start[normal]
+            centre = (c[0], c[1], c[2])
+            turns = int(params.get("P", 1))
+        elif end == start:
+            return None
+
+        state.position = end
+        return Move(
+            kind,
+            _point(start),
+            _point(end),
+            centre=centre,
+            turns=turns,
+            feed=state.feed,
+            blend=state.blend,
+            plane=state.plane,
+            line=number,
+        )
+
+
+def _mmap_lines(path: Union[str, os.PathLike]) -> Iterator[bytes]:
+
+    with open(path, "rb") as f0:
+        if os.fstat(f0.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f0.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield from iter(mm.readline, b"")
+
+
+def read_lines(
+    path: Union[str, os.PathLike], use_mmap: bool = False
+) -> Iterator[Union[str, bytes]]:
+    """
+    Lazily reads the lines of a g-code file. .gz and .zst files are
+    decompressed, .zst files need the optional zstandard package.
+
+    Args:
+      path: File to read.
+      use_mmap: Memory map the file instead of reading it through a buffer.
+    """
+    suffix = pathlib.Path(path).suffix
+    if suffix == ".gz":
+        with gzip.open(path, "rt") as f0:
+            yield from f0
+    elif suffix == ".zst":
+        try:
+            import zstandard  # type: ignore[import-not-found]
+        except ImportError as e:
+            raise ImportError("zstd input requires the zstandard package") from e
+
+        with zstandard.open(path, "rt") as f0:
+            yield from f0
+    elif use_mmap:
+        yield from _mmap_lines(path)
+    else:
+        with open(path, encoding="utf-8") as f0:
+            yield from f0
+
+
+def parse(
+    source: Union[str, os.PathLike, Iterable[Union[str, bytes]]],
+    state: Optional[ParserState] = None,
+    use_mmap: bool = False,
+) -> Iterator[Move]:
+    """
+    Lazily parses g-code.
+
+    Args:
+      source: A path to a g-code file, or an iterable of lines.
+      state: Starting modal state, see Parser.
+      use_mmap: Memory map source if it is a path.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        source = read_lines(source, use_mmap)
+    return Parser(state).parse(source)
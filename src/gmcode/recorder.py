@@ -0,0 +1,440 @@
+"""
+A Machine that records what it is asked to do instead of writing text.
+
+Moves and feedrates are stored in typed arrays, one per column, so a long
+program takes a few dozen bytes per move and nothing is formatted until it is
+rendered. Everything else (comments, plane and path mode changes, raw lines,
+tool changes, ...) is recorded as the method call that made it.
+
+A recording can be rendered to text, replayed onto any Machine (optionally
+translated) or turned into gmcode.parser Move records without writing or
+parsing any text for the moves.
+"""
+
+import array
+import functools
+import io
+import math
+import numpy as np
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from gmcode.geom import Vector
+from gmcode.machine import Machine, MachineError, MachineState, _modal_changes
+from gmcode.output import Sink
+from gmcode.parser import (
+    Move,
+    Parser,
+    RAPID,
+    LINEAR,
+    ARC_CW,
+    ARC_CCW,
+)
+
+# Record kinds, besides the motion kinds from gmcode.parser
+FEED = 8
+CALL = 9
+
+_CODES = np.array(["G0", "G1", "G2", "G3"], dtype=object)
+
+
+class _CaptureSink(Sink):
+    """
+    Keeps the text written by the methods that are recorded as calls.
+    """
+
+    def __init__(self) -> None:
+        self.chunks: List[str] = []
+
+    def write(self, text: str):
+
+        self.chunks.append(text)
+
+
+def _recorded(method):
+    """
+    Records calls to a Machine method, along with the text it writes. Calls
+    made from inside another recorded call are not recorded again.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._in_call:
+            return method(self, *args, **kwargs)
+
+        self._in_call = True
+        try:
+            result = method(self, *args, **kwargs)
+        finally:
+            self._in_call = False
+        text = "".join(self.outfile.chunks)
+        self.outfile.chunks.clear()
+        self._calls.append((method.__name__, args, kwargs, text))
+        self._append(CALL, value=len(self._calls) - 1)
+        return result
+
+    return wrapper
+
+
+class Recorder(Machine):
+    """
+    Has the same methods as Machine, but records moves in memory.
+
+    Args:
+      accuracy: Smallest distance that moves the recorded position, as for
+        Machine. Output accuracy is set when rendering.
+      state: Starting state, see Machine.snapshot.
+    """
+
+    def __init__(
+        self,
+        accuracy: float = 1e-4,
+        state: Optional[MachineState] = None,
+        **kwargs,
+    ):
+        super().__init__(_CaptureSink(), accuracy=accuracy, buffer_size=0, **kwargs)
+        self.start_state = state if state is not None else MachineState()
+        self.restore(self.start_state)
+        self._in_call = False
+        self._calls: List[Tuple[str, tuple, Dict[str, Any], str]] = []
+        self._kind = array.array("b")
+        self._columns = {k: array.array("d") for k in ("x", "y", "z", "i", "j", "v")}
+
+    def __getstate__(self):
+
+        return {
+            "accuracy": self.accuracy,
+            "start_state": self.start_state,
+            "state": self.snapshot(),
+            "calls": self._calls,
+            "kind": self._kind,
+            "columns": self._columns,
+        }
+
+    def __setstate__(self, data):
+
+        self.__init__(data["accuracy"], data["start_state"])
+        self.restore(data["state"])
+        self._calls = data["calls"]
+        self._kind = data["kind"]
+        self._columns = data["columns"]
+
+    def __len__(self) -> int:
+
+        return len(self._kind)
+
+    def _append(
+        self,
+        kind: int,
+        x: float = math.nan,
+        y: float = math.nan,
+        z: float = math.nan,
+        i: float = math.nan,
+        j: float = math.nan,
+        value: float = math.nan,
+    ):
+
+        self._kind.append(kind)
+        cols = self._columns
+        cols["x"].append(x)
+        cols["y"].append(y)
+        cols["z"].append(z)
+        cols["i"].append(i)
+        cols["j"].append(j)
+        cols["v"].append(value)
+
+    def _move_to(self, x, y, z):
+        """
+        Updates the position the same way Machine._xyz_to_command does.
+        """
+        position = self.position
+        new = []
+        for axis, current, val in zip("XYZ", position, (x, y, z)):
+            if val is not None and (
+                abs(val - current) > self.accuracy or self._unitialised[axis]
+            ):
+                self._unitialised[axis] = False
+                new.append(val)
+            else:
+                new.append(current)
+        self.position = Vector(*new)
+
+    def g0(
+        self,
+        x: Optional[float] = None,
+        y: Optional[float] = None,
+        z: Optional[float] = None,
+    ):
+        nan = math.nan
+        self._append(
+            RAPID,
+            nan if x is None else x,
+            nan if y is None else y,
+            nan if z is None else z,
+        )
+        self._move_to(x, y, z)
+
+    def g1(
+        self,
+        x: Optional[float] = None,
+        y: Optional[float] = None,
+        z: Optional[float] = None,
+    ):
+        nan = math.nan
+        self._append(
+            LINEAR,
+            nan if x is None else x,
+            nan if y is None else y,
+            nan if z is None else z,
+        )
+        self._move_to(x, y, z)
+
+    def feedrate(self, f: float):
+
+        if self._feedrate is None or abs(self._feedrate - f) > self.accuracy:
+            self._append(FEED, value=f)
+            self._feedrate = f
+
+    def arc(
+        self,
+        x: Optional[float] = None,
+        y: Optional[float] = None,
+        z: Optional[float] = None,
+        i: Optional[float] = None,
+        j: Optional[float] = None,
+        cw: bool = True,
+        p: int = 1,
+    ):
+        if i is None or j is None:
+            raise MachineError("arc centre must be specified")
+
+        end = Vector(
+            self.position.x if x is None else x,
+            self.position.y if y is None else y,
+            self.position.z if z is None else z,
+        )
+        self._append(ARC_CW if cw else ARC_CCW, end.x, end.y, end.z, i, j, p)
+        self.position = end
+
+    def _emit(
+        self,
+        codes: np.ndarray,
+        ends: np.ndarray,
+        is_arc: np.ndarray,
+        centres: Optional[np.ndarray] = None,
+        feeds: Optional[np.ndarray] = None,
+    ):
+        n = len(codes)
+        if n == 0:
+            return
+
+        kind = np.select(
+            [codes == "G0", codes == "G1", codes == "G2"],
+            [RAPID, LINEAR, ARC_CW],
+            ARC_CCW,
+        ).astype(np.int8)
+        has_feed = np.zeros(n, dtype=bool)
+        if feeds is not None and not np.all(np.isnan(feeds)):
+            first = None
+            current = self._feedrate
+            if current is None:
+                first = int(np.flatnonzero(~np.isnan(feeds))[0])
+                current = float(feeds[first])
+            has_feed, _, self._feedrate = _modal_changes(
+                feeds, current, self.accuracy, first, np.zeros(n, dtype=bool)
+            )
+
+        # a feed row goes before its move, rows without one are dropped
+        rows = np.stack([has_feed, np.ones(n, dtype=bool)], axis=1).reshape(-1)
+        row_kind = np.stack([np.full(n, FEED, dtype=np.int8), kind], axis=1)
+        self._kind.frombytes(row_kind.reshape(-1)[rows].tobytes())
+        empty = np.full(n, np.nan)
+        if centres is None:
+            centres = np.full((n, 3), np.nan)
+        columns = {
+            "x": (empty, ends[:, 0]),
+            "y": (empty, ends[:, 1]),
+            "z": (empty, ends[:, 2]),
+            "i": (empty, np.where(is_arc, centres[:, 0], np.nan)),
+            "j": (empty, np.where(is_arc, centres[:, 1], np.nan)),
+            "v": (feeds if feeds is not None else empty, np.where(is_arc, 1.0, np.nan)),
+        }
+        for name, (feed_row, move_row) in columns.items():
+            data = np.stack([feed_row, move_row], axis=1).reshape(-1)[rows]
+            self._columns[name].frombytes(np.ascontiguousarray(data).tobytes())
+
+        not_arc = np.flatnonzero(~is_arc)
+        position = list(self.position)
+        for k, axis in enumerate("XYZ"):
+            first = None
+            if self._unitialised[axis] and not_arc.size:
+                first = int(not_arc[0])
+                self._unitialised[axis] = False
+            _, _, position[k] = _modal_changes(
+                ends[:, k], position[k], self.accuracy, first, is_arc
+            )
+        self.position = Vector(*position)
+
+    plane = _recorded(Machine.plane)
+    write = _recorded(Machine.write)
+    comment = _recorded(Machine.comment)
+    toolchange = _recorded(Machine.toolchange)
+    dwell = _recorded(Machine.dwell)
+    pause = _recorded(Machine.pause)
+    path_mode = _recorded(Machine.path_mode)
+
+    def _write_block(self, text: str):
+
+        self.write(text[:-1])
+
+    def subroutine(self, name: str, origin: Optional[Vector] = None):
+
+        raise MachineError("Subroutines can not be recorded")
+
+    def flush(self):
+
+        pass
+
+    def close(self):
+
+        pass
+
+    def _arrays(self):
+
+        kind = np.frombuffer(self._kind, dtype=np.int8)
+        cols = {k: np.frombuffer(v, dtype=np.float64) for k, v in self._columns.items()}
+        return kind, cols
+
+    def replay(self, m: Machine, offset: Vector = Vector()):
+        """
+        Makes the same calls on m, with moves translated by offset. Runs of
+        moves are written in one batch.
+        """
+        kind, cols = self._arrays()
+        n = len(kind)
+        if n == 0:
+            return
+
+        motion = kind <= ARC_CCW
+        is_arc = (kind == ARC_CW) | (kind == ARC_CCW)
+        turns = np.where(is_arc, cols["v"], 1)
+        batched = motion & (turns == 1)
+        next_batched = np.append(batched[1:], False)
+        batched |= (kind == FEED) & next_batched
+        # batches run between the rows that have to be replayed one by one
+        single = np.flatnonzero(~batched)
+        bounds = np.concatenate([[-1], single, [n]])
+
+        ends = np.stack([cols["x"], cols["y"], cols["z"]], axis=1) + tuple(offset)
+        centres = np.stack(
+            [cols["i"] + offset.x, cols["j"] + offset.y, cols["z"]], axis=1
+        )
+        for before, after in zip(bounds[:-1], bounds[1:]):
+            if after - before > 1:
+                self._replay_batch(m, kind, cols, ends, centres, before + 1, after)
+            if after < n:
+                self._replay_row(m, kind[after], cols, ends, centres, after)
+
+    def _replay_batch(self, m, kind, cols, ends, centres, first, last):
+
+        kind = kind[first:last]
+        moves = np.flatnonzero(kind != FEED)
+        feed_rows = np.flatnonzero(kind == FEED)
+        feeds = np.full(len(moves), np.nan)
+        # every feed row is followed by a move
+        feeds[np.searchsorted(moves, feed_rows)] = cols["v"][first:last][feed_rows]
+        rows = moves + first
+        m._emit(
+            _CODES[kind[moves]],
+            ends[rows],
+            kind[moves] >= ARC_CW,
+            centres[rows],
+            feeds,
+        )
+
+    def _replay_row(self, m, kind, cols, ends, centres, row):
+
+        if kind == CALL:
+            name, args, kwargs, _ = self._calls[int(cols["v"][row])]
+            getattr(m, name)(*args, **kwargs)
+        elif kind == FEED:
+            m.feedrate(float(cols["v"][row]))
+        else:
+            x, y, z = ends[row].tolist()
+            i, j, _ = centres[row].tolist()
+            m.arc(x, y, z, i, j, cw=kind == ARC_CW, p=int(cols["v"][row]))
+
+    def render(self, outfile=None, **kwargs) -> Optional[str]:
+        """
+        Writes the recording as g-code.
+
+        Args:
+          outfile: Anything Machine accepts. If None, the g-code is returned
+            as a string.
+          kwargs: Other arguments for Machine, accuracy defaults to this
+            Recorder's.
+        """
+        kwargs.setdefault("accuracy", self.accuracy)
+        text = io.StringIO() if outfile is None else None
+        m = Machine(outfile if text is None else text, **kwargs)
+        m.restore(self.start_state)
+        self.replay(m)
+        m.close()
+        return text.getvalue() if text is not None else None
+
+    def moves(self) -> Iterator[Move]:
+        """
+        The recording as gmcode.parser Move records, like parsing the
+        rendered g-code would give but with unrounded coordinates. Only the
+        text written by recorded calls is parsed.
+
+        Arc centres are taken to be absolute, as Machine.arc means them.
+        """
+        kind, cols = self._arrays()
+        parser = Parser()
+        state = parser.state
+        state.arc_absolute = True
+        state.position = list(self.start_state.position)
+        if self.start_state.feedrate is not None:
+            state.feed = self.start_state.feedrate
+
+        uninitialised = set(self.start_state.unitialised)
+        accuracy = self.accuracy
+        columns = [cols[k].tolist() for k in ("x", "y", "z", "i", "j", "v")]
+        for row, (k, x, y, z, i, j, v) in enumerate(zip(kind.tolist(), *columns)):
+            if k == CALL:
+                text = self._calls[int(v)][3]
+                for line in text.splitlines():
+                    yield from parser.parse_line(line, row)
+                continue
+            if k == FEED:
+                state.feed = v
+                continue
+
+            start = state.position
+            end = list(start)
+            for idx, (axis, val) in enumerate(zip("XYZ", (x, y, z))):
+                if val == val and (
+                    abs(val - start[idx]) > accuracy or axis in uninitialised
+                ):
+                    end[idx] = val
+                    uninitialised.discard(axis)
+            centre = None
+            turns = 1
+            if k >= ARC_CW:
+                end = [x, y, z]
+                centre = (i, j, start[2])
+                turns = int(v)
+            elif end == start:
+                continue
+
+            state.position = end
+            yield Move(
+                k,
+                (start[0], start[1], start[2]),
+                (end[0], end[1], end[2]),
+                centre=centre,
+                turns=turns,
+                feed=state.feed,
+                blend=state.blend,
+                plane=state.plane,
+                line=row,
+            )
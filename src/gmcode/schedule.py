@@ -0,0 +1,395 @@
+"""
+Ordering of independent operations to cut down on rapid moves.
+
+An Operation is a feature (a hole, a pocket, ...) with an entry and exit
+point. order puts operations in a sequence that keeps the XY distance
+travelled between them short: a nearest neighbour tour built with a spatial
+grid, then improved with 2-opt and Or-opt moves. Only moves that join an
+operation to one of its nearest neighbours are tried, and an operation is
+only looked at again once a move changes the tour around it, so improving
+takes about as long as the number of moves it makes. Operations that use
+the same tool are kept together so tool changes are kept to a minimum.
+"""
+
+import attr
+import heapq
+import math
+import numpy as np
+from collections import defaultdict, deque
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from gmcode.machine import Machine
+from gmcode.geom import Vector
+
+# nearest operations moves are tried with when improving a tour
+_NEIGHBOURS = 10
+# longest run of operations an Or-opt move takes
+_RUN = 3
+
+
+@attr.s(auto_detect=True, frozen=True, slots=True)  # type: ignore[call-overload]
+class Operation:
+    """
+    Something to machine.
+
+    Attributes:
+      entry: Where the operation starts. The machine is moved here before
+        action is called.
+      action: Function that does the machining, called with the Machine.
+      exit: Where the operation finishes, defaults to entry.
+      tool: Tool number to use, None if any tool will do.
+      name: Written as a comment before the operation.
+    """
+
+    entry: Vector = attr.ib()
+    action: Callable[[Machine], Any] = attr.ib()
+    exit: Optional[Vector] = attr.ib(None)
+    tool: Optional[int] = attr.ib(None)
+    name: str = attr.ib("")
+
+    @property
+    def end(self) -> Vector:
+
+        return self.entry if self.exit is None else self.exit
+
+
+class _Grid:
+    """
+    Uniform grid of points that supports nearest neighbour queries with
+    removal.
+    """
+
+    def __init__(self, points: np.ndarray):
+        self.points = points
+        lo = points.min(axis=0)
+        span = np.maximum(points.max(axis=0) - lo, 1e-9)
+        # about one point per cell, points on a line get cells along the line
+        n = len(points)
+        self.cell = max(math.sqrt(span[0] * span[1] / n), span.max() / n)
+        self.lo = lo
+        self.cells: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        for idx, key in enumerate(self._keys(points)):
+            self.cells[key].append(idx)
+        self.size = len(points)
+        self.shape = tuple(int(k) + 1 for k in np.floor(span / self.cell))
+
+    def _keys(self, points: np.ndarray):
+
+        cells = np.floor((points - self.lo) / self.cell).astype(int)
+        return [tuple(c) for c in cells.tolist()]
+
+    def remove(self, idx: int):
+
+        self.cells[self._keys(self.points[idx : idx + 1])[0]].remove(idx)
+        self.size -= 1
+
+    def nearest(self, point: np.ndarray) -> int:
+        """
+        Index of the closest point that has not been removed.
+        """
+        near = self.near(point, 1)
+        return near[0] if near else -1
+
+    def near(self, point: np.ndarray, k: int) -> List[int]:
+        """
+        Indices of the k closest points that have not been removed, closest
+        first.
+        """
+        cx, cy = np.floor((point - self.lo) / self.cell).astype(int).tolist()
+        nx, ny = self.shape
+        # rings of cells around the query that overlap the grid
+        first = max(-cx, cx - nx + 1, -cy, cy - ny + 1, 0)
+        last = max(cx, nx - 1 - cx, cy, ny - 1 - cy)
+        # the k best so far, furthest first
+        best: List[Tuple[float, int]] = []
+        for ring in range(first, last + 1):
+            if len(best) == k and (ring - 1) * self.cell >= -best[0][0]:
+                break
+            y0, y1 = max(cy - ring, 0), min(cy + ring, ny - 1)
+            for ix in range(max(cx - ring, 0), min(cx + ring, nx - 1) + 1):
+                column: Sequence[int]
+                if abs(ix - cx) == ring:
+                    column = range(y0, y1 + 1)
+                else:
+                    column = [iy for iy in (cy - ring, cy + ring) if y0 <= iy <= y1]
+                for iy in column:
+                    for idx in self.cells.get((ix, iy), ()):
+                        dist = math.dist(point, self.points[idx])
+                        if len(best) < k:
+                            heapq.heappush(best, (-dist, -idx))
+                        elif dist < -best[0][0]:
+                            heapq.heapreplace(best, (-dist, -idx))
+        return [-idx for _, idx in sorted(best, reverse=True)]
+
+
+def _distances(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+
+    return np.hypot(a[..., 0] - b[..., 0], a[..., 1] - b[..., 1])
+
+
+def _nearest_neighbour(
+    entries: np.ndarray, exits: np.ndarray, start: np.ndarray
+) -> List[int]:
+
+    grid = _Grid(entries)
+    tour = []
+    point = start
+    while grid.size:
+        idx = grid.nearest(point)
+        grid.remove(idx)
+        tour.append(idx)
+        point = exits[idx]
+    return tour
+
+
+class _Tour:
+    """
+    A tour being improved, with the cost of each edge in it.
+
+    Position -1 is the start point and the start point is operation n, with
+    no entry.
+    """
+
+    def __init__(self, tour: List[int], entries: np.ndarray, exits: np.ndarray):
+        self.tour = tour
+        self.entries = entries
+        self.exits = exits
+        self.ent = entries.tolist()
+        self.ext = exits.tolist()
+        self.update()
+
+    def update(self):
+        """
+        Works out positions and the running totals of the edges between
+        operations, forwards and as they would be if reversed.
+        """
+        n = len(self.tour)
+        tour = np.array(self.tour, dtype=np.intp)
+        pos = np.empty(n + 1, dtype=np.intp)
+        pos[tour] = np.arange(n)
+        pos[n] = -1
+        self.pos = pos.tolist()
+        forward = _distances(self.exits[tour[:-1]], self.entries[tour[1:]])
+        backward = _distances(self.exits[tour[1:]], self.entries[tour[:-1]])
+        self.forward = np.concatenate([[0.0], np.cumsum(forward)]).tolist()
+        self.backward = np.concatenate([[0.0], np.cumsum(backward)]).tolist()
+
+    def exit_at(self, i: int) -> List[float]:
+
+        return self.ext[-1] if i < 0 else self.ext[self.tour[i]]
+
+    def edge(self, i: int) -> float:
+        """
+        Cost of the edge into position i, 0 past the end.
+        """
+        if i >= len(self.tour):
+            return 0.0
+        return math.dist(self.exit_at(i - 1), self.ent[self.tour[i]])
+
+    def reverse_gain(self, i: int, j: int) -> float:
+        """
+        How much shorter the tour gets reversing positions i to j.
+        """
+        tour = self.tour
+        old = self.edge(i) + self.edge(j + 1) + self.forward[j] - self.forward[i]
+        new = math.dist(self.exit_at(i - 1), self.ent[tour[j]])
+        new += self.backward[j] - self.backward[i]
+        if j + 1 < len(tour):
+            new += math.dist(self.ext[tour[i]], self.ent[tour[j + 1]])
+        return old - new
+
+    def move_gain(self, i: int, length: int, q: int) -> float:
+        """
+        How much shorter the tour gets moving the run at positions i to
+        i + length - 1 in front of position q.
+        """
+        tour = self.tour
+        n = len(tour)
+        first, last = tour[i], tour[i + length - 1]
+        removed = self.edge(i) + self.edge(i + length)
+        if i + length < n:
+            removed -= math.dist(self.exit_at(i - 1), self.ent[tour[i + length]])
+        added = math.dist(self.exit_at(q - 1), self.ent[first])
+        if q < n:
+            added += math.dist(self.ext[last], self.ent[tour[q]]) - self.edge(q)
+        return removed - added
+
+
+def _improve(
+    tour: List[int],
+    entries: np.ndarray,
+    exits: np.ndarray,
+    start: np.ndarray,
+    max_moves: int,
+):
+    """
+    Shortens a tour in place with 2-opt and Or-opt moves that join
+    operations to their nearest neighbours.
+    """
+    n = len(tour)
+    k = min(_NEIGHBOURS, n)
+    by_entry = _Grid(entries)
+    by_exit = _Grid(exits)
+    # operations that could come after each one, and the start, and
+    # operations that could come before each one
+    after = [by_entry.near(p, k) for p in np.vstack([exits, start])]
+    before = [by_exit.near(p, k) for p in entries]
+
+    t = _Tour(tour, entries, np.vstack([exits, start]))
+    queue = deque([n] + tour)
+    queued = set(queue)
+    moves = 0
+    while queue and moves < max_moves:
+        a = queue.popleft()
+        queued.discard(a)
+        p = t.pos[a]
+        best = (1e-9, "", 0, 0, 0)
+
+        # 2-opt: reverse a run so a new edge joins a to a neighbour
+        for c in after[a]:
+            j = t.pos[c]
+            if j > p + 1:
+                gain = t.reverse_gain(p + 1, j)
+                if gain > best[0]:
+                    best = (gain, "reverse", p + 1, j, 0)
+            if p >= 0 and j - 1 > p:
+                gain = t.reverse_gain(p, j - 1)
+                if gain > best[0]:
+                    best = (gain, "reverse", p, j - 1, 0)
+
+        # Or-opt: move a run starting at a next to a neighbour
+        if p >= 0:
+            for length in range(1, min(_RUN, n - p) + 1):
+                last = tour[p + length - 1]
+                places = [t.pos[c] for c in after[last]]
+                places += [t.pos[c] + 1 for c in before[a] if c != last]
+                for q in places:
+                    if not p <= q <= p + length:
+                        gain = t.move_gain(p, length, q)
+                        if gain > best[0]:
+                            best = (gain, "move", p, length, q)
+
+        gain, kind, i, j, q = best
+        if not kind:
+            continue
+        moves += 1
+        if kind == "reverse":
+            ends = [i - 1, i, j, j + 1]
+        else:
+            ends = [i - 1, i, i + j - 1, i + j, q - 1, q]
+        # the operations either side of the new edges are looked at again
+        touched = [n if x < 0 else tour[x] for x in ends if x < n]
+        if kind == "reverse":
+            tour[i : j + 1] = tour[i : j + 1][::-1]
+        else:
+            run = tour[i : i + j]
+            del tour[i : i + j]
+            place = q if q < i else q - j
+            tour[place:place] = run
+        t.update()
+        for c in touched:
+            if c not in queued:
+                queue.append(c)
+                queued.add(c)
+
+
+def _route(
+    ops: Sequence[Operation], start: Vector, improve: bool, max_iterations: int
+) -> Tuple[List[Operation], Vector]:
+
+    if not ops:
+        return [], start
+
+    entries = np.array([op.entry.xy_tuple() for op in ops], dtype=np.float64)
+    exits = np.array([op.end.xy_tuple() for op in ops], dtype=np.float64)
+    start_xy = np.array(start.xy_tuple(), dtype=np.float64)
+    tour = _nearest_neighbour(entries, exits, start_xy)
+    if improve and len(tour) > 1:
+        _improve(tour, entries, exits, start_xy, max_iterations)
+
+    ordered = [ops[idx] for idx in tour]
+    return ordered, ordered[-1].end
+
+
+def travel(ops: Sequence[Operation], start: Vector = Vector()) -> float:
+    """
+    XY distance of the rapid moves between operations, in order.
+    """
+    total = 0.0
+    point = start
+    for op in ops:
+        total += math.dist(point.xy_tuple(), op.entry.xy_tuple())
+        point = op.end
+    return total
+
+
+def order(
+    ops: Sequence[Operation],
+    start: Vector = Vector(),
+    tool: Optional[int] = None,
+    improve: bool = True,
+    max_iterations: int = 1000,
+) -> List[Operation]:
+    """
+    Puts operations in an order with short rapid moves between them.
+
+    Operations are grouped by tool, starting with the current tool, so there
+    is at most one tool change per tool. Operations without a tool run with
+    the current tool.
+
+    Args:
+      ops: Operations to order.
+      start: Where the machine is before the first operation.
+      tool: Tool that is in the machine at the start.
+      improve: Refine the nearest neighbour tour with 2-opt and Or-opt.
+      max_iterations: Maximum number of refinement moves per tool.
+    """
+    groups: Dict[Optional[int], List[Operation]] = {}
+    for op in ops:
+        groups.setdefault(op.tool if op.tool is not None else tool, []).append(op)
+
+    keys = list(groups)
+    if tool in groups:
+        keys.remove(tool)
+        keys.insert(0, tool)
+
+    out: List[Operation] = []
+    for key in keys:
+        ordered, start = _route(groups[key], start, improve, max_iterations)
+        out += ordered
+    return out
+
+
+def approach(m: Machine, op: Operation, clearance: float):
+    """
+    Gets the machine ready for an operation: changes the tool if needed,
+    writes the name, retracts to clearance height, rapids over the entry
+    point and down to it.
+    """
+    if op.tool is not None:
+        m.toolchange(op.tool)
+    if op.name:
+        m.comment(op.name)
+    m.g0(z=clearance)
+    m.g0(op.entry.x, op.entry.y)
+    m.g0(z=op.entry.z)
+
+
+def run(m: Machine, ops: Sequence[Operation], clearance: float):
+    """
+    Machines operations in the order given, calling approach before each
+    one.
+    """
+    for op in ops:
+        approach(m, op, clearance)
+        op.action(m)
+
+    m.g0(z=clearance)
+
+
+def schedule(m: Machine, ops: Sequence[Operation], clearance: float, **kwargs):
+    """
+    Orders operations, starting from the machine's current position and
+    tool, then machines them. kwargs are passed on to order.
+    """
+    ordered = order(ops, start=m.position, tool=m.tool_number, **kwargs)
+    run(m, ordered, clearance)
@@ -0,0 +1,183 @@
+"""
+Path simplification.
+
+Tessellated curves and CAD exports often arrive as thousands of short,
+nearly collinear lines. Each one becomes a G1 command, makes the file bigger
+and gives the controller's look-ahead less to work with. The functions here
+merge runs of lines with the Ramer-Douglas-Peucker algorithm, so no point of
+the original path is further than the tolerance from the simplified one.
+Points that are exactly collinear are always merged.
+"""
+
+import attr
+import numpy as np
+from typing import Callable, Iterable, List, Union, overload
+from gmcode.geom import VectorArray, PathElement, Line, TOLERANCE
+from gmcode.toolpath import Toolpath, LINE
+
+
+def _segment_distances(points: np.ndarray, a: np.ndarray, b: np.ndarray):
+    """
+    Distances from each point to the line segment a-b.
+    """
+    ab = b - a
+    length2 = ab.dot(ab)
+    ap = points - a
+    if length2 == 0:
+        return np.sqrt(np.einsum("ij,ij->i", ap, ap))
+
+    t = np.clip(ap.dot(ab) / length2, 0, 1)
+    diff = ap - t[:, None] * ab
+    return np.sqrt(np.einsum("ij,ij->i", diff, diff))
+
+
+def simplify_mask(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Mask of the points to keep, see simplify_points.
+    """
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+
+        dists = _segment_distances(
+            points[first + 1 : last], points[first], points[last]
+        )
+        idx = int(np.argmax(dists))
+        if dists[idx] > tolerance:
+            split = first + 1 + idx
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+
+    return keep
+
+
+def simplify_points(
+    points: Union[VectorArray, np.ndarray], tolerance: float
+) -> np.ndarray:
+    """
+    Simplifies a polyline with the Ramer-Douglas-Peucker algorithm.
+
+    The first and last points are always kept, and every removed point is
+    within tolerance of the simplified polyline.
+
+    Args:
+      points: N x 3 array of points, eg. for Machine.g1_many.
+      tolerance: Largest allowable distance from the original points.
+
+    Returns:
+      An M x 3 array of the points that are kept, M <= N.
+    """
+    if isinstance(points, VectorArray):
+        points = points.data
+    points = np.asarray(points, dtype=np.float64)
+    return points[simplify_mask(points, tolerance)]
+
+
+def _map_line_runs(path: Toolpath, func: Callable[[np.ndarray], Toolpath]):
+    """
+    Replaces each run of connected lines in path with func(points), where
+    points are the N + 1 points of the N lines.
+
+    A run of lines ends at arcs, gaps and feedrate changes.
+    """
+    n = len(path)
+    if n == 0:
+        return path
+
+    is_line = path.kind == LINE
+    starts_run = np.ones(n, dtype=bool)
+    starts_run[1:] = ~(is_line[1:] & is_line[:-1])
+    starts_run[path.gaps(tolerance=TOLERANCE)] = True
+    has_feed = ~np.isnan(path.feed)
+    last_feed = np.maximum.accumulate(np.where(has_feed, np.arange(n), 0))
+    feed = path.feed[last_feed]
+    starts_run[1:] |= has_feed[1:] & (feed[1:] != feed[:-1])
+    bounds = np.append(np.flatnonzero(starts_run), n)
+
+    pieces = []
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        piece = path[first:last]
+        if not is_line[first] or last - first < 2:
+            pieces.append(piece)
+            continue
+
+        points = np.vstack([piece.start.data[:1], piece.end.data])
+        new = func(points)
+        run_feed = np.full(len(new), np.nan)
+        run_feed[:1] = path.feed[first]
+        pieces.append(attr.evolve(new, feed=run_feed))
+
+    return Toolpath.concatenate(pieces)
+
+
+def _map_element_runs(
+    paths: Iterable[PathElement], func: Callable[[np.ndarray], Toolpath]
+) -> List[PathElement]:
+    """
+    Like _map_line_runs, for a list of PathElements.
+    """
+    out: List[PathElement] = []
+    run: List[PathElement] = []
+
+    def finish_run():
+        if len(run) > 1:
+            points = np.array([tuple(run[0].start)] + [tuple(p.end) for p in run])
+            out.extend(func(points))
+        else:
+            out.extend(run)
+        run.clear()
+
+    for p in paths:
+        if isinstance(p, Line) and (not run or run[-1].end.isclose(p.start)):
+            run.append(p)
+            continue
+
+        finish_run()
+        if isinstance(p, Line):
+            run.append(p)
+        else:
+            out.append(p)
+
+    finish_run()
+    return out
+
+
+def _simplified_lines(tolerance: float) -> Callable[[np.ndarray], Toolpath]:
+
+    return lambda points: Toolpath.lines(points[simplify_mask(points, tolerance)])
+
+
+@overload
+def simplify(paths: Toolpath, tolerance: float) -> Toolpath: ...
+
+
+@overload
+def simplify(paths: List[PathElement], tolerance: float) -> List[PathElement]: ...
+
+
+def simplify(paths, tolerance):
+    """
+    Merges runs of Lines that are within tolerance of a straight line. Arcs
+    are left alone, as are the points where lines meet them.
+
+    Args:
+      paths: A list of PathElements or a Toolpath. A Toolpath also keeps the
+        lines where the feedrate changes.
+      tolerance: Largest allowable distance from the original path.
+
+    Returns:
+      The same type as paths.
+    """
+    if isinstance(paths, Toolpath):
+        return _map_line_runs(paths, _simplified_lines(tolerance))
+
+    return _map_element_runs(paths, _simplified_lines(tolerance))
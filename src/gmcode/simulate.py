@@ -0,0 +1,587 @@
+"""
+Simulating the material a program removes from a block of stock.
+
+Stock is a heightmap: a grid of square cells over the block, each holding the
+height of the material left in it (a Z dexel). Moves are split into short
+straight pieces, and each piece lowers the cells the tool passes over to the
+bottom of the tool there.
+
+The grid is done in square tiles. Cells in different tiles never affect each
+other, so tiles are simulated in parallel threads (NumPy lets go of the GIL
+for most of the array work), and the pieces over a tile are done in batches
+so memory use does not grow with the program or the stock.
+"""
+
+import attr
+import os
+import numpy as np
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Iterable, List, Mapping, Optional, Sequence, Tuple, Union
+from gmcode import parser
+from gmcode.backplot import _path
+from gmcode.parser import Move
+
+# cell and piece pairs looked at once
+_BATCH = 1 << 20
+# halvings of the searches along a piece for the lowest point of a ball over
+# a cell, and for where a rapid first goes into material
+_BALL_STEPS = 24
+
+
+@attr.s(auto_detect=True, frozen=True, slots=True)  # type: ignore[call-overload]
+class Tool:
+    """
+    An end mill.
+
+    Attributes:
+      diameter: Cutting diameter.
+      ball: Whether the end is a ball rather than flat. The position of the
+        tool is the bottom of the ball.
+    """
+
+    diameter: float = attr.ib()
+    ball: bool = attr.ib(False)
+
+    @property
+    def radius(self) -> float:
+
+        return self.diameter / 2
+
+
+@attr.s(auto_detect=True, frozen=True, slots=True)  # type: ignore[call-overload]
+class Collision:
+    """
+    A rapid move through material.
+
+    Attributes:
+      line: Line number the move came from.
+      position: Where the tool first goes into material.
+      depth: Deepest the tool goes into material during the move.
+    """
+
+    line: int = attr.ib()
+    position: Tuple[float, float, float] = attr.ib()
+    depth: float = attr.ib()
+
+
+@attr.s(auto_detect=True, slots=True)  # type: ignore[call-overload]
+class Simulation:
+    """
+    The result of simulate. Volumes are in cubic units, distances in units.
+
+    Attributes:
+      removed: Volume of material cut away.
+      remaining: Volume of material left.
+      cutting_distance: Length of the G1/G2/G3 moves.
+      air_distance: Length of the G1/G2/G3 moves that cut nothing.
+      collisions: Rapid moves that went through material.
+    """
+
+    removed: float = attr.ib(0.0)
+    remaining: float = attr.ib(0.0)
+    cutting_distance: float = attr.ib(0.0)
+    air_distance: float = attr.ib(0.0)
+    collisions: List[Collision] = attr.ib(factory=list)
+
+    @property
+    def air_cut(self) -> float:
+        """
+        Percentage of the cutting distance that cut nothing.
+        """
+        if self.cutting_distance <= 0:
+            return 0.0
+        return 100 * self.air_distance / self.cutting_distance
+
+    def __str__(self) -> str:
+
+        out = [
+            f"removed {self.removed:.4f}, remaining {self.remaining:.4f}",
+            f"air cutting {self.air_cut:.1f}% of {self.cutting_distance:.4f}",
+        ]
+        out.extend(
+            f"rapid through material on line {c.line} at {c.position},"
+            f" {c.depth:.4f} deep"
+            for c in self.collisions
+        )
+        return "\n".join(out)
+
+
+class Stock:
+    """
+    A rectangular block of material, as a heightmap.
+
+    Args:
+      lo: Lowest corner of the block, (x, y, z).
+      hi: Highest corner. The grid is rounded up to whole cells in X and Y.
+      resolution: Width of the cells.
+
+    Attributes:
+      heights: Height of the top of the material in each cell, indexed by
+        row (Y) then column (X).
+      origin: XY corner of the first cell.
+      bottom: Height of the bottom of the block.
+    """
+
+    def __init__(self, lo: Sequence[float], hi: Sequence[float], resolution: float):
+        if resolution <= 0:
+            raise ValueError("resolution must be positive")
+        low = np.asarray(lo, dtype=np.float64)
+        high = np.asarray(hi, dtype=np.float64)
+        if low.shape != (3,) or high.shape != (3,) or np.any(high <= low):
+            raise ValueError("hi must be above lo in X, Y and Z")
+
+        self.resolution = resolution
+        self.origin = low[:2]
+        self.bottom = float(low[2])
+        cols, rows = np.ceil((high[:2] - low[:2]) / resolution).astype(np.intp)
+        self.heights = np.full((rows, cols), high[2])
+
+    @property
+    def volume(self) -> float:
+        """
+        Volume of the material left.
+        """
+        return float(np.sum(self.heights - self.bottom)) * self.resolution**2
+
+
+def _lowest(
+    tool: Tool,
+    start: np.ndarray,
+    end: np.ndarray,
+    piece: np.ndarray,
+    x: np.ndarray,
+    y: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    How low the bottom of a tool moving in straight pieces from start to end,
+    N x 3, gets over the cell centres x, y of each piece. inf where it does
+    not pass over them.
+
+    Returns:
+      The lowest heights, and the times from 0 to 1 along the pieces they
+      are reached.
+    """
+    r = tool.radius
+    ab = end - start
+    qx = start[piece, 0] - x
+    qy = start[piece, 1] - y
+    # the distance to the cell squared is l2 t^2 + 2 bt + c + r^2 at time t
+    l2 = np.einsum("ij,ij->i", ab[:, :2], ab[:, :2])[piece]
+    bt = qx * ab[piece, 0] + qy * ab[piece, 1]
+    c = qx * qx + qy * qy - r * r
+
+    moving = l2 > 1e-24
+    l2 = np.where(moving, l2, 1.0)
+    disc = bt * bt - l2 * c
+    root = np.sqrt(np.maximum(disc, 0))
+    t0 = np.where(moving, (-bt - root) / l2, 0.0)
+    t1 = np.where(moving, (-bt + root) / l2, 1.0)
+    reach = np.where(moving, disc >= 0, c <= 0) & (t0 <= 1) & (t1 >= 0)
+    t0 = np.clip(t0, 0, 1)
+    t1 = np.clip(t1, 0, 1)
+
+    z0 = start[piece, 2]
+    dz = ab[piece, 2]
+    if not tool.ball:
+        # the bottom is flat, the lowest point is at one end of the time
+        # it is over the cell
+        when = np.where(dz < 0, t1, t0)
+        return np.where(reach, z0 + dz * when, np.inf), when
+
+    # the height of the ball over the cell is convex in t, so the lowest
+    # point is where its slope changes sign
+    l2 = np.where(moving, l2, 0.0)
+    for _ in range(_BALL_STEPS):
+        t = (t0 + t1) / 2
+        under = np.sqrt(np.maximum(-(l2 * t * t + 2 * bt * t + c), 1e-300))
+        rising = dz + (l2 * t + bt) / under > 0
+        t1 = np.where(rising, t, t1)
+        t0 = np.where(rising, t0, t)
+    t = (t0 + t1) / 2
+    under = np.sqrt(np.maximum(-(l2 * t * t + 2 * bt * t + c), 0))
+    return np.where(reach, z0 + dz * t + r - under, np.inf), t
+
+
+def _first_below(
+    tool: Tool,
+    start: np.ndarray,
+    end: np.ndarray,
+    piece: np.ndarray,
+    x: np.ndarray,
+    y: np.ndarray,
+    level: np.ndarray,
+    last: np.ndarray,
+) -> np.ndarray:
+    """
+    The first time from 0 to 1 along each piece that the bottom of the tool
+    is at or below level over the cell centre x, y, given a time last when it
+    is. Until its lowest point the tool only gets lower over the cell, so the
+    time is found by halving.
+    """
+    r = tool.radius
+    ab = (end - start)[piece]
+    t0 = np.zeros(len(piece))
+    t1 = last.copy()
+    for _ in range(_BALL_STEPS):
+        t = (t0 + t1) / 2
+        at = start[piece] + ab * t[:, None]
+        d2 = (at[:, 0] - x) ** 2 + (at[:, 1] - y) ** 2
+        bottom = at[:, 2]
+        if tool.ball:
+            bottom = bottom + r - np.sqrt(np.maximum(r * r - d2, 0))
+        under = (d2 <= r * r) & (bottom <= level)
+        t1 = np.where(under, t, t1)
+        t0 = np.where(under, t0, t)
+    return t1
+
+
+class _Simulator:
+    """
+    Cuts the stock with batches of moves.
+    """
+
+    def __init__(
+        self,
+        stock: Stock,
+        tolerance: float,
+        tile_size: int,
+        executor: Optional[Executor],
+        result: Simulation,
+    ):
+        self.stock = stock
+        self.tolerance = tolerance
+        self.tile_size = tile_size
+        self.executor = executor
+        self.result = result
+        self.tool: Optional[Tool] = None
+
+    def run(self, moves: List[Move]):
+        """
+        Cuts with motion moves, which follow on from each other.
+        """
+        if not moves:
+            return
+        if self.tool is None:
+            raise ValueError("There is no Tool for the tool in the machine")
+        tool = self.tool
+
+        # moves are split into pieces no longer than the tool radius, so the
+        # cells around each piece are mostly ones it passes over
+        points, counts = _path(moves, self.tolerance)
+        move = np.repeat(np.arange(len(moves)), counts)
+        a, b = points[:-1], points[1:]
+        length = np.hypot(*(b - a)[:, :2].T)
+        step = max(tool.radius, self.stock.resolution)
+        n = np.maximum(np.ceil(length / step), 1).astype(np.intp)
+        segment = np.repeat(np.arange(len(n)), n)
+        first = np.cumsum(n) - n
+        t = ((np.arange(n.sum()) - first[segment]) / n[segment])[:, None]
+        u = t + 1 / n[segment, None]
+        start = a[segment] + (b - a)[segment] * t
+        end = a[segment] + (b - a)[segment] * u
+        end[first + n - 1] = b
+        move = move[segment]
+
+        kind = np.array([m.kind for m in moves])[move]
+        rapid = kind == parser.RAPID
+        removed, depth, contact = self._cut(tool, start, end, rapid)
+
+        distance = np.linalg.norm(end - start, axis=1)
+        # a cut that takes less than tolerance off the width of the tool is
+        # air, it is rounding or going over the same place again
+        least = self.tolerance * tool.diameter * np.maximum(distance, step)
+        air = ~rapid & (removed <= least)
+        self.result.cutting_distance += float(distance[~rapid].sum())
+        self.result.air_distance += float(distance[air].sum())
+
+        hit = np.flatnonzero(rapid & (depth > self.tolerance))
+        if hit.size:
+            deepest = np.zeros(len(moves))
+            np.maximum.at(deepest, move[hit], depth[hit])
+            hit_moves, firsts = np.unique(move[hit], return_index=True)
+            pieces = hit[firsts]
+            at = start[pieces] + (end - start)[pieces] * contact[pieces, None]
+            for k, position in zip(hit_moves.tolist(), at.tolist()):
+                self.result.collisions.append(
+                    Collision(
+                        moves[k].line,
+                        tuple(position),  # type: ignore[arg-type]
+                        float(deepest[k]),
+                    )
+                )
+
+    def _cut(
+        self, tool: Tool, start: np.ndarray, end: np.ndarray, watch: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Cuts with pieces in order.
+
+        Returns:
+          The volume each piece removes, the deepest it cuts, and for the
+          pieces in the watch mask the first time from 0 to 1 along them
+          that they go into material, inf if they don't.
+        """
+        stock = self.stock
+        res = stock.resolution
+        rows, cols = stock.heights.shape
+        reach = tool.radius
+        lo = np.minimum(start[:, :2], end[:, :2]) - reach
+        hi = np.maximum(start[:, :2], end[:, :2]) + reach
+        # first and last cell each piece may be over, by column and row
+        c0 = np.ceil((lo - stock.origin) / res - 0.5).astype(np.intp)
+        c1 = np.floor((hi - stock.origin) / res - 0.5).astype(np.intp)
+        c0 = np.maximum(c0, 0)
+        c1 = np.minimum(c1, [cols - 1, rows - 1])
+        lowest = np.minimum(start[:, 2], end[:, 2])
+        live = np.all(c0 <= c1, axis=1) & (lowest < stock.heights.max(initial=-np.inf))
+
+        # every tile each piece may be over
+        piece = np.flatnonzero(live)
+        t0 = c0[piece] // self.tile_size
+        t1 = c1[piece] // self.tile_size
+        span = t1 - t0 + 1
+        count = span[:, 0] * span[:, 1]
+        pair = np.repeat(np.arange(len(piece)), count)
+        k = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        tx = t0[pair, 0] + k % span[pair, 0]
+        ty = t0[pair, 1] + k // span[pair, 0]
+        tiles_across = -(-cols // self.tile_size)
+        key = ty * tiles_across + tx
+        order = np.argsort(key, kind="stable")
+        key, pair = key[order], piece[pair[order]]
+        bounds = np.flatnonzero(np.diff(key)) + 1
+        jobs = [
+            (int(k[0]), p)
+            for k, p in zip(np.split(key, bounds), np.split(pair, bounds))
+            if len(k)
+        ]
+
+        def tile(job):
+            number, pieces = job
+            return pieces, self._tile(
+                tool,
+                number,
+                start[pieces],
+                end[pieces],
+                c0[pieces],
+                c1[pieces],
+                watch[pieces],
+            )
+
+        removed = np.zeros(len(start))
+        depth = np.zeros(len(start))
+        contact = np.full(len(start), np.inf)
+        done = (
+            map(tile, jobs) if self.executor is None else self.executor.map(tile, jobs)
+        )
+        for pieces, (volume, deepest, first) in done:
+            removed[pieces] += volume
+            np.maximum.at(depth, pieces, deepest)
+            np.minimum.at(contact, pieces, first)
+        return removed, depth, contact
+
+    def _tile(
+        self,
+        tool: Tool,
+        number: int,
+        start: np.ndarray,
+        end: np.ndarray,
+        c0: np.ndarray,
+        c1: np.ndarray,
+        watch: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Cuts the cells of one tile with pieces in order.
+
+        Returns:
+          The volume each piece removes from the tile, the deepest it cuts
+          in it, and when the watched ones first go into material in it.
+        """
+        stock = self.stock
+        size = self.tile_size
+        rows, cols = stock.heights.shape
+        tiles_across = -(-cols // size)
+        y0, x0 = number // tiles_across * size, number % tiles_across * size
+        # a copy of the tile, so cells are next to each other
+        window = stock.heights[y0 : y0 + size, x0 : x0 + size]
+        heights = window.copy()
+        h, w = heights.shape
+
+        # the cells of the tile each piece may be over
+        lo = np.maximum(c0 - [x0, y0], 0)
+        hi = np.minimum(c1 - [x0, y0], [w - 1, h - 1])
+        span = hi - lo + 1
+        count = span[:, 0] * span[:, 1]
+        removed = np.zeros(len(start))
+        depth = np.zeros(len(start))
+        contact = np.full(len(start), np.inf)
+        total = np.cumsum(count)
+        first = 0
+        while first < len(count):
+            limit = total[first] - count[first] + _BATCH
+            last = max(int(np.searchsorted(total, limit, side="right")), first + 1)
+            self._batch(
+                tool,
+                heights,
+                (x0, y0),
+                start[first:last],
+                end[first:last],
+                lo[first:last],
+                span[first:last],
+                watch[first:last],
+                removed[first:last],
+                depth[first:last],
+                contact[first:last],
+            )
+            first = last
+        window[:] = heights
+        return removed, depth, contact
+
+    def _batch(
+        self,
+        tool: Tool,
+        heights: np.ndarray,
+        corner: Tuple[int, int],
+        start: np.ndarray,
+        end: np.ndarray,
+        lo: np.ndarray,
+        span: np.ndarray,
+        watch: np.ndarray,
+        removed: np.ndarray,
+        depth: np.ndarray,
+        contact: np.ndarray,
+    ):
+        """
+        Cuts cells of a tile with some pieces in order, adding up what each
+        piece removes in removed, depth and, for watched pieces, contact.
+        """
+        stock = self.stock
+        res = stock.resolution
+        w = heights.shape[1]
+        cells = heights.ravel()
+
+        # each row of cells each piece may be over, then each cell in them
+        across, down = span[:, 0], span[:, 1]
+        piece = np.repeat(np.arange(len(down)), down)
+        row = (
+            lo[piece, 1]
+            + np.arange(len(piece))
+            - np.repeat(np.cumsum(down) - down, down)
+        )
+        across = across[piece]
+        skip = np.cumsum(across) - across
+        flat = np.repeat(row * w + lo[piece, 0] - skip, across)
+        flat += np.arange(len(flat))
+        x = np.repeat(
+            stock.origin[0] + (corner[0] + lo[piece, 0] - skip + 0.5) * res, across
+        )
+        x += np.arange(len(flat)) * res
+        y = np.repeat(stock.origin[1] + (corner[1] + row + 0.5) * res, across)
+        piece = np.repeat(piece, across)
+
+        # pieces only cut where they go below what is there
+        below = np.minimum(start[:, 2], end[:, 2])[piece] < cells[flat]
+        piece, flat, x, y = piece[below], flat[below], x[below], y[below]
+        low, when = _lowest(tool, start, end, piece, x, y)
+        low = np.maximum(low, stock.bottom)
+        pair = np.flatnonzero(low < cells[flat])
+        if not len(pair):
+            return
+        piece, low, flat = piece[pair], low[pair], flat[pair]
+
+        # cells are cut by the pieces over them in order, a piece removes
+        # what is left above it after the ones before it
+        order = np.argsort(flat, kind="stable")
+        flat, low, piece, pair = flat[order], low[order], piece[order], pair[order]
+        new = np.concatenate([[True], flat[1:] != flat[:-1]])
+        group = np.cumsum(new) - 1
+        # a running minimum over each cell, by moving earlier cells up out of
+        # the way of later ones
+        gap = float(low.max() - low.min()) + 1
+        lift = (group[-1] - group) * gap
+        running = np.minimum.accumulate(low + lift) - lift
+        before = cells[flat]
+        before[~new] = np.minimum(before[~new], running[:-1][~new[1:]])
+        cut = np.maximum(before - low, 0)
+        removed += np.bincount(piece, cut, minlength=len(removed)) * res * res
+        np.maximum.at(depth, piece, cut)
+
+        # when watched pieces first go below what is there
+        hit = watch[piece] & (cut > 0)
+        if hit.any():
+            k = pair[hit]
+            first = _first_below(
+                tool, start, end, piece[hit], x[k], y[k], before[hit], when[k]
+            )
+            np.minimum.at(contact, piece[hit], first)
+
+        last = np.concatenate([np.flatnonzero(new[1:]), [len(flat) - 1]])
+        cells[flat[last]] = np.minimum(cells[flat[last]], running[last])
+
+
+def simulate(
+    source: Union[str, os.PathLike, Iterable[Move]],
+    stock: Stock,
+    tool: Union[Tool, Mapping[int, Tool]],
+    tolerance: Optional[float] = None,
+    tile_size: int = 256,
+    workers: Optional[int] = None,
+    chunk_size: int = 1 << 16,
+) -> Simulation:
+    """
+    Cuts stock with a program.
+
+    Rapid moves cut too, as the tool would, and are reported if they go
+    through material. A cutting move that removes less than tolerance from
+    the width of the tool over its length counts as cutting air.
+
+    Args:
+      source: Path to a g-code file, or Move records from gmcode.parser or
+        gmcode.recorder.Recorder.moves.
+      stock: The material, which is cut in place.
+      tool: The tool, or the tool for each tool number that is changed to.
+      tolerance: Largest distance arcs are moved by splitting them into
+        lines, and the depth of cut ignored. Defaults to a quarter of the
+        stock resolution.
+      tile_size: Width of the tiles of cells, in cells.
+      workers: Number of threads, defaults to the number of CPUs.
+      chunk_size: Number of moves cut at once.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        source = parser.parse(source, use_mmap=True)
+    if tolerance is None:
+        tolerance = stock.resolution / 4
+    if tile_size < 1:
+        raise ValueError("tile_size must be at least 1")
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    result = Simulation()
+    initial = stock.volume
+    executor = ThreadPoolExecutor(workers) if workers > 1 else None
+    try:
+        simulator = _Simulator(stock, tolerance, tile_size, executor, result)
+        if isinstance(tool, Tool):
+            simulator.tool = tool
+        moves: List[Move] = []
+        for move in source:
+            if move.kind in parser.MOTION_KINDS:
+                moves.append(move)
+                if len(moves) >= chunk_size:
+                    simulator.run(moves)
+                    moves = []
+            elif move.kind == parser.TOOLCHANGE and not isinstance(tool, Tool):
+                simulator.run(moves)
+                moves = []
+                number = int(move.value)
+                if number not in tool:
+                    raise ValueError(f"There is no Tool for tool {number}")
+                simulator.tool = tool[number]
+        simulator.run(moves)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    result.remaining = stock.volume
+    result.removed = initial - result.remaining
+    return result
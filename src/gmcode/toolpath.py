@@ -0,0 +1,232 @@
+"""
+Columnar storage for long sequences of lines and arcs.
+"""
+
+import attr
+import numpy as np
+from typing import Iterator, List, Optional, Sequence, Union, overload
+from gmcode.geom import Vector, VectorArray, PathElement, Line, ArcXY, TOLERANCE
+
+LINE = 0
+ARC = 1
+
+
+def _as_vectorarray(val) -> VectorArray:
+
+    return val if isinstance(val, VectorArray) else VectorArray(val)
+
+
+def _as_kinds(val) -> np.ndarray:
+
+    return np.ascontiguousarray(val, dtype=np.int8).reshape(-1)
+
+
+def _as_flags(val) -> np.ndarray:
+
+    return np.ascontiguousarray(val, dtype=np.bool_).reshape(-1)
+
+
+def _as_floats(val) -> np.ndarray:
+
+    return np.ascontiguousarray(val, dtype=np.float64).reshape(-1)
+
+
+@attr.s(auto_detect=True, frozen=True, slots=True, eq=False)  # type: ignore[call-overload]
+class Toolpath:
+    """
+    A sequence of lines and arcs, stored as one array per attribute instead of
+    one object per element.
+
+    Attributes:
+      kind: LINE or ARC for each element.
+      start: Start point of each element.
+      end: End point of each element.
+      centre: Arc centres, ignored for lines.
+      cw: Arc directions, ignored for lines.
+      feed: Feedrate to set before each element, nan to keep the current
+        feedrate.
+
+    Machine.cut accepts a Toolpath and writes it out without creating any
+    PathElement objects.
+    """
+
+    kind: np.ndarray = attr.ib(converter=_as_kinds)
+    start: VectorArray = attr.ib(converter=_as_vectorarray)
+    end: VectorArray = attr.ib(converter=_as_vectorarray)
+    centre: VectorArray = attr.ib(converter=_as_vectorarray)
+    cw: np.ndarray = attr.ib(converter=_as_flags)
+    feed: np.ndarray = attr.ib(converter=_as_floats)
+
+    def __attrs_post_init__(self):
+
+        n = len(self.kind)
+        columns = [self.start, self.end, self.centre, self.cw, self.feed]
+        if any(len(c) != n for c in columns):
+            raise ValueError("All Toolpath columns must be the same length")
+
+    @staticmethod
+    def _feeds(feed: Union[None, float, Sequence[float], np.ndarray], n: int):
+
+        if feed is None:
+            return np.full(n, np.nan)
+        return np.broadcast_to(np.asarray(feed, dtype=np.float64), (n,))
+
+    @classmethod
+    def lines(
+        cls,
+        points: Union[VectorArray, np.ndarray],
+        feed: Union[None, float, np.ndarray] = None,
+    ) -> "Toolpath":
+        """
+        A polyline through points. Produces len(points) - 1 lines.
+
+        Args:
+          points: N x 3 array of points.
+          feed: Feedrate of every line, or one feedrate per line.
+        """
+        points = _as_vectorarray(points).data
+        n = max(len(points) - 1, 0)
+        return cls(
+            kind=np.full(n, LINE),
+            start=points[:-1],
+            end=points[1:],
+            centre=np.zeros((n, 3)),
+            cw=np.zeros(n, dtype=bool),
+            feed=cls._feeds(feed, n),
+        )
+
+    @classmethod
+    def arcs(
+        cls,
+        start: Union[VectorArray, np.ndarray],
+        end: Union[VectorArray, np.ndarray],
+        centre: Union[VectorArray, np.ndarray],
+        cw: Union[bool, np.ndarray] = True,
+        feed: Union[None, float, np.ndarray] = None,
+    ) -> "Toolpath":
+        """
+        A sequence of XY plane arcs. Unlike ArcXY the radii are not checked.
+        """
+        start = _as_vectorarray(start)
+        n = len(start)
+        return cls(
+            kind=np.full(n, ARC),
+            start=start,
+            end=end,
+            centre=centre,
+            cw=np.broadcast_to(np.asarray(cw, dtype=bool), (n,)),
+            feed=cls._feeds(feed, n),
+        )
+
+    @classmethod
+    def from_elements(
+        cls, paths: Sequence[PathElement], feed: Optional[float] = None
+    ) -> "Toolpath":
+        """
+        Converts a list of Line and ArcXY objects.
+        """
+        kind = []
+        centre = []
+        cw = []
+        for p in paths:
+            if isinstance(p, Line):
+                kind.append(LINE)
+                centre.append((0.0, 0.0, 0.0))
+                cw.append(False)
+            elif isinstance(p, ArcXY):
+                kind.append(ARC)
+                centre.append(tuple(p.centre))
+                cw.append(p.cw)
+            else:
+                raise TypeError(f"Toolpath can not hold type {type(p)}")
+
+        return cls(
+            kind=kind,
+            start=VectorArray.from_vectors(p.start for p in paths),
+            end=VectorArray.from_vectors(p.end for p in paths),
+            centre=centre,
+            cw=cw,
+            feed=cls._feeds(feed, len(paths)),
+        )
+
+    @classmethod
+    def concatenate(cls, toolpaths: Sequence["Toolpath"]) -> "Toolpath":
+
+        if not toolpaths:
+            return cls.lines(np.zeros((0, 3)))
+
+        return cls(
+            kind=np.concatenate([t.kind for t in toolpaths]),
+            start=np.concatenate([t.start.data for t in toolpaths]),
+            end=np.concatenate([t.end.data for t in toolpaths]),
+            centre=np.concatenate([t.centre.data for t in toolpaths]),
+            cw=np.concatenate([t.cw for t in toolpaths]),
+            feed=np.concatenate([t.feed for t in toolpaths]),
+        )
+
+    def __add__(self, o: "Toolpath") -> "Toolpath":
+
+        return self.concatenate([self, o])
+
+    def __len__(self) -> int:
+
+        return len(self.kind)
+
+    def _element(self, idx: int) -> PathElement:
+
+        if self.kind[idx] == ARC:
+            return ArcXY(
+                start=self.start[idx],
+                end=self.end[idx],
+                centre=self.centre[idx],
+                cw=bool(self.cw[idx]),
+            )
+        return Line(self.start[idx], self.end[idx])
+
+    @overload
+    def __getitem__(self, idx: int) -> PathElement: ...
+
+    @overload
+    def __getitem__(self, idx: Union[slice, np.ndarray]) -> "Toolpath": ...
+
+    def __getitem__(self, idx):
+
+        if isinstance(idx, (int, np.integer)):
+            return self._element(idx)
+
+        return self.__class__(
+            kind=self.kind[idx],
+            start=self.start[idx],
+            end=self.end[idx],
+            centre=self.centre[idx],
+            cw=self.cw[idx],
+            feed=self.feed[idx],
+        )
+
+    def __iter__(self) -> Iterator[PathElement]:
+
+        for idx in range(len(self)):
+            yield self._element(idx)
+
+    def to_elements(self) -> List[PathElement]:
+
+        return list(self)
+
+    def gaps(self, start: Optional[Vector] = None, tolerance: float = TOLERANCE):
+        """
+        Indices of elements that don't start where the previous element ended.
+
+        Args:
+          start: If given, the first element is checked against this point.
+          tolerance: Largest allowable distance between points.
+        """
+        if len(self) == 0:
+            return np.zeros(0, dtype=np.intp)
+
+        prev_end = self.end.data[:-1]
+        if start is not None:
+            prev_end = np.vstack([[tuple(start)], prev_end])
+        starts = self.start.data[len(self) - len(prev_end) :]
+        diff = starts - prev_end
+        sq_dist = np.einsum("ij,ij->i", diff, diff)
+        return np.flatnonzero(sq_dist >= tolerance**2) + len(self) - len(prev_end)
@@ -0,0 +1,278 @@
+"""
+Checking a g-code program against a known good one.
+
+compare memory maps both files and compares the moves in them rather than the
+text, so two programs match if they move the same way to within a tolerance,
+eg. the accuracy of the Machine that wrote them, even if the numbers are
+formatted differently.
+
+Regenerated programs are mostly the same bytes as before. The text the two
+files start and end with in common is found with block compares of the
+memory maps. Moves in it are not compared: the start is only scanned once,
+counting its moves without making them, to get the modal state where the
+files first differ, and the end is not parsed at all if the files are in the
+same state when they reach it. The scan still reads every line of the start,
+so it takes time in proportion to its length, though much less than parsing.
+"""
+
+import attr
+import mmap
+import os
+import numpy as np
+from itertools import zip_longest
+from typing import Iterator, List, Optional, Tuple, Union
+from gmcode.parser import Move, Parser, ParserState
+
+# bytes compared at once looking for the first difference
+_BLOCK = 1 << 20
+
+
+@attr.s(auto_detect=True, frozen=True, slots=True)  # type: ignore[call-overload]
+class Difference:
+    """
+    A pair of moves that do not match.
+
+    Attributes:
+      index: Number of the move in the programs, counting from 0.
+      a: The move in the first program, None if it has no more moves.
+      b: The move in the second program, None if it has no more moves.
+      reason: The first thing that differs: "missing", "kind", "end",
+        "centre", "turns", "plane", "feed", "value" or "blend".
+    """
+
+    index: int = attr.ib()
+    a: Optional[Move] = attr.ib()
+    b: Optional[Move] = attr.ib()
+    reason: str = attr.ib()
+
+    def __str__(self) -> str:
+
+        a, b = (
+            "nothing" if move is None else f"line {move.line}: {move}"
+            for move in (self.a, self.b)
+        )
+        return f"move {self.index}, {self.reason} differs: {a} != {b}"
+
+
+@attr.s(auto_detect=True, frozen=True, slots=True)  # type: ignore[call-overload]
+class Comparison:
+    """
+    The result of compare.
+
+    Attributes:
+      differences: The first pairs of moves that do not match.
+      moves: Number of pairs of moves compared one by one.
+      common_bytes: Length of the text the files start and end with in
+        common, whose moves were not compared.
+    """
+
+    differences: List[Difference] = attr.ib(factory=list)
+    moves: int = attr.ib(0)
+    common_bytes: int = attr.ib(0)
+
+    @property
+    def matches(self) -> bool:
+
+        return not self.differences
+
+    def __str__(self) -> str:
+
+        if self.matches:
+            return (
+                f"match, {self.moves} moves compared and {self.common_bytes}"
+                " bytes the same"
+            )
+        return "\n".join(str(d) for d in self.differences)
+
+
+def _different(a: Optional[Move], b: Optional[Move], tolerance: float) -> str:
+    """
+    Why two moves do not match, or "" if they do.
+    """
+    if a is None or b is None:
+        return "missing"
+    # numbers rounded to the same places can be tolerance apart, give or take
+    # the error in reading them
+    tolerance *= 1 + 1e-9
+    if a.kind != b.kind:
+        return "kind"
+    if any(abs(p - q) > tolerance for p, q in zip(a.end, b.end)):
+        return "end"
+    if (a.centre is None) != (b.centre is None) or (
+        a.centre is not None
+        and b.centre is not None
+        and any(abs(p - q) > tolerance for p, q in zip(a.centre, b.centre))
+    ):
+        return "centre"
+    if a.turns != b.turns:
+        return "turns"
+    if a.plane != b.plane:
+        return "plane"
+    if (a.feed is None) != (b.feed is None) or (
+        a.feed is not None and b.feed is not None and abs(a.feed - b.feed) > tolerance
+    ):
+        return "feed"
+    if abs(a.value - b.value) > tolerance:
+        return "value"
+    if a.blend != b.blend and not abs(a.blend - b.blend) <= tolerance:
+        return "blend"
+    return ""
+
+
+def _buffer(path: Union[str, os.PathLike]) -> Union[mmap.mmap, bytes]:
+    """
+    The file memory mapped, empty files can not be.
+    """
+    with open(path, "rb") as f0:
+        if os.fstat(f0.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f0.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _first_difference(a, b, n: int, backwards: bool = False) -> int:
+    """
+    Number of bytes a and b have in common at the start, or the end, looking
+    at no more than n.
+    """
+    done = 0
+    while done < n:
+        size = min(_BLOCK, n - done)
+        if backwards:
+            x = a[len(a) - done - size : len(a) - done]
+            y = b[len(b) - done - size : len(b) - done]
+        else:
+            x, y = a[done : done + size], b[done : done + size]
+        if x != y:
+            unequal = np.frombuffer(x, np.uint8) != np.frombuffer(y, np.uint8)
+            if backwards:
+                return done + int(np.argmax(unequal[::-1]))
+            return done + int(np.argmax(unequal))
+        done += size
+    return n
+
+
+def _common(a, b) -> Tuple[int, int]:
+    """
+    Lengths of the whole lines a and b start and end with in common.
+    """
+    n = min(len(a), len(b))
+    prefix = _first_difference(a, b, n)
+    if prefix < len(a) or prefix < len(b):
+        prefix = a.rfind(b"\n", 0, prefix) + 1
+    suffix = _first_difference(a, b, n - prefix, backwards=True)
+
+    # the common end has to start at the start of a line in both
+    start = len(a) - suffix
+    if suffix and start > 0 and (a[start - 1] != 10 or b[len(b) - suffix - 1] != 10):
+        newline = a.find(b"\n", start)
+        suffix = len(a) - newline - 1 if newline >= 0 else 0
+    return prefix, suffix
+
+
+def _lines(buffer, start: int, stop: int) -> Iterator[str]:
+
+    while start < stop:
+        end = buffer.find(b"\n", start, stop)
+        end = stop if end < 0 else end + 1
+        yield buffer[start:end].decode("utf-8")
+        start = end
+
+
+def _moves(parser: Parser, lines: Iterator[str], first: int) -> Iterator[Move]:
+    """
+    Parses lines, numbering them from first.
+    """
+    for number, text in enumerate(lines, first):
+        yield from parser.parse_line(text, number)
+
+
+def compare(
+    a: Union[str, os.PathLike],
+    b: Union[str, os.PathLike],
+    tolerance: float = 1e-4,
+    limit: int = 10,
+    state: Optional[ParserState] = None,
+) -> Comparison:
+    """
+    Compares the moves of two uncompressed g-code files.
+
+    Moves are compared in order, one pair at a time: their kinds, turns and
+    planes have to be the same, and their end points, arc centres,
+    feedrates, dwell times and blending tolerances within tolerance.
+    Comments and the way numbers are written don't matter.
+
+    Args:
+      a: A known good program.
+      b: The program to check.
+      tolerance: Largest difference allowed, eg. the accuracy of the Machine
+        that wrote the programs.
+      limit: Number of differences to find before stopping.
+      state: Starting modal state, see gmcode.parser.Parser.
+
+    Returns:
+      The differences found, none if the programs match.
+    """
+    buffers = [_buffer(a), _buffer(b)]
+    try:
+        return _compare(buffers[0], buffers[1], tolerance, limit, state)
+    finally:
+        for buffer in buffers:
+            if isinstance(buffer, mmap.mmap):
+                buffer.close()
+
+
+def _compare(a, b, tolerance, limit, state) -> Comparison:
+
+    prefix, suffix = _common(a, b)
+    if prefix == len(a) == len(b):
+        return Comparison(common_bytes=prefix)
+
+    # the start is the same in both, only its modal state and the number of
+    # moves in it are needed
+    first = Parser(state)
+    line = 1
+    count = 0
+    for number, text in enumerate(_lines(a, 0, prefix), 1):
+        count += first.scan_line(text, number)
+        line = number + 1
+    second = first.copy()
+
+    differences: List[Difference] = []
+    compared = 0
+
+    def check(pairs):
+        nonlocal compared
+        for x, y in pairs:
+            reason = _different(x, y, tolerance)
+            compared += 1
+            if reason:
+                differences.append(Difference(count + compared - 1, x, y, reason))
+                if len(differences) >= limit:
+                    return True
+        return False
+
+    ends = len(a) - suffix, len(b) - suffix
+    middle = [_lines(a, prefix, ends[0]), _lines(b, prefix, ends[1])]
+    numbers = [line, line]
+
+    def numbered(k):
+        for text in middle[k]:
+            numbers[k] += 1
+            yield text
+
+    done = check(
+        zip_longest(_moves(first, numbered(0), line), _moves(second, numbered(1), line))
+    )
+
+    # the end is the same text, which moves the same way if the state is too
+    same = first.state == second.state and first.subroutines == second.subroutines
+    if not done and suffix and not same:
+        check(
+            zip_longest(
+                _moves(first, _lines(a, ends[0], len(a)), numbers[0]),
+                _moves(second, _lines(b, ends[1], len(b)), numbers[1]),
+            )
+        )
+        suffix = 0
+
+    return Comparison(differences, compared, prefix + suffix)
@@ -0,0 +1,152 @@
+import io
+import struct
+import zlib
+import numpy as np
+import pytest
+import xml.etree.ElementTree as ET
+from gmcode import Machine, Vector, functions
+from gmcode.backplot import (
+    Backplot,
+    BACKGROUND,
+    RAPID_COLOUR,
+    backplot,
+    encode_png,
+)
+from gmcode.parser import parse
+from gmcode.recorder import Recorder
+
+
+def decode_png(data):
+    """
+    The pixels of a PNG written by encode_png.
+    """
+    assert data[:8] == b"\x89PNG\r\n\x1a\n"
+    chunks = {}
+    pos = 8
+    while pos < len(data):
+        (length,) = struct.unpack(">I", data[pos : pos + 4])
+        tag = data[pos + 4 : pos + 8]
+        body = data[pos + 8 : pos + 8 + length]
+        (crc,) = struct.unpack(">I", data[pos + 8 + length : pos + 12 + length])
+        assert crc == zlib.crc32(tag + body)
+        chunks[tag] = body
+        pos += 12 + length
+    width, height = struct.unpack(">II", chunks[b"IHDR"][:8])
+    rows = np.frombuffer(zlib.decompress(chunks[b"IDAT"]), np.uint8)
+    rows = rows.reshape(height, 1 + 3 * width)
+    assert np.all(rows[:, 0] == 0)
+    return rows[:, 1:].reshape(height, width, 3)
+
+
+def test_encode_png():
+    image = np.random.default_rng(0).integers(0, 256, (7, 5, 3), dtype=np.uint8)
+    assert np.array_equal(decode_png(encode_png(image)), image)
+
+
+def program():
+    text = io.StringIO()
+    m = Machine(text)
+    m.std_init()
+    m.feedrate(300)
+    m.g0(0, 0, 5)
+    m.g0(z=0)
+    m.g1(z=-1)
+    m.g1(100, 0)
+    m.g1(100, 50)
+    m.g1(0, 50, -2)
+    m.g1(0, 0)
+    m.g0(z=5)
+    m.g0(30, 25)
+    m.g0(z=0)
+    # a helix down to -3, 5 around (25, 25)
+    functions.helical_entry(m, Vector(25, 25), final_height=-3, doc=1)
+    m.flush()
+    return text.getvalue().splitlines()
+
+
+def test_from_moves():
+    plot = Backplot.from_moves(parse(program()), tolerance=0.01)
+    assert len(plot.rapid) == len(plot.points) - 1
+    assert plot.points[0].tolist() == [0, 0, 0]
+    assert plot.points[-1] == pytest.approx([30, 25, -3])
+
+    # the helix goes 3 times around a circle of radius 5, within tolerance
+    helix = plot.points[np.flatnonzero(np.hypot(*(plot.points[:, :2] - 25).T) < 6)]
+    assert np.hypot(*(helix[:, :2] - 25).T) == pytest.approx(5)
+    angles = np.unwrap(np.arctan2(helix[:, 1] - 25, helix[:, 0] - 25))
+    assert angles[0] - angles[-1] == pytest.approx(6 * np.pi)  # clockwise
+    chord = np.hypot(*np.diff(helix[:, :2], axis=0).T).max()
+    assert 5 * (1 - np.cos(chord / 10)) <= 0.01
+    assert np.all(np.diff(helix[:, 2]) < 0)
+
+    # the same from a recording
+    recorder = Recorder()
+    recorder.restore(Machine(io.StringIO()).snapshot())
+    recorder.feedrate(100)
+    recorder.g0(1, 0, 0)
+    recorder.arc(x=-1, y=0, i=0, j=0, cw=False)
+    plot = Backplot.from_moves(recorder.moves(), tolerance=0.01)
+    assert plot.rapid[0] and not plot.rapid[1:].any()
+    assert np.hypot(*plot.points[1:, :2].T) == pytest.approx(1)
+    assert np.all(plot.points[2:-1, 1] > 0)
+
+    empty = Backplot.from_moves([])
+    assert empty.image(100).shape == (100, 100, 3)
+    assert (empty.image(100) == BACKGROUND).all()
+
+
+def test_image(tmp_path):
+    plot = Backplot.from_moves(parse(program()))
+    image = plot.image(216)
+    view = plot.view(216)
+    assert image.shape == (view.height, 216, 3)
+    assert view.height == 116  # 100 x 50 and an 8 pixel margin
+
+    def pixel(x, y):
+        col, row = np.floor(view.pixels(np.array([[x, y]]))[0]).astype(int)
+        return tuple(image[min(row, view.height - 1), min(col, 215)].tolist())
+
+    assert pixel(50, 25) == BACKGROUND
+    # cuts go from 0 down to -3 in the helix
+    colours = Backplot._colours(np.array([0, 1 / 3, 2 / 3, 1])).tolist()
+    assert pixel(50, 0) == tuple(colours[1])
+    assert pixel(0, 25) == tuple(colours[2])
+    assert pixel(60, 50) not in (BACKGROUND, pixel(50, 0), pixel(0, 25))
+    assert np.abs(np.subtract(pixel(25, 30), colours[3])).max() < 30
+    # rapids are on top
+    assert pixel(0, 0) == RAPID_COLOUR
+    assert pixel(15, 12.5) == RAPID_COLOUR
+    assert pixel(20, 25) != BACKGROUND
+
+    path = tmp_path / "plot.png"
+    backplot(parse(program()), path, width=216)
+    assert np.array_equal(decode_png(path.read_bytes()), image)
+
+
+def test_svg(tmp_path):
+    path = tmp_path / "plot.svg"
+    Backplot.from_moves(parse(program())).write(path, width=300)
+    root = ET.parse(path).getroot()
+    assert root.get("width") == "300"
+    lines = root.findall("{http://www.w3.org/2000/svg}polyline")
+    dashed = [p for p in lines if p.get("stroke-dasharray")]
+    assert len(dashed) == 2
+    assert {p.get("stroke") for p in dashed} == {f"rgb{RAPID_COLOUR}"}
+    assert len({p.get("stroke") for p in lines}) > 3
+
+    with pytest.raises(ValueError):
+        Backplot.from_moves(parse(program())).write(tmp_path / "plot.jpg")
+
+
+def test_decimation():
+    # a million tiny moves on a small picture only draws a point or so a pixel
+    n = 1_000_000
+    t = np.linspace(0, 40 * np.pi, n)
+    points = np.stack([t * np.cos(t), t * np.sin(t), -t / 100], axis=1)
+    plot = Backplot(points, np.zeros(n - 1, dtype=bool))
+    view = plot.view(200)
+    kept = plot._decimated(view.pixels(points))
+    assert kept.sum() < n / 20
+    assert kept[0] and kept[-1]
+    image = plot.image(200)
+    assert (image != BACKGROUND).any(axis=2).sum() > 1000
@@ -0,0 +1,113 @@
+import io
+import pytest
+from gmcode import Machine, Vector, functions
+from gmcode.cache import OperationCache
+
+
+def pocket(m, centre, radius, depth=-1):
+    functions.helical_entry(m, centre, final_height=depth, doc=0.5)
+    functions.spiral(m, Vector(centre.x, centre.y, depth), radius, doc=0.3)
+    m.g0(z=5)
+    return radius
+
+
+def sheet(run):
+    text = io.StringIO()
+    with Machine(text) as m:
+        m.std_init()
+        m.feedrate(300)
+        for x in (0, 23.7, 50.1):
+            for y in (0, 17.3):
+                m.g0(x + 2, y, 5)
+                m.g0(z=0)
+                run(m, Vector(x, y), 6)
+    return text.getvalue()
+
+
+def test_cache_matches_direct():
+    cache = OperationCache()
+    cached = sheet(lambda m, centre, radius: cache.run(m, pocket, centre, radius))
+    assert cached == sheet(pocket)
+    assert cache.misses == 1
+    assert cache.hits == 5
+
+
+def test_cache_key():
+    cache = OperationCache()
+    spiral = cache.wrap(pocket)
+    m = Machine(io.StringIO())
+    m.feedrate(100)
+    m.g0(2, 0, 0)
+    assert spiral(m, Vector(), 3) == 3
+    m.g0(12, 0, 0)
+    spiral(m, Vector(10, 0), 3)
+    assert (cache.misses, cache.hits) == (1, 1)
+
+    # a different radius, depth, feedrate or start height is recorded again
+    m.g0(12, 0, 0)
+    spiral(m, Vector(10, 0), 3, depth=-2)
+    m.feedrate(200)
+    m.g0(12, 0, 0)
+    spiral(m, Vector(10, 0), 3)
+    m.g0(12, 0, 1)
+    spiral(m, Vector(10, 0), 3)
+    assert (cache.misses, cache.hits) == (4, 1)
+
+
+def test_cache_lru_and_persistence(tmp_path):
+    path = tmp_path / "cache.pkl"
+    cache = OperationCache(maxsize=2, path=path)
+    m = Machine(io.StringIO())
+    m.feedrate(100)
+    for radius in (3, 4, 5, 3):
+        m.g0(2, 0, 0)
+        cache.run(m, pocket, Vector(), radius)
+    assert len(cache) == 2
+    assert cache.misses == 4
+    cache.save()
+
+    loaded = OperationCache(path=path)
+    assert len(loaded) == 2
+    text = io.StringIO()
+    with Machine(text) as m:
+        m.feedrate(100)
+        m.g0(12, 0, 0)
+        loaded.run(m, pocket, Vector(10, 0), 3)
+    assert loaded.hits == 1
+    direct = io.StringIO()
+    with Machine(direct) as m:
+        m.feedrate(100)
+        m.g0(12, 0, 0)
+        pocket(m, Vector(10, 0), 3)
+    assert text.getvalue() == direct.getvalue()
+
+
+def make(depth):
+    def cut(m):
+        m.g1(z=-depth)
+
+    return cut
+
+
+def test_cache_key_code():
+    # lambdas, closures and defaults are told apart by their code and values
+    cache = OperationCache()
+
+    def run(func):
+        text = io.StringIO()
+        with Machine(text) as m:
+            m.feedrate(100)
+            m.g0(1, 1, 0)
+            cache.run(m, func)
+        return text.getvalue()
+
+    assert "Z-1.0000" in run(lambda m: m.g1(z=-1))
+    assert "Z-5.0000" in run(lambda m: m.g1(z=-5))
+    assert "G0 X3.0000" in run(lambda m: m.g0(x=2))  # relative to the start
+    assert "Z-2.0000" in run(make(2))
+    assert "Z-3.0000" in run(make(3))
+    assert "Z-4.0000" in run(lambda m, z=-4: m.g1(z=z))
+    assert "Z-6.0000" in run(lambda m, z=-6: m.g1(z=z))
+    assert cache.misses == 7
+    assert "Z-3.0000" in run(make(3))
+    assert cache.hits == 1
@@ -0,0 +1,118 @@
+import math
+import pytest
+from gmcode import Machine, Vector, functions
+from gmcode.estimate import estimate, MachineLimits
+from gmcode import parser
+from gmcode.parser import Move, parse, RAPID, LINEAR
+
+LIMITS = MachineLimits(rapid=(6000, 6000, 6000), acceleration=(500, 500, 500))
+
+
+def line_time(length, speed, accel):
+    # accelerate to speed, cruise, decelerate to a stop
+    return 2 * speed / accel + (length - speed**2 / accel) / speed
+
+
+def test_single_rapid():
+    moves = [Move(RAPID, (0, 0, 0), (1000, 0, 0))]
+    result = estimate(moves, LIMITS)
+    assert result.total == pytest.approx(line_time(1000, 100, 500))
+    assert result.rapid_distance == pytest.approx(1000)
+    assert result.moves == 1
+
+
+def test_short_move():
+    # never reaches full speed, so accelerates for half and decelerates for half
+    moves = [Move(LINEAR, (0, 0, 0), (1, 0, 0), feed=6000)]
+    result = estimate(moves, LIMITS)
+    assert result.cutting == pytest.approx(2 * math.sqrt(1 / 500))
+
+
+def test_collinear_and_exact_stop():
+    points = [(0, 0, 0), (500, 0, 0), (1000, 0, 0)]
+    moves = [Move(LINEAR, p0, p1, feed=3000) for p0, p1 in zip(points[:-1], points[1:])]
+    assert estimate(moves, LIMITS).total == pytest.approx(line_time(1000, 50, 500))
+
+    stopping = [m._replace(blend=0.0) for m in moves]
+    assert estimate(stopping, LIMITS).total == pytest.approx(
+        2 * line_time(500, 50, 500)
+    )
+
+
+def test_corner_blending():
+    corner = [
+        Move(LINEAR, (0, 0, 0), (100, 0, 0), feed=3000, blend=b)
+        for b in (0.0, 0.01, 1.0)
+    ]
+    times = [
+        estimate(
+            [m, Move(LINEAR, m.end, (100, 100, 0), feed=3000, blend=m.blend)]
+        ).total
+        for m in corner
+    ]
+    assert times[0] > times[1] > times[2]
+
+
+def test_chunks(tmp_file):
+    m = Machine(tmp_file)
+    m.std_init()
+    m.feedrate(1000)
+    m.g0(0, 0, 0)
+    for idx in range(1, 20):
+        m.g1(idx * 10, (idx % 2) * 10)
+    m.close()
+    whole = estimate(tmp_file)
+    chunked = estimate(parse(tmp_file), chunk_size=3)
+    assert chunked.total == pytest.approx(whole.total)
+    assert chunked.moves == whole.moves == 19
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 10])
+def test_chunks_collinear(chunk_size):
+    # braking for the end of the program starts several chunks before it
+    moves = [
+        Move(LINEAR, (idx / 10, 0, 0), ((idx + 1) / 10, 0, 0), feed=6000)
+        for idx in range(40)
+    ]
+    whole = estimate(moves, LIMITS)
+    assert whole.total == pytest.approx(2 * math.sqrt(4 / 500))
+    chunked = estimate(moves, LIMITS, chunk_size=chunk_size)
+    assert chunked.total == pytest.approx(whole.total)
+    assert chunked.moves == 40
+
+
+def test_arc_plane_limits():
+    limits = MachineLimits(rapid=(6000, 6000, 600), acceleration=(500, 500, 50))
+    arcs = [
+        Move(parser.ARC_CCW, (10, 0, 0), (10, 0, 0), centre=c, feed=6000, plane=p)
+        for c, p in (((0, 0, 0), "XY"), ((10, 0, -10), "ZX"))
+    ]
+    xy, zx = (estimate([a], limits).total for a in arcs)
+    assert zx > 5 * xy
+
+
+def test_machine_program(tmp_file):
+    m = Machine(tmp_file)
+    m.std_init(toolchange=True)
+    m.feedrate(600)
+    m.g0(10, 0, 1)
+    m.g1(z=0)
+    functions.helical_entry(m, Vector(0, 0), final_height=-1, doc=0.5)
+    m.dwell(2)
+    m.pause()
+    m.g0(z=5)
+    m.std_close()
+    m.close()
+    limits = MachineLimits(pause=10, toolchange=30)
+    result = estimate(tmp_file, limits)
+    assert result.dwell == 2
+    assert result.pauses == 1
+    assert result.toolchanges == 1
+    assert result.other == 40
+    helix = math.hypot(2 * 2 * math.pi * 10, 1)
+    assert result.cutting_distance == pytest.approx(helix + 1)
+    # helix at full feed rate is a lower bound
+    assert result.cutting > helix / 10
+    assert result.total == pytest.approx(
+        result.cutting + result.rapid + result.dwell + result.other
+    )
@@ -0,0 +1,110 @@
+import io
+import math
+import numpy as np
+import pytest
+from gmcode import Machine, Vector
+from gmcode.geom import Line, ArcXY
+from gmcode.fit import fit_arcs, fit_points
+from gmcode.parser import parse, ARC_CW, ARC_CCW, LINEAR
+from gmcode.toolpath import Toolpath, LINE, ARC
+
+
+def circle_points(centre, radius, a0, a1, n, z=0.0):
+    t = np.linspace(a0, a1, n)
+    return np.stack(
+        [
+            centre[0] + radius * np.cos(t),
+            centre[1] + radius * np.sin(t),
+            np.full(n, z),
+        ],
+        axis=1,
+    )
+
+
+@pytest.mark.parametrize("cw", [True, False])
+def test_fit_points_arc(cw):
+    a0, a1 = (math.pi, 0) if cw else (0, math.pi)
+    points = circle_points((3, 4), 10, a0, a1, 500, z=-1)
+    tp = fit_points(points, 1e-3)
+    assert list(tp.kind) == [ARC]
+    arc = tp[0]
+    assert arc.cw == cw
+    assert arc.centre == Vector(3, 4, -1)
+    assert arc.radius() == pytest.approx(10)
+    assert arc.start == Vector(*points[0])
+    assert arc.end == Vector(*points[-1])
+
+
+def test_fit_points_mixed():
+    # a slot: a line, a half circle, a line back
+    arc = circle_points((10, 5), 5, -math.pi / 2, math.pi / 2, 200)
+    points = np.vstack(
+        [
+            [(x, 0, 0) for x in np.linspace(0, 10, 50)[:-1]],
+            arc,
+            [(x, 10, 0) for x in np.linspace(10, 0, 50)[1:]],
+        ]
+    )
+    tp = fit_points(points, 1e-3)
+    assert list(tp.kind) == [LINE, ARC, LINE]
+    assert not tp.cw[1]
+    assert tp.gaps().size == 0
+    assert tp.end[2] == Vector(0, 10, 0)
+
+
+def test_fit_points_tolerance():
+    # a polygon with few sides is not a circle at a tight tolerance
+    hexagon = circle_points((0, 0), 10, 0, 2 * math.pi, 7)
+    assert ARC not in fit_points(hexagon, 1e-3).kind
+    # a full circle is split into arcs of less than 360 degrees
+    circle = circle_points((0, 0), 10, 0, 2 * math.pi, 1000)
+    tp = fit_points(circle, 1e-3)
+    assert len(tp) == 2
+    assert tp.kind[0] == ARC
+
+
+def test_fit_points_helix():
+    # arcs have to be flat, so a helix stays as lines
+    points = circle_points((0, 0), 10, 0, math.pi, 20)
+    points[:, 2] = np.linspace(0, -1, 20)
+    tp = fit_points(points, 1e-3)
+    assert np.all(tp.kind == LINE)
+    assert len(tp) == 19
+
+
+def test_fit_arcs_elements(tmp_file):
+    points = [Vector(*p) for p in circle_points((0, 0), 5, 0, math.pi / 2, 50)]
+    lines = [Line(a, b) for a, b in zip(points[:-1], points[1:])]
+    arc = ArcXY(start=points[-1], end=Vector(-5, 0), centre=Vector(), cw=False)
+    paths = lines + [arc]
+    fitted = fit_arcs(paths, 1e-3)
+    assert len(fitted) == 2
+    assert isinstance(fitted[0], ArcXY)
+    assert fitted[1] is arc
+
+    with Machine(tmp_file) as m:
+        m.feedrate(100)
+        m.g0(5, 0, 0)
+        m.cut(fitted)
+
+    kinds = [move.kind for move in parse(tmp_file)]
+    assert kinds[1:] == [ARC_CCW, ARC_CCW]
+
+
+def test_fit_arcs_toolpath():
+    points = circle_points((0, 0), 5, 0, -math.pi / 2, 50)
+    tp = Toolpath.lines(points, feed=100) + Toolpath.lines(
+        points[-1:] + [[0, 0, 0], [-5, 0, 0]]
+    )
+    fitted = fit_arcs(tp, 1e-3)
+    assert list(fitted.kind) == [ARC, LINE]
+    assert fitted.cw[0]
+    assert fitted.feed[0] == 100
+    text = io.StringIO()
+    with Machine(text) as m:
+        m.g0(5, 0, 0)
+        m.cut(fitted)
+    assert [m.kind for m in parse(text.getvalue().splitlines())][1:] == [
+        ARC_CW,
+        LINEAR,
+    ]
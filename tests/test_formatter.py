@@ -0,0 +1,34 @@
+import pytest
+from gmcode.formatter import Formatter
+
+
+@pytest.mark.parametrize("places", [0, 1, 4, 8])
+def test_fixed_places(places):
+    f = Formatter(places)
+    assert f(1.23456789) == f"{1.23456789:.{places}f}"
+    assert f(-10) == f"{-10:.{places}f}"
+
+
+@pytest.mark.parametrize(
+    "num,out",
+    [
+        (10, "10"),
+        (10.0, "10"),
+        (10.5, "10.5"),
+        (0.00001, "0"),
+        (-0.00001, "0"),
+        (-1.25, "-1.25"),
+        (100.00011, "100.0001"),
+    ],
+)
+def test_strip_zeros(num, out):
+    assert Formatter(4, strip_zeros=True)(num) == out
+
+
+@pytest.mark.parametrize("strip_zeros", [False, True])
+def test_cache(strip_zeros):
+    cached = Formatter(3, strip_zeros=strip_zeros, cache_size=2)
+    uncached = Formatter(3, strip_zeros=strip_zeros)
+    nums = [1, 2.5, 1, 3.1234, 2.5, -7]
+    assert cached.many(nums) == uncached.many(nums)
+    assert cached._format.cache_info().hits == 1
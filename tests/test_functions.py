@@ -1,5 +1,9 @@
+import io
+import numpy as np
 import pytest
-from gmcode import functions, Vector
+from gmcode import functions, Machine, MachineError, Vector
+from gmcode.parser import parse, ARC_CW, ARC_CCW
+from gmcode.toolpath import ARC, LINE
 import math
 import pygcode
 
@@ -151,3 +155,114 @@ def test_rect_in(tmp_gcodefile, tmp_machine, centre):
     tmp_machine.close()
     # that should have made 10 loops, each with 4 g1 commands + 1 for the inital
     assert tmp_gcodefile.count_gcode("G1") == pytest.approx(10 * 4 + 1, abs=1)
+
+
+def pocket(m, centre, radius):
+    functions.helical_entry(m, centre, final_height=-1, doc=0.4)
+    functions.spiral(m, Vector(centre.x, centre.y, -1), radius, doc=0.3)
+    m.g0(z=1)
+    functions.rect_in(m, centre, woc=0.5)
+
+
+@pytest.mark.parametrize("strip_zeros", [False, True])
+def test_repeat(strip_zeros):
+    starts = [Vector(2, 0, 0), Vector(12.34567, 0, 0), Vector(2.1, -9.87654, 0)]
+    starts += [s + Vector(0, 20) for s in starts]
+
+    def program(use_repeat):
+        text = io.StringIO()
+        with Machine(text, accuracy=1e-3, strip_zeros=strip_zeros) as m:
+            m.std_init()
+            m.feedrate(200)
+            m.g0(0, 0, 5)
+            if use_repeat:
+                functions.repeat(m, pocket, starts, Vector(), 3, clearance=5)
+            else:
+                for start in starts:
+                    m.g0(z=5)
+                    m.g0(start.x, start.y)
+                    m.g0(z=start.z)
+                    pocket(m, Vector(start.x - 2, start.y), 3)
+                m.g0(z=5)
+        return text.getvalue(), m.position
+
+    text, position = program(True)
+    unrolled, unrolled_position = program(False)
+    assert position == unrolled_position
+    assert len(text) < len(unrolled) / 2
+
+    moves = list(parse(text.splitlines()))
+    expected = list(parse(unrolled.splitlines()))
+    assert [m.kind for m in moves] == [m.kind for m in expected]
+    for a, b in zip(moves, expected):
+        assert a.end == pytest.approx(b.end, abs=1e-3)
+        if a.centre is not None:
+            assert a.centre == pytest.approx(b.centre, abs=1e-3)
+
+
+def test_spiral_many_turns():
+    # used to stop at 10000 half turns
+    text = io.StringIO()
+    with Machine(text) as m:
+        m.std_init()
+        m.feedrate(100)
+        m.g0(0.5, 0, 0)
+        functions.spiral(m, Vector(), radius_end=200, doc=0.02)
+        assert abs(m.position) == pytest.approx(200)
+
+    arcs = [move for move in parse(text.getvalue().splitlines()) if move.centre]
+    assert len(arcs) > 2 * (200 - 0.5) / 0.02
+    radii = [math.dist(move.end, move.centre) for move in arcs[1:-2]]
+    assert max(np.diff(radii)) == pytest.approx(0.01, abs=1e-3)
+
+
+def test_spiral_path():
+    tp = functions.spiral_path(Vector(1, 2, -1), Vector(1, 0, -1), 4, doc=0.5)
+    assert tp.gaps(Vector(1, 2, -1)).size == 0
+    assert list(tp.kind[-3:]) == [ARC, LINE, ARC]
+    assert np.all(tp.kind[:-2] == ARC)
+    assert abs(tp.end[len(tp) - 1] - Vector(1, 0, -1)) == pytest.approx(4)
+
+    with pytest.raises(MachineError):
+        functions.spiral_path(Vector(1, 2, 0), Vector(1, 0, -1), 4)
+
+
+@pytest.mark.parametrize(
+    "start,radius_end,cw",
+    [(Vector(3, 0), 10, True), (Vector(0, 0.3), 5, False), (Vector(-10, -10), 1, True)],
+)
+def test_archimedean_spiral(start, radius_end, cw):
+    centre = Vector(0, 0)
+    accuracy = 1e-3
+    doc = 0.4
+    text = io.StringIO()
+    with Machine(text, accuracy=accuracy) as m:
+        m.std_init()
+        m.feedrate(100)
+        m.g0(start.x, start.y, 0)
+        functions.archimedean_spiral(m, centre, radius_end, doc=doc, cw=cw)
+        assert abs(m.position - centre) == pytest.approx(radius_end)
+
+    moves = list(parse(text.getvalue().splitlines()))
+    assert {move.kind for move in moves[1:]} == {ARC_CW if cw else ARC_CCW}
+
+    # points along the arcs are on the spiral, whose radius changes by doc
+    # every turn
+    radius_start = abs(start)
+    pitch = math.copysign(doc, radius_end - radius_start) / (2 * math.pi)
+    swept = 0.0
+    for move in moves[1:-1]:
+        c = np.array(move.centre[:2])
+        a = np.array(move.start[:2]) - c
+        b = np.array(move.end[:2]) - c
+        angle = math.atan2(a[0] * b[1] - a[1] * b[0], a.dot(b))
+        t = np.linspace(0, angle, 20)
+        r = math.hypot(*a)
+        a0 = math.atan2(a[1], a[0])
+        xy = c + r * np.stack([np.cos(a0 + t), np.sin(a0 + t)], axis=1)
+        polar = np.unwrap(np.arctan2(xy[:, 1], xy[:, 0]))
+        progress = swept + np.abs(polar - polar[0])
+        expected = radius_start + pitch * progress
+        assert np.max(np.abs(np.hypot(*xy.T) - expected)) < 2 * accuracy
+        swept = progress[-1]
+    assert swept * abs(pitch) == pytest.approx(abs(radius_end - radius_start), abs=0.01)
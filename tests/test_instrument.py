@@ -0,0 +1,117 @@
+import io
+import numpy as np
+import pytest
+from gmcode import Machine, MachineError, Vector, functions
+from gmcode.instrument import Hook, TIMED_METHODS, command_kind
+
+
+def test_command_kind():
+    assert command_kind("G1 X1.0000") == "G1"
+    assert command_kind("G2 X1 Y1 I0 J0") == "G2"
+    assert command_kind("F500.0000") == "F"
+    assert command_kind("T2 M6") == "T"
+    assert command_kind("(a comment)") == "comment"
+    assert command_kind("o<hole> call") == "o"
+    assert command_kind("G17 ; plane XY") == "G17"
+    assert command_kind("") == "blank"
+
+
+class Lines(Hook):
+    def __init__(self):
+        self.lines = []
+        self.timed_names = set()
+
+    def line(self, kind, text):
+        self.lines.append((kind, text))
+
+    def timed(self, name, seconds):
+        self.timed_names.add(name)
+
+
+def test_instrument():
+    text = io.StringIO()
+    m = Machine(text)
+    hook = Lines()
+    instruments = m.instrument(hook)
+    m.std_init()
+    m.feedrate(500)
+    m.g0(5, 0, -1)
+    m.g1(6, 0)
+    functions.spiral(m, Vector(0, 0, -1), 6, doc=1)
+    m.toolchange(2)
+    m.flush()
+
+    report = instruments.report()
+    written = text.getvalue().splitlines()
+    assert report.lines == len(written)
+    assert report.bytes == len(text.getvalue().encode())
+    assert [line for _, line in hook.lines] == written
+    assert report.commands["G1"] == 2  # one in the spiral
+    assert report.commands["G2"] == sum(line.split()[0] == "G2" for line in written)
+    assert report.commands["F"] == 1
+    assert report.commands["T"] == 1
+    assert report.commands["comment"] == 2
+
+    assert report.timings["functions.spiral"].calls == 1
+    assert report.timings["_xyz_to_command"].calls == 2
+    assert report.timings["format"].calls >= 4
+    assert report.timings["_write_block"].calls == 1
+    assert report.timings["_xyz_to_command"].seconds > 0
+    assert hook.timed_names == set(report.timings)
+    assert "functions.spiral" in str(report)
+
+    with pytest.raises(MachineError):
+        m.instrument()
+
+    # detaching puts the machine back how it was, and the report is kept
+    instruments.detach()
+    assert m.instruments is None
+    assert not set(TIMED_METHODS) & set(vars(m))
+    m.g1(7, 0)
+    assert instruments.report() == report
+
+    instruments.reset()
+    assert instruments.report().lines == 0
+
+
+def test_instrument_many():
+    # batches of moves are formatted together, which is timed as format
+    text = io.StringIO()
+    m = Machine(text)
+    m.std_init()
+    m.feedrate(500)
+    instruments = m.instrument()
+    m.g1_many(np.stack([np.arange(100), np.arange(100) % 3, np.full(100, -1)], 1))
+    m.flush()
+    report = instruments.report()
+    assert report.commands["G1"] == 100
+    assert report.timings["format"].calls >= 1
+    assert report.timings["format"].seconds > 0
+    assert "_xyz_to_command" not in report.timings
+
+
+def test_instrument_subroutine():
+    text = io.StringIO()
+    m = Machine(text)
+    m.std_init()
+    m.feedrate(500)
+    m.g0(0, 0, 0)
+    instruments = m.instrument()
+    functions.repeat(
+        m,
+        functions.helical_entry,
+        [Vector(1, 0, 0), Vector(11, 0, 0)],
+        centre=Vector(0, 0, 0),
+        final_height=-1,
+        clearance=2,
+        name="hole",
+    )
+    m.flush()
+
+    report = instruments.report()
+    # the body is written by another Machine, which is measured too
+    assert report.commands["o"] == 4
+    assert report.commands["G2"] == 1
+    assert report.timings["functions.repeat"].calls == 1
+    assert report.timings["functions.helical_entry"].calls == 1
+    instruments.detach()
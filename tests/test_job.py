@@ -0,0 +1,156 @@
+import attr
+import io
+import numpy as np
+import pytest
+from gmcode import Machine, Vector, functions
+from gmcode.geom import Line, ArcXY
+from gmcode.job import Call, FragmentCache, Job, _options, fingerprint, render
+from gmcode.machine import MachineState
+from gmcode.schedule import run
+
+
+def drill(m, depth, feed):
+    m.feedrate(feed)
+    m.g1(z=depth)
+
+
+def pocket(m, centre, radius):
+    functions.helical_entry(m, centre, final_height=-1, doc=0.5)
+    functions.spiral(m, centre, radius, doc=0.5)
+
+
+def make_job():
+    job = Job(clearance=5)
+    for idx in range(6):
+        centre = Vector(idx * 20, 0, -1)
+        job.add(pocket, centre + Vector(2, 0, 1), centre, 5, tool=1 + idx % 2)
+    job.add(drill, Vector(0, 20, 1), -3, feed=50, name="drill")
+    return job
+
+
+def output(func):
+    text = io.StringIO()
+    m = Machine(text)
+    m.std_init()
+    m.feedrate(300)
+    func(m)
+    state = m.snapshot()
+    m.close()
+    return text.getvalue(), state
+
+
+def test_snapshot_restore():
+    m = Machine(io.StringIO())
+    assert m.snapshot() == MachineState()
+    m.std_init()
+    m.feedrate(100)
+    m.g0(1, 2, 3)
+    state = m.snapshot()
+    assert state.position == Vector(1, 2, 3)
+    assert state.feedrate == 100
+    assert state.plane == "G17"
+    assert state.unitialised == frozenset()
+
+    other = Machine(io.StringIO())
+    other.restore(state)
+    assert other.snapshot() == state
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_build_matches_serial(processes):
+    serial, serial_state = output(lambda m: run(m, make_job().operations, 5))
+    built, built_state = output(lambda m: make_job().build(m, processes=processes))
+    assert built == serial
+    assert built_state == serial_state
+    assert serial.count("T1 M6") == 3
+
+
+def test_render_unknown_state():
+    # with nothing known, the fragment sets everything it relies on
+    job = Job(clearance=5)
+    op = job.add(drill, Vector(0, 0, 1), -3, feed=50)
+    fragment = render(op, {"accuracy": 1e-3})
+    assert fragment.text == "F50.000\nG1 Z-3.000\n"
+    assert fragment.state.position == Vector(0, 0, -3)
+    assert fragment.state.feedrate == 50
+    assert fragment.state.plane is None
+
+
+def test_build_cache(tmp_path):
+    path = tmp_path / "fragments.pkl"
+    cache = FragmentCache(path=path)
+    expected, _ = output(lambda m: make_job().build(m, processes=1))
+
+    def build(job):
+        job.cache = cache
+        return output(lambda m: job.build(m, processes=1))[0]
+
+    assert build(make_job()) == expected
+    assert (cache.misses, cache.hits) == (7, 0)
+    assert build(make_job()) == expected
+    assert (cache.misses, cache.hits) == (7, 7)
+
+    # only the operation that changed is rendered again
+    job = make_job()
+    changed = job.operations[2]
+    job.operations[2] = attr.evolve(
+        changed, action=attr.evolve(changed.action, args=(Vector(40, 0, -1), 4))
+    )
+    job.operations[3] = attr.evolve(job.operations[3], name="renamed")
+    built = build(job)
+    assert (cache.misses, cache.hits) == (8, 13)
+    assert built != expected
+    job.cache = None
+    assert output(lambda m: job.build(m, processes=1))[0] == built
+
+    options = _options(Machine(io.StringIO()))
+    cache.retain([fingerprint(op, options) for op in job.operations])
+    assert len(cache) == 7
+    cache.save()
+    loaded = FragmentCache(path=path)
+    assert len(loaded) == 7
+    job.cache = loaded
+    assert output(lambda m: job.build(m, processes=1))[0] == built
+    assert (loaded.misses, loaded.hits) == (0, 7)
+
+
+def test_fingerprint():
+    options = {"accuracy": 1e-3}
+    job = Job(clearance=5)
+    a = job.add(pocket, Vector(2, 0), Vector(), 5, name="a")
+    b = job.add(pocket, Vector(2, 0), Vector(), 5.0, tool=1, exit=Vector(1, 1))
+    c = job.add(pocket, Vector(2, 0), Vector(), 5.0001)
+    d = job.add(drill, Vector(2, 0), Vector(), 5)
+    keys = [fingerprint(op, options) for op in (a, b, c, d)]
+    assert keys[0] == fingerprint(attr.evolve(a, name="b", exit=Vector(1)), options)
+    assert len(set(keys)) == 4
+    assert fingerprint(a, {"accuracy": 1e-4}) != keys[0]
+
+    # arrays are hashed by value
+    e = job.add(pocket, Vector(), np.arange(6.0), 1)
+    assert fingerprint(e, options) == fingerprint(
+        attr.evolve(e, action=Call(pocket, (np.arange(6.0), 1))), options
+    )
+    assert fingerprint(e, options) != fingerprint(
+        attr.evolve(e, action=Call(pocket, (np.arange(6.0) + 1, 1))), options
+    )
+
+
+def test_job_cut():
+    paths = [
+        Line(Vector(0, 0, -1), Vector(10, 0, -1)),
+        ArcXY(Vector(10, 0, -1), Vector(10, 10, -1), Vector(10, 5, -1), cw=False),
+    ]
+
+    def direct(m):
+        m.toolchange(2)
+        m.g0(z=5)
+        m.g0(0, 0)
+        m.g0(z=-1)
+        m.cut(paths)
+        m.g0(z=5)
+
+    job = Job(clearance=5)
+    op = job.cut(paths, tool=2)
+    assert op.end == Vector(10, 10, -1)
+    assert output(lambda m: job.build(m, processes=1)) == output(direct)
@@ -425,3 +425,111 @@ def test_pause(tmp_gcodefile, tmp_machine):
     tmp_machine.pause()
     tmp_machine.close()
     assert tmp_gcodefile.line_contains_gcode(-1, "M0")
+
+
+def test_strip_zeros(tmp_file, tmp_gcodefile):
+    m = Machine(tmp_file, strip_zeros=True, format_cache=16)
+    m.g0(10, 2.5, 0)
+    m.close()
+    assert tmp_gcodefile.lines[-1].text.strip() == "G0 X10 Y2.5 Z0"
+
+
+@pytest.mark.parametrize("command", ["g0", "g1"])
+@pytest.mark.parametrize("accuracy", [1e-4, 0.5])
+def test_many(tmp_file, command, accuracy):
+    nan = float("nan")
+    points = [
+        (0, 0, nan),
+        (1, 0, 0),
+        (1, 0, 0),
+        (1 + accuracy / 2, nan, nan),
+        (nan, 2, -1),
+        (nan, nan, nan),
+        (0.3, 0.2, 0.1),
+    ]
+
+    slow = Machine(tmp_file.with_suffix(".slow"), accuracy=accuracy)
+    for p in points:
+        getattr(slow, command)(*[None if math.isnan(v) else v for v in p])
+    slow.close()
+
+    fast = Machine(tmp_file, accuracy=accuracy)
+    getattr(fast, command + "_many")(points)
+    fast.close()
+
+    assert tmp_file.read_text() == tmp_file.with_suffix(".slow").read_text()
+    assert fast.position == slow.position
+    assert fast._unitialised == slow._unitialised
+
+
+def test_many_shape(tmp_machine):
+    with pytest.raises(MachineError):
+        tmp_machine.g1_many([(1, 2)])
+
+
+def test_cut_tolerance(tmp_file):
+    m = Machine(tmp_file, tolerance=0.01)
+    m.g0(0, 0, 0)
+    m.cut([Line(Vector(0.005, 0, 0), Vector(1, 0, 0))])
+    with pytest.raises(MachineError):
+        m.cut([Line(Vector(1.02, 0, 0), Vector(2, 0, 0))])
+    m.close()
+
+
+def test_subroutine(tmp_file):
+    m = Machine(tmp_file)
+    m.std_init()
+    m.g0(1, 1, 0)
+    with m.subroutine("Step") as sub:
+        sub.feedrate(100)
+        sub.g1(1.5, 1.00001, -1)
+        sub.arc(x=2.5, y=1, i=2, j=1, cw=False)
+        sub.g1(z=0)
+    assert m.position == Vector(1, 1, 0)
+    m.call("step")
+    assert m.position == Vector(2.5, 1, 0)
+    m.g0(y=3)
+    m.call("STEP")
+    assert m.position == Vector(4, 3, 0)
+    m.close()
+
+    with open(tmp_file) as f0:
+        lines = f0.read().splitlines()
+    start = lines.index("o<step> sub")
+    assert lines[start + 1 :] == [
+        "G91 ; incremental distance mode",
+        "G91.1 ; arc centre incremental distance mode",
+        "F100.0000",
+        "G1 X0.5000 Z-1.0000",
+        "G3 X1.0000 Y0.0000 I0.5000 J0.0000",
+        "G1 Z1.0000",
+        "G90 ; absolute distance mode",
+        "G90.1 ; arc centre absolute distance mode",
+        "o<step> endsub",
+        "o<step> call",
+        "G0 Y3.0000",
+        "o<step> call",
+    ]
+
+
+def test_subroutine_errors(tmp_machine):
+    with pytest.raises(MachineError):
+        tmp_machine.call("missing")
+
+    with tmp_machine.subroutine("a") as sub:
+        sub.g1(x=1)
+        with pytest.raises(MachineError):
+            with sub.subroutine("b"):
+                pass
+
+    # nothing has been written to the axes yet
+    with pytest.raises(MachineError):
+        tmp_machine.call("a")
+
+    with pytest.raises(MachineError):
+        with tmp_machine.subroutine("a"):
+            pass
+
+    with pytest.raises(MachineError):
+        with tmp_machine.subroutine("not a name"):
+            pass
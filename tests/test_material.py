@@ -0,0 +1,119 @@
+import io
+import math
+import numpy as np
+import pytest
+from gmcode import Machine, functions
+from gmcode.material import Material
+from gmcode.offset import Region
+from gmcode.parser import parse, ARC_CW, ARC_CCW, LINEAR
+
+SQUARE = np.array([[0, 0], [20, 0], [20, 10], [0, 10]], dtype=float)
+ISLAND = np.array([[4, 4], [6, 4], [6, 6], [4, 6]], dtype=float)
+
+
+def test_material_area():
+    material = Material(Region(SQUARE, [ISLAND]), 0.05)
+    assert material.area == pytest.approx(196)
+    assert material.initial == material.area
+    assert material.present(np.array([[1, 1], [5, 5], [-1, 1]])).tolist() == [
+        True,
+        False,
+        False,
+    ]
+
+    with pytest.raises(ValueError):
+        Material(Region(SQUARE), 0)
+
+
+def test_material_cut():
+    material = Material(Region(SQUARE), 0.02)
+    material.cut(np.array([[5, 5], [15, 5]]), 1)
+    assert material.area == pytest.approx(200 - 20 - math.pi, abs=0.1)
+    assert not material.present(np.array([[10, 5.9]]))[0]
+
+    # a circle clears a ring as wide as the tool
+    material.cut_circle(np.array([10, 5]), 3, 1)
+    assert not material.present(np.array([[10, 8.9], [13.9, 5]])).any()
+    assert material.present(np.array([[10, 9.1], [10, 6.9]])).all()
+
+
+@pytest.mark.parametrize("width", [0.25, 0.5, 1, 1.5])
+def test_engagement(width):
+    material = Material(Region(SQUARE), 0.02)
+    # a slot takes the whole front of the tool
+    slot = np.stack([np.linspace(2, 10, 401), np.full(401, 5)], axis=1)
+    assert np.all(material.engagement(slot, 1)[10:] == pytest.approx(math.pi))
+
+    # along a wall, width wide
+    material.cut(np.array([[0, 0], [20, 0]]), 1)
+    wall = np.stack([np.linspace(2, 10, 401), np.full(401, width)], axis=1)
+    found = material.engagement(wall, 1)[10:]
+    assert np.all(np.abs(found - math.acos(1 - width)) <= math.pi / 24 + 1e-9)
+    # nothing is cut
+    assert material.present(np.array([[5, 2.1]]))[0]
+
+
+def _moves(text):
+    """
+    Points along each move at depth, and its feedrate.
+    """
+    for move in parse(text.splitlines()):
+        if move.start[2] != -1 or move.end[2] != -1:
+            continue
+        start, end = np.array(move.start[:2]), np.array(move.end[:2])
+        if move.kind == LINEAR:
+            t = np.linspace(0, 1, max(int(math.dist(start, end) / 0.1), 1) + 1)
+            points = start + t[:, None] * (end - start)
+        elif move.kind in (ARC_CW, ARC_CCW):
+            centre = np.array(move.centre[:2])
+            r = math.dist(start, centre)
+            a0 = math.atan2(*(start - centre)[::-1])
+            sweep = -2 * math.pi if move.kind == ARC_CW else 2 * math.pi
+            t = a0 + np.linspace(0, sweep, max(int(2 * math.pi * r / 0.1), 8) + 1)
+            points = centre + r * np.stack([np.cos(t), np.sin(t)], axis=1)
+        else:
+            continue
+        yield move.kind, points, move.feed
+
+
+@pytest.mark.parametrize("climb", [True, False])
+def test_adaptive(climb):
+    tool_radius, stepover = 1.5, 0.5
+    text = io.StringIO()
+    m = Machine(text, accuracy=1e-3)
+    m.std_init()
+    m.feedrate(500)
+    m.g0(10, 5, -1)
+    material = functions.adaptive(
+        m, SQUARE, tool_radius, stepover, clearance=5, climb=climb
+    )
+    m.flush()
+
+    # only the corners the tool can not get into are left
+    rows, cols = np.nonzero(material.cells)
+    left = material.origin + (np.stack([cols, rows], axis=1) + 0.5) * (
+        material.resolution
+    )
+    to_corner = np.hypot(*(left[:, None, :] - SQUARE[None, :, :]).T).min(axis=0)
+    assert np.all(to_corner <= tool_radius + material.resolution)
+
+    # going over the program again, the tool stays inside the pocket and the
+    # load on it is about the same as a cut stepover wide, or it slows down
+    region = Region(SQUARE, tolerance=1e-3)
+    check = Material(region, material.resolution)
+    check.cut(np.array([[10, 5]]), tool_radius)
+    limit = math.acos(1 - stepover / tool_radius)
+    moves = list(_moves(text.getvalue()))
+    for kind, points, feed in moves:
+        engagement = check.engagement(points, tool_radius).max(initial=0)
+        load = (1 - math.cos(engagement)) * feed / 500
+        assert load <= 2 * (1 - math.cos(limit))
+        check.cut(points, tool_radius)
+
+    assert check.area == pytest.approx(material.area, abs=0.1)
+    path = np.vstack([points for _, points, _ in moves])
+    assert np.all(region.distances(path, tool_radius) >= tool_radius - 2e-3)
+    assert {kind for kind, _, _ in moves} == {LINEAR, ARC_CCW if climb else ARC_CW}
+
+    with pytest.raises(ValueError):
+        functions.adaptive(m, SQUARE, tool_radius, 0, clearance=5)
@@ -0,0 +1,195 @@
+import io
+import math
+import numpy as np
+import pytest
+from gmcode import Machine, Vector, functions
+from gmcode.geom import Line, ArcXY
+from gmcode.offset import (
+    Region,
+    contour,
+    offset,
+    loop_toolpath,
+    concentric_loops,
+    zigzag_passes,
+    _signed_area,
+)
+from gmcode.parser import parse
+from gmcode.toolpath import ARC
+
+SQUARE = np.array([[0, 0], [10, 0], [10, 10], [0, 10]], dtype=float)
+ELL = np.array([[0, 0], [30, 0], [30, 10], [10, 10], [10, 30], [0, 30]], dtype=float)
+
+
+def test_contour_elements():
+    paths = [
+        Line(Vector(0, 0), Vector(10, 0)),
+        ArcXY(Vector(10, 0), Vector(10, 10), Vector(10, 5), cw=False),
+        Line(Vector(10, 10), Vector(0, 10)),
+        Line(Vector(0, 10), Vector(0, 0)),
+    ]
+    points = contour(paths, tolerance=1e-3)
+    assert _signed_area(points) == pytest.approx(100 + math.pi * 25 / 2, rel=1e-3)
+    # the lines between corners stay within tolerance of the arc
+    on_arc = points[points[:, 0] > 10]
+    middles = (on_arc[1:] + on_arc[:-1]) / 2
+    assert np.all(5 - np.hypot(*(middles - (10, 5)).T) <= 1e-3)
+
+    with pytest.raises(TypeError):
+        contour([object()])
+
+
+@pytest.mark.parametrize(
+    "distance,area",
+    [(1, 64), (4.9, 0.04), (-1, 100 + 40 + math.pi), (-0.5, 100 + 20 + math.pi / 4)],
+)
+def test_offset_square(distance, area):
+    loops = offset(SQUARE, distance, tolerance=1e-4)
+    assert len(loops) == 1
+    assert _signed_area(loops[0]) == pytest.approx(area, abs=1e-3)
+    # clockwise input gives the same answer
+    reverse = offset(SQUARE[::-1], distance, tolerance=1e-4)
+    assert _signed_area(reverse[0]) == pytest.approx(area, abs=1e-3)
+
+
+def test_offset_vanishes():
+    assert offset(SQUARE, 5.1) == []
+    assert offset(SQUARE, 0)[0].tolist() == SQUARE.tolist()
+
+
+def test_offset_distance():
+    # every corner of the offset is the offset distance from the L, and the
+    # concave corner becomes a round
+    tolerance = 1e-4
+    region = Region(ELL, tolerance=tolerance)
+    for distance in (0.5, 2, 4.9, -3):
+        loops = region.offset(distance)
+        assert len(loops) == 1
+        found = region.distances(loops[0], radius=10)
+        assert np.all(np.abs(found - abs(distance)) < tolerance)
+
+    # the arms are 10 wide, but a circle of radius 10 / (1 + 1 / sqrt(2))
+    # fits where they meet
+    assert len(region.offset(5.8)) == 1
+    assert region.offset(5.9) == []
+
+
+def test_offset_islands():
+    island = np.array([[4, 4], [6, 4], [6, 6], [4, 6]], dtype=float)
+    loops = offset(SQUARE, 1, [island])
+    assert sorted(_signed_area(loop) for loop in loops) == pytest.approx(
+        [-(4 + 8 + math.pi), 64], abs=1e-3
+    )
+    # the island and the outline meet
+    assert offset(SQUARE, 2.5, [island]) == []
+
+    # two islands grow into one
+    islands = [island - (1.5, 0), island + (1.5, 0)]
+    loops = offset(SQUARE * 2, 1.2, [i * 2 for i in islands])
+    assert len(loops) == 2
+    assert min(_signed_area(loop) for loop in loops) < 0
+
+
+def test_offset_many_corners():
+    t = np.linspace(0, 2 * math.pi, 5000, endpoint=False)
+    r = 20 + 5 * np.sin(12 * t)
+    star = np.stack([r * np.cos(t), r * np.sin(t)], axis=1)
+    region = Region(star, tolerance=1e-3)
+    for distance in (1, 6):
+        loops = region.offset(distance)
+        assert len(loops) == 1
+        found = region.distances(loops[0], radius=10)
+        assert np.all(found > distance - 2e-3)
+
+
+def test_within():
+    t = np.linspace(0, 2 * math.pi, 500, endpoint=False)
+    r = 20 + 5 * np.sin(12 * t)
+    star = np.stack([r * np.cos(t), r * np.sin(t)], axis=1)
+    region = Region(star, [SQUARE - 5])
+    points = np.random.default_rng(0).uniform(-30, 30, (2000, 2))
+    found = region.distances(points, radius=30)
+    for limit in (0.5, 4, 25, np.linspace(0, 30, len(points))):
+        assert np.array_equal(region.within(points, limit), found < limit)
+    assert not Region([]).within(points, 1).any()
+
+
+def test_loop_toolpath():
+    circle = [ArcXY(Vector(5, 0), Vector(5, 0), Vector(), cw=False)]
+    loops = offset(circle, 2, tolerance=1e-4)
+    tp = loop_toolpath(loops[0], z=-1, tolerance=1e-3)
+    assert set(tp.kind) == {ARC}
+    assert len(tp) <= 4
+    assert np.allclose(abs(tp.end - Vector(0, 0, -1)), 3, atol=1e-3)
+
+
+def test_pocket_paths():
+    region = Region(ELL, tolerance=1e-3)
+    levels = concentric_loops(region, tool_radius=1, stepover=1.5)
+    assert len(levels) == 4
+    assert all(len(loops) == 1 for loops in levels)
+
+    passes = zigzag_passes(region, tool_radius=1, stepover=2, angle=math.pi / 2)
+    # passes go up and down
+    assert all(abs(p[0, 0] - p[1, 0]) < 1e-9 for p in passes)
+    xs = sorted({round(p[0, 0], 6) for p in passes})
+    assert max(np.diff(xs)) <= 2
+
+    with pytest.raises(ValueError):
+        concentric_loops(region, 1, 0)
+
+
+@pytest.mark.parametrize("pattern", ["concentric", "zigzag"])
+def test_pocket(pattern):
+    tool_radius = 1.5
+    island = np.array([[3, 3], [6, 3], [6, 6], [3, 6]], dtype=float)
+    text = io.StringIO()
+    with Machine(text, accuracy=1e-3) as m:
+        m.std_init()
+        m.feedrate(500)
+        m.g0(5, 20, 5)
+        m.g1(z=-1)
+        functions.pocket(
+            m,
+            ELL,
+            tool_radius,
+            stepover=1.2,
+            islands=[island],
+            clearance=5,
+            pattern=pattern,
+            angle=0.3,
+        )
+
+    # the tool's path at depth, in small steps
+    points = []
+    for move in parse(text.getvalue().splitlines()):
+        if move.start[2] != -1 or move.end[2] != -1:
+            continue
+        if move.centre is None:
+            t = np.linspace(0, 1, 20)[:, None]
+            points.append(
+                np.array(move.start[:2]) + t * np.subtract(move.end, move.start)[:2]
+            )
+        else:
+            c = np.array(move.centre[:2])
+            a0 = math.atan2(*(np.array(move.start[:2]) - c)[::-1])
+            a1 = math.atan2(*(np.array(move.end[:2]) - c)[::-1])
+            sweep = (a1 - a0) % (2 * math.pi) or 2 * math.pi
+            if move.kind == 2:
+                sweep -= 2 * math.pi
+            t = a0 + sweep * np.linspace(0, 1, 50)
+            r = math.dist(move.start[:2], c)
+            points.append(c + r * np.stack([np.cos(t), np.sin(t)], axis=1))
+    path = np.vstack(points)
+
+    # the tool never cuts into the walls or the island
+    region = Region(ELL, [island], tolerance=1e-3)
+    assert np.all(region.distances(path, radius=tool_radius) >= tool_radius - 2e-3)
+
+    # and everywhere the tool fits has been cut
+    x, y = np.meshgrid(np.linspace(0, 30, 121), np.linspace(0, 30, 121))
+    grid = np.stack([x.ravel(), y.ravel()], axis=1)
+    inside = (grid[:, 0] < 10) | (grid[:, 1] < 10)
+    inside &= ~np.all((grid >= 3) & (grid <= 6), axis=1)
+    fits = inside & np.isinf(region.distances(grid, radius=tool_radius))
+    for point in grid[fits]:
+        assert np.min(np.hypot(*(path - point).T)) <= tool_radius
@@ -0,0 +1,145 @@
+import gzip
+import io
+import pytest
+from gmcode import Machine
+from gmcode.output import (
+    Sink,
+    BufferedSink,
+    FileSink,
+    CompressedFileSink,
+    open_sink,
+)
+
+
+class ListSink(Sink):
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, text):
+        self.chunks.append(text)
+
+    def close(self):
+        self.closed = True
+
+
+def test_buffered_sink_chunks():
+    inner = ListSink()
+    sink = BufferedSink(inner, size=10)
+    sink.write("G0 X1\n")
+    assert inner.chunks == []
+    sink.write("G0 X2\n")
+    assert inner.chunks == ["G0 X1\nG0 X2\n"]
+    sink.write("M2\n")
+    sink.flush()
+    assert inner.chunks == ["G0 X1\nG0 X2\n", "M2\n"]
+
+
+def test_buffered_sink_context_manager():
+    inner = ListSink()
+    with BufferedSink(inner) as sink:
+        sink.write("M2\n")
+        assert inner.chunks == []
+
+    assert inner.chunks == ["M2\n"]
+    assert inner.closed
+
+
+def test_open_sink(tmp_file):
+    inner = ListSink()
+    assert open_sink(inner, buffer_size=0) is inner
+    assert isinstance(open_sink(inner).sink, ListSink)
+    sink = open_sink(tmp_file, buffer_size=0)
+    assert isinstance(sink, FileSink)
+    sink.close()
+    with pytest.raises(TypeError):
+        open_sink(1)
+
+
+def test_machine_flush(tmp_file):
+    m = Machine(tmp_file)
+    m.write("M2")
+    assert tmp_file.read_text() == ""
+    m.flush()
+    assert tmp_file.read_text() == "M2\n"
+    m.close()
+
+
+def test_machine_context_manager(tmp_file):
+    with Machine(tmp_file, buffer_size=0) as m:
+        m.g0(1, 2, 3)
+        m.flush()
+        assert "G0 X1" in tmp_file.read_text()
+
+    assert m.outfile is None
+
+
+def test_stream_sinks():
+    text = io.StringIO()
+    with Machine(text) as m:
+        m.write("M2")
+
+    assert text.getvalue() == "M2\n"
+
+    data = io.BytesIO()
+    with Machine(data) as m:
+        m.write("M2")
+
+    assert data.getvalue() == b"M2\n"
+
+
+def test_callback_sink():
+    lines = []
+    with Machine(lines.append, buffer_size=10) as m:
+        m.write("G0 X1")
+        m.write("G0 X2")
+        m.write("M2")
+
+    assert lines == ["G0 X1\n", "G0 X2\n", "M2\n"]
+
+
+def test_callback_sink_line_breaks():
+    lines = []
+    with Machine(lines.append) as m:
+        m.comment("a\x0cb\u2028c")
+
+    assert lines == ["(a\x0cb\u2028c)\n"]
+
+
+def test_generator_sink():
+    received = []
+    finished = []
+
+    def consumer():
+        try:
+            while True:
+                received.append((yield))
+        finally:
+            finished.append(True)
+
+    with Machine(consumer()) as m:
+        m.write("G0 X1")
+        m.write("M2")
+
+    assert received == ["G0 X1\n", "M2\n"]
+    assert finished
+
+
+def test_gzip_sink(tmp_path):
+    fname = tmp_path / "test.ngc.gz"
+    with Machine(fname) as m:
+        m.write("M2")
+
+    sink = open_sink(tmp_path / "other.gz")
+    assert isinstance(sink.sink, CompressedFileSink)
+    sink.close()
+    with gzip.open(fname, "rt") as f0:
+        assert f0.read() == "M2\n"
+
+
+def test_buffered_sink_garbage_collected(tmp_file):
+    m = Machine(tmp_file)
+    m.std_init()
+    m.g0(1, 2, 3)
+    del m
+    assert "G0 X1" in tmp_file.read_text()
@@ -0,0 +1,216 @@
+import gzip
+import io
+import math
+import pytest
+from gmcode import Machine, Vector, functions
+from gmcode import parser
+from gmcode.parser import Parser, ParseError, parse, tokenise
+
+
+@pytest.fixture
+def program(tmp_file):
+    m = Machine(tmp_file)
+    m.std_init(toolchange=True)
+    m.g0(1, 2, 5)
+    m.feedrate(300)
+    m.g1(z=-1)
+    m.g1(4, 2)
+    m.arc(x=6, y=2, i=5, j=2, cw=False)
+    m.path_mode(exact_path=True)
+    functions.helical_entry(m, centre=Vector(5, 2), final_height=-2, doc=0.5)
+    m.dwell(1.5)
+    m.pause()
+    m.std_close()
+    m.close()
+    return tmp_file
+
+
+def test_tokenise():
+    assert tokenise("G1 X1.5 y-.2 (comment Z2) F100 ; more Z3") == [
+        ("G", "1"),
+        ("X", "1.5"),
+        ("Y", "-.2"),
+        ("F", "100"),
+    ]
+    assert tokenise("(only a comment)") == []
+    with pytest.raises(ParseError):
+        tokenise("G0 (unclosed")
+
+    # semicolons in parenthesised comments don't end the line
+    assert tokenise("G0 (step; 2) X1 ; (X2") == [("G", "0"), ("X", "1")]
+    assert tokenise("(a; b) (c)") == []
+
+
+def test_semicolon_in_comment():
+    text = io.StringIO()
+    m = Machine(text)
+    m.std_init()
+    m.comment("step; 2")
+    m.g0(1, 2, 3)
+    m.flush()
+    moves = list(parse(text.getvalue().splitlines()))
+    assert moves[-1].end == (1, 2, 3)
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_machine_program(program, use_mmap):
+    moves = list(parse(program, use_mmap=use_mmap))
+    kinds = [m.kind for m in moves]
+    assert kinds == [
+        parser.TOOLCHANGE,
+        parser.RAPID,
+        parser.LINEAR,
+        parser.LINEAR,
+        parser.ARC_CCW,
+        parser.ARC_CW,
+        parser.DWELL,
+        parser.PAUSE,
+        parser.END,
+    ]
+    tool, rapid, plunge, line, arc, helix, dwell, pause, end = moves
+    assert tool.value == 1
+    assert rapid.end == (1, 2, 5)
+    assert rapid.feed is None
+    assert plunge.start == (1, 2, 5)
+    assert plunge.end == (1, 2, -1)
+    assert plunge.feed == 300
+    assert plunge.blend == pytest.approx(0.05)
+    assert line.end == (4, 2, -1)
+    assert arc.centre == (5, 2, -1)
+    assert arc.end == (6, 2, -1)
+    assert helix.turns == 2
+    assert helix.end == (6, 2, -2)
+    assert helix.blend == 0
+    assert dwell.value == 1.5
+    assert end.end == (6, 2, -2)
+    assert moves[-1].line == len(program.read_text().splitlines())
+
+
+def test_modal_and_incremental():
+    lines = [
+        "G1 X1 F100",
+        "Y2",
+        "G91 X1",
+        "G2 X2 I1 J0",
+        "G90 G0 Z5",
+        "G0",
+    ]
+    moves = list(Parser().parse(lines))
+    assert [m.end for m in moves] == [
+        (1, 0, 0),
+        (1, 2, 0),
+        (2, 2, 0),
+        (4, 2, 0),
+        (4, 2, 5),
+    ]
+    assert moves[1].kind == parser.LINEAR
+    assert moves[3].centre == (3, 2, 0)
+
+
+def test_parse_gzip_and_bytes(tmp_path):
+    fname = tmp_path / "test.ngc.gz"
+    with gzip.open(fname, "wt") as f0:
+        f0.write("G0 X1\nG0 Y1\n")
+
+    assert [m.end for m in parse(fname)] == [(1, 0, 0), (1, 1, 0)]
+    assert [m.end for m in parse([b"G0 Z1\n"])] == [(0, 0, 1)]
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_parse_utf8_comment(tmp_file, use_mmap):
+    with Machine(tmp_file) as m:
+        m.comment("Ø6 drill")
+        m.g0(1, 2, 3)
+
+    assert [m.end for m in parse(tmp_file, use_mmap=use_mmap)] == [(1, 2, 3)]
+
+
+def test_mcode_after_motion():
+    moves = list(parse(["G0 X5 M0", "G1 Y1 F10 M2"]))
+    assert [m.kind for m in moves] == [
+        parser.RAPID,
+        parser.PAUSE,
+        parser.LINEAR,
+        parser.END,
+    ]
+    assert moves[1].end == (5, 0, 0)
+    assert moves[3].start == (5, 1, 0)
+
+
+def test_parse_zstd(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    fname = tmp_path / "test.ngc.zst"
+    with zstandard.open(fname, "wt") as f0:
+        f0.write("G0 X1\n")
+
+    assert [m.end for m in parse(fname)] == [(1, 0, 0)]
+
+
+def test_parse_errors():
+    with pytest.raises(ParseError):
+        list(parse(["X1"]))
+
+    with pytest.raises(ParseError):
+        list(parse(["G2 X1 Y1 R1"]))
+
+    with pytest.raises(ParseError):
+        list(parse(["G90.1", "G2 X1 I1"]))
+
+
+def test_subroutine_expansion():
+    lines = [
+        "G90 G90.1",
+        "o<step> sub",
+        "G91",
+        "G1 X1 F100",
+        "o<step> return",
+        "G1 X5",
+        "G90",
+        "o<step> endsub",
+        "G0 X10",
+        "O<STEP> call",
+        "o<step> call",
+    ]
+    moves = list(parse(lines))
+    assert [m.end for m in moves] == [(10, 0, 0), (11, 0, 0), (12, 0, 0)]
+    assert [m.line for m in moves] == [9, 10, 11]
+
+    with pytest.raises(ParseError):
+        list(parse(["o<missing> call"]))
+
+    with pytest.raises(ParseError):
+        list(parse(["o100 while [1]"]))
+
+
+def test_scan_line():
+    # scanning gives the same state and number of moves as parsing
+    lines = [
+        "G21 G90 G90.1",
+        "G0 Z5",
+        "x1 y2",
+        "N10 G01 X1 Y2 F300",
+        "G1 X2 F400 (comment)",
+        "F500",
+        "G0",
+        "G91 G1 X1",
+        "X1 Y1",
+        "G90",
+        "G2 X0 Y0 I1 J1",
+        "X3 Y3 I2 J2",
+        "G1 X1.0 Y-.5",
+        "o<step> sub",
+        "G1 X1",
+        "o<step> endsub",
+        "o<step> call",
+        "T2 M6",
+        "M2",
+    ]
+    parsed = Parser()
+    scanned = Parser()
+    for number, text in enumerate(lines, 1):
+        count = scanned.scan_line(text, number)
+        assert count == len(parsed.parse_line(text, number)), text
+        assert scanned.state == parsed.state, text
+
+    with pytest.raises(ParseError):
+        Parser().scan_line("X1")
@@ -0,0 +1,96 @@
+import io
+import math
+import numpy as np
+import pytest
+from gmcode import Machine, Vector, functions
+from gmcode.geom import Line, ArcXY
+from gmcode.parser import parse
+from gmcode.recorder import Recorder
+from gmcode.toolpath import Toolpath
+
+
+def program(m):
+    m.std_init(toolchange=True)
+    m.feedrate(300)
+    m.g0(10, 0, 1)
+    m.g1(z=0)
+    m.g1(z=0.00001)  # less than accuracy
+    functions.helical_entry(m, Vector(0, 0), final_height=-1, doc=0.5)
+    functions.spiral(m, Vector(0, 0, -1), 15, doc=2)
+    m.feedrate(200)
+    m.g1_many(np.array([(20, 0, -1), (20, 5, np.nan), (np.nan, 10, -2)]))
+    m.cut(
+        [
+            Line(Vector(20, 10, -2), Vector(25, 10, -2)),
+            ArcXY(
+                start=Vector(25, 10, -2), end=Vector(25, 20, -2), centre=Vector(25, 15)
+            ),
+        ]
+    )
+    m.cut(
+        Toolpath.lines(
+            np.array([(25, 20, -2), (0, 20, -2), (0, 0, -2)]), feed=[500, 600]
+        )
+    )
+    m.dwell(1)
+    m.g0(z=5)
+    m.pause()
+    m.std_close()
+
+
+def direct():
+    text = io.StringIO()
+    m = Machine(text)
+    program(m)
+    m.close()
+    return text.getvalue()
+
+
+def test_render_matches_machine():
+    r = Recorder()
+    program(r)
+    assert r.render() == direct()
+    assert r.position == Vector(0, 0, 5)
+    assert r.tool_number == 1
+
+
+def test_replay_offset():
+    r = Recorder()
+    r.feedrate(100)
+    r.g0(1, 2, 3)
+    r.arc(3, 2, i=2, j=2, p=2)
+    r.g1(x=5)
+    text = io.StringIO()
+    with Machine(text) as m:
+        r.replay(m, offset=Vector(10, 20, -1))
+
+    assert text.getvalue().splitlines() == [
+        "F100.0000",
+        "G0 X11.0000 Y22.0000 Z2.0000",
+        "G2 X13.0000 Y22.0000 I12.0000 J22.0000 P2",
+        "G1 X15.0000",
+    ]
+    assert m.position == Vector(15, 22, 2)
+
+
+def test_moves_match_parser():
+    r = Recorder()
+    program(r)
+    recorded = list(r.moves())
+    parsed = list(parse(direct().splitlines()))
+    assert len(recorded) == len(parsed)
+    for a, b in zip(recorded, parsed):
+        assert a.kind == b.kind
+        assert a.end == pytest.approx(b.end, abs=1e-4)
+        assert a.feed == b.feed
+        assert a.blend == b.blend
+        assert a.turns == b.turns
+        assert (a.centre is None) == (b.centre is None)
+
+
+def test_compact():
+    r = Recorder()
+    r.feedrate(100)
+    r.g1_many(np.random.default_rng(0).uniform(size=(10000, 3)))
+    assert len(r) == 10001
+    assert r.outfile.chunks == []
@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+from gmcode import Vector
+from gmcode.schedule import Operation, order, run, schedule, travel, _Grid
+
+
+def holes(points, tool=None):
+    return [Operation(Vector(x, y, 1), lambda m: None, tool=tool) for x, y in points]
+
+
+def test_grid_nearest():
+    rng = np.random.default_rng(0)
+    points = rng.uniform(-50, 50, (200, 2))
+    grid = _Grid(points)
+    removed = set(range(0, 200, 3))
+    for idx in removed:
+        grid.remove(idx)
+    for query in rng.uniform(-80, 80, (50, 2)):
+        dists = np.hypot(*(points - query).T)
+        dists[list(removed)] = np.inf
+        assert grid.nearest(query) == int(np.argmin(dists))
+
+        near = grid.near(query, 5)
+        assert near == np.argsort(dists, kind="stable")[:5].tolist()
+
+    # points on a line, or all in one place
+    for points in ([[x, 0] for x in range(100)], [[1, 1]] * 3):
+        grid = _Grid(np.array(points, dtype=float))
+        assert grid.nearest(np.array([-1e3, 5.0])) == 0
+
+
+def test_order_shortens_travel():
+    rng = np.random.default_rng(1)
+    ops = holes(rng.uniform(0, 100, (150, 2)))
+    nn = order(ops, improve=False)
+    improved = order(ops)
+    assert sorted(map(id, improved)) == sorted(map(id, ops))
+    assert travel(improved) <= travel(nn) < travel(ops)
+
+
+def test_order_many():
+    # slots with their exits to one side, enough that trying every move
+    # would take minutes
+    rng = np.random.default_rng(2)
+    entries = rng.uniform(0, 1000, (2000, 2))
+    exits = entries + rng.uniform(-20, 20, (2000, 2))
+    ops = [
+        Operation(Vector(*p), lambda m: None, exit=Vector(*q))
+        for p, q in zip(entries, exits)
+    ]
+    nn = order(ops, improve=False)
+    improved = order(ops)
+    assert sorted(map(id, improved)) == sorted(map(id, ops))
+    assert travel(improved) < 0.9 * travel(nn)
+
+
+def test_order_line():
+    # the optimal order of points on a line is obvious
+    xs = [5, 1, 9, 3, 7, 2, 8, 4, 6]
+    ops = holes([(x, 0) for x in xs])
+    ordered = order(ops)
+    assert [op.entry.x for op in ordered] == sorted(xs)
+    assert travel(ordered) == pytest.approx(9)
+
+
+def test_order_exits():
+    # slots that enter at one end and exit at the other
+    ops = [
+        Operation(Vector(x, 0), lambda m: None, exit=Vector(x, 10))
+        for x in [0, 1, 2, 3]
+    ]
+    ordered = order(ops[::-1])
+    assert [op.entry.x for op in ordered] == [0, 1, 2, 3]
+
+
+def test_order_tools():
+    ops = holes([(0, 0), (10, 0)], tool=2) + holes([(1, 0), (11, 0)], tool=1)
+    ops += holes([(5, 5)])
+    ordered = order(ops, tool=1)
+    # operations without a tool are done with the tool that's already in
+    assert [op.tool for op in ordered] == [1, None, 1, 2, 2]
+    assert order(ops[:1]) == ops[:1]
+    assert order([]) == []
+
+
+def test_schedule(tmp_gcodefile, tmp_machine):
+    visited = []
+
+    def drill(m):
+        visited.append(m.position)
+        m.feedrate(100)
+        m.g1(z=-1)
+
+    ops = [
+        Operation(Vector(x, 0, 0.5), drill, tool=t, name=f"hole {x}")
+        for x, t in [(3, 1), (1, 2), (2, 1)]
+    ]
+    tmp_machine.toolchange(1)
+    schedule(tmp_machine, ops, clearance=5)
+    tmp_machine.close()
+    assert visited == [Vector(2, 0, 0.5), Vector(3, 0, 0.5), Vector(1, 0, 0.5)]
+    assert tmp_gcodefile.count_gcode("T1") == 1
+    assert tmp_gcodefile.count_gcode("T2") == 1
+    assert tmp_gcodefile.line_contains_word(-1, "Z5")
@@ -0,0 +1,82 @@
+import io
+import math
+import numpy as np
+import pytest
+from gmcode import Machine, Vector
+from gmcode.geom import Line, ArcXY
+from gmcode.simplify import simplify, simplify_points, _segment_distances
+from gmcode.toolpath import Toolpath, LINE, ARC
+
+
+def polyline_error(original, simple):
+    # largest distance from an original point to the simplified polyline
+    worst = 0.0
+    for p in original:
+        dists = [
+            _segment_distances(p[None, :], a, b)[0]
+            for a, b in zip(simple[:-1], simple[1:])
+        ]
+        worst = max(worst, min(dists))
+    return worst
+
+
+def test_simplify_points_collinear():
+    points = np.array([(x, 2 * x, -x) for x in np.linspace(0, 10, 101)])
+    simple = simplify_points(points, 1e-9)
+    assert np.array_equal(simple, points[[0, -1]])
+
+
+def test_simplify_points_tolerance():
+    t = np.linspace(0, math.pi, 2000)
+    points = np.stack([10 * np.cos(t), 10 * np.sin(t), np.zeros_like(t)], axis=1)
+    for tolerance in (0.1, 0.001):
+        simple = simplify_points(points, tolerance)
+        assert 2 < len(simple) < 200
+        assert np.array_equal(simple[[0, -1]], points[[0, -1]])
+        assert polyline_error(points[::7], simple) <= tolerance
+
+    assert len(simplify_points(points[:2], 1)) == 2
+    assert len(simplify_points(np.zeros((0, 3)), 1)) == 0
+
+
+def test_simplify_elements():
+    points = [Vector(x, 0.001 * (x % 2)) for x in range(6)]
+    lines = [Line(a, b) for a, b in zip(points[:-1], points[1:])]
+    arc = ArcXY(start=points[-1], end=Vector(7, 0), centre=Vector(6, 0))
+    paths = lines + [arc, Line(Vector(7, 0), Vector(8, 0))]
+
+    assert simplify(paths, 0.01) == [Line(points[0], points[-1]), arc, paths[-1]]
+    assert simplify(paths, 1e-4) == paths
+
+
+def test_simplify_toolpath():
+    points = np.array([(x, 0, 0) for x in range(5)], dtype=float)
+    tp = Toolpath.concatenate(
+        [
+            Toolpath.lines(points, feed=100),
+            Toolpath.arcs([(4, 0, 0)], [(6, 0, 0)], [(5, 0, 0)]),
+            Toolpath.lines(points + (6, 0, 0)),
+            Toolpath.lines(points + (10, 0, 0), feed=200),
+        ]
+    )
+    simple = simplify(tp, 1e-6)
+    assert list(simple.kind) == [LINE, ARC, LINE, LINE]
+    assert simple.end[0] == Vector(4, 0, 0)
+    assert simple.end[3] == Vector(14, 0, 0)
+    assert simple.feed[0] == 100
+    assert np.isnan(simple.feed[2])
+    assert simple.feed[3] == 200
+
+
+def test_machine_cut_simplify():
+    points = [Vector(x / 10, 0) for x in range(101)]
+    lines = [Line(a, b) for a, b in zip(points[:-1], points[1:])]
+    for paths in (lines, Toolpath.from_elements(lines, feed=100)):
+        text = io.StringIO()
+        with Machine(text) as m:
+            m.feedrate(100)
+            m.g0(0, 0, 0)
+            m.cut(paths, simplify=True)
+
+        assert text.getvalue().count("G1") == 1
+        assert m.position == Vector(10, 0)
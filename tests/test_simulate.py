@@ -0,0 +1,170 @@
+import io
+import math
+import numpy as np
+import pytest
+from gmcode import Machine, Vector, functions
+from gmcode.parser import Move, parse, RAPID, LINEAR, TOOLCHANGE
+from gmcode.simulate import Stock, Tool, simulate
+
+
+def slot(z=-1):
+    # a feed across a 20 x 20 block through the middle, then a rapid
+    # through it
+    return [
+        Move(RAPID, (-5, 10, 5), (-5, 10, z)),
+        Move(LINEAR, (-5, 10, z), (25, 10, z), feed=500),
+        Move(RAPID, (25, 10, z), (25, 3, z), line=3),
+        Move(RAPID, (25, 3, z), (10, 3, z), line=4),
+    ]
+
+
+def test_flat():
+    stock = Stock((0, 0, -10), (20, 20, 0), 0.1)
+    assert stock.heights.shape == (200, 200)
+    assert stock.volume == pytest.approx(4000)
+
+    result = simulate(slot(), stock, Tool(4))
+    # the slot, then a rapid from the edge to the middle 1 deep, which cuts
+    # another with a round end
+    volume = 20 * 4 + 10 * 4 + 2 * math.pi
+    assert result.removed == pytest.approx(volume, rel=0.01)
+    assert result.remaining == pytest.approx(stock.volume)
+    assert result.remaining + result.removed == pytest.approx(4000)
+    assert stock.heights[100, :].tolist() == [-1] * 200
+    assert stock.heights[120, :].tolist() == [0] * 200
+    assert stock.heights[80, 50] == -1 and stock.heights[79, 50] == 0
+
+    # the parts 3 or more outside the stock cut nothing
+    assert result.cutting_distance == pytest.approx(30)
+    assert result.air_distance == pytest.approx(8)
+    assert result.air_cut == pytest.approx(100 * 8 / 30)
+
+    assert len(result.collisions) == 1
+    (collision,) = result.collisions
+    assert collision.line == 4
+    # where the edge of the tool reaches the centres of the last cells
+    assert collision.position == pytest.approx((19.95 + math.sqrt(4 - 0.05**2), 3, -1))
+    assert collision.depth == pytest.approx(1)
+    assert "line 4" in str(result)
+
+    # a plunge hits the top of the stock
+    for tool in (Tool(4), Tool(4, ball=True)):
+        stock = Stock((0, 0, -10), (20, 20, 0), 0.1)
+        moves = [Move(RAPID, (5, 5, 5), (5, 5, -2), line=7)]
+        (collision,) = simulate(moves, stock, tool).collisions
+        # the ball is over the nearest cell centres a little above its bottom
+        assert collision.position == pytest.approx((5, 5, 0), abs=2e-3)
+        assert collision.depth == pytest.approx(2, abs=2e-3)
+
+
+def test_ball():
+    stock = Stock((0, 0, -10), (20, 20, 0), 0.05)
+    result = simulate(slot()[:2], stock, Tool(4, ball=True))
+    # a circle of radius 2, 1 below the top
+    section = 4 * math.acos(1 / 2) - math.sqrt(3)
+    assert result.removed == pytest.approx(20 * section, rel=0.01)
+    y = 10 - np.arange(-40, 40) * 0.05 - 0.025
+    expected = np.minimum(-1 + 2 - np.sqrt(np.maximum(4 - (y - 10) ** 2, 0)), 0)
+    assert stock.heights[160:240, 100] == pytest.approx(expected[::-1])
+
+    # going down a slope, compared with the ball at many points along it
+    stock = Stock((0, 0, -10), (20, 20, 0), 0.05)
+    moves = [Move(LINEAR, (5, 10, 0), (15, 10, -2), feed=100)]
+    simulate(moves, stock, Tool(4, ball=True))
+    x = np.arange(400) * 0.05 + 0.025
+    s = np.linspace(5, 15, 20001)[:, None]
+    d2 = (x - s) ** 2 + 0.025**2
+    ball = np.where(d2 <= 4, -(s - 5) / 5 + 2 - np.sqrt(np.maximum(4 - d2, 0)), 0)
+    expected = np.minimum(ball.min(axis=0), 0)
+    assert stock.heights[200, :] == pytest.approx(expected, abs=1e-3)
+
+
+def test_plunge_and_through():
+    stock = Stock((0, 0, -10), (20, 20, 0), 0.1)
+    moves = [
+        Move(RAPID, (10, 10, 5), (10, 10, 1)),
+        Move(LINEAR, (10, 10, 1), (10, 10, -20), feed=100),
+    ]
+    result = simulate(moves, stock, Tool(2))
+    # the bottom of the stock is as deep as it goes
+    assert result.removed == pytest.approx(math.pi * 10, rel=0.02)
+    assert stock.heights[100, 100] == -10
+    assert result.air_distance == 0 and not result.collisions
+
+
+def test_passes():
+    # only the first of two passes at the same depth cuts, a deeper one
+    # cuts again
+    stock = Stock((0, 0, -10), (20, 20, 0), 0.1)
+    moves = slot()[:2] + [
+        Move(LINEAR, (25, 10, -1), (-5, 10, -1), feed=500),
+        Move(LINEAR, (-5, 10, -1), (-5, 10, -2), feed=500),
+        Move(LINEAR, (-5, 10, -2), (25, 10, -2), feed=500),
+    ]
+    result = simulate(moves, stock, Tool(4))
+    assert result.removed == pytest.approx(20 * 4 * 2)
+    assert result.air_distance == pytest.approx(8 + 30 + 1 + 8)
+
+
+def pocket():
+    text = io.StringIO()
+    m = Machine(text)
+    m.std_init()
+    m.feedrate(500)
+    m.g0(33, 30, 2)
+    m.g0(z=0)
+    functions.helical_entry(m, Vector(30, 30), final_height=-2, doc=1)
+    functions.spiral(m, Vector(30, 30, -2), 20, doc=3)
+    m.g0(z=5)
+    m.g0(0, 0)
+    m.flush()
+    return text.getvalue().splitlines()
+
+
+def test_pocket(tmp_path):
+    stock = Stock((0, 0, -5), (60, 60, 0), 0.2)
+    result = simulate(parse(pocket()), stock, Tool(6))
+    # a circle of radius 20 + 3 two deep
+    assert result.removed == pytest.approx(math.pi * 23**2 * 2, rel=0.01)
+    assert not result.collisions
+    assert result.air_cut < 5
+
+    # tiles, chunks and threads don't change anything
+    path = tmp_path / "pocket.ngc"
+    path.write_text("\n".join(pocket()) + "\n")
+    other = Stock((0, 0, -5), (60, 60, 0), 0.2)
+    same = simulate(path, other, Tool(6), tile_size=7, workers=3, chunk_size=5)
+    assert np.array_equal(other.heights, stock.heights)
+    assert same.cutting_distance == pytest.approx(result.cutting_distance)
+    assert same.air_distance == pytest.approx(result.air_distance)
+
+
+def test_tools():
+    tools = {1: Tool(2), 2: Tool(6)}
+    moves = [
+        Move(TOOLCHANGE, (0, 0, 5), (0, 0, 5), value=1),
+        Move(LINEAR, (10, 5, 5), (10, 5, -1), feed=100),
+        Move(TOOLCHANGE, (10, 5, -1), (10, 5, -1), value=2),
+        Move(LINEAR, (10, 15, 5), (10, 15, -1), feed=100),
+    ]
+    stock = Stock((0, 0, -10), (20, 20, 0), 0.1)
+    result = simulate(moves, stock, tools)
+    assert result.removed == pytest.approx(math.pi * (1 + 9), rel=0.02)
+
+    with pytest.raises(ValueError):
+        simulate(moves[1:], stock, tools)
+    with pytest.raises(ValueError):
+        simulate(moves, stock, {1: Tool(2)})
+
+
+def test_stock():
+    with pytest.raises(ValueError):
+        Stock((0, 0, 0), (1, 1, 1), 0)
+    with pytest.raises(ValueError):
+        Stock((0, 0, 0), (1, 0, 1), 0.1)
+    with pytest.raises(ValueError):
+        Stock((0, 0), (1, 1), 0.1)
+    # rounded up to whole cells
+    assert Stock((0, 0, 0), (1.05, 1, 1), 0.1).heights.shape == (10, 11)
+    result = simulate([], Stock((0, 0, 0), (1, 1, 1), 0.1), Tool(1))
+    assert result.removed == 0 and result.air_cut == 0
@@ -0,0 +1,127 @@
+import io
+import math
+import numpy as np
+import pytest
+from gmcode import Machine, MachineError, Vector
+from gmcode.geom import Line, ArcXY
+from gmcode.toolpath import Toolpath, LINE, ARC
+
+
+def square(size=10.0, z=0.0):
+    points = [(0, 0, z), (size, 0, z), (size, size, z), (0, size, z), (0, 0, z)]
+    return np.array(points, dtype=float)
+
+
+def elements():
+    return [
+        Line(Vector(0, 0, 0), Vector(2, 0, 0)),
+        ArcXY(start=Vector(2, 0, 0), end=Vector(4, 0, 0), centre=Vector(3, 0, 0)),
+        Line(Vector(4, 0, 0), Vector(4, 1, -1)),
+        ArcXY(
+            start=Vector(4, 1, -1),
+            end=Vector(4, 3, -1),
+            centre=Vector(4, 2, -1),
+            cw=False,
+        ),
+    ]
+
+
+def output(func, **kwargs):
+    text = io.StringIO()
+    m = Machine(text, **kwargs)
+    func(m)
+    m.close()
+    return text.getvalue()
+
+
+def test_lines():
+    tp = Toolpath.lines(square(), feed=100)
+    assert len(tp) == 4
+    assert np.all(tp.kind == LINE)
+    assert np.all(tp.feed == 100)
+    assert tp[1] == Line(Vector(10, 0, 0), Vector(10, 10, 0))
+    assert len(tp.gaps(Vector())) == 0
+    assert list(tp.gaps(Vector(1, 1, 1))) == [0]
+
+
+def test_elements_round_trip():
+    tp = Toolpath.from_elements(elements())
+    assert list(tp.kind) == [LINE, ARC, LINE, ARC]
+    assert tp.to_elements() == elements()
+    assert list(tp[1:3]) == elements()[1:3]
+    both = tp + tp[:2]
+    assert len(both) == 6
+    assert list(both.gaps()) == [4]
+    assert len(Toolpath.concatenate([])) == 0
+    with pytest.raises(ValueError):
+        Toolpath(kind=[LINE], start=[(0, 0, 0)], end=[], centre=[], cw=[], feed=[])
+
+
+@pytest.mark.parametrize("accuracy", [1e-4, 1e-1])
+def test_cut_matches_elements(accuracy):
+    def start(m):
+        m.feedrate(200)
+        m.g0(0, 0, 0)
+
+    def slow(m):
+        start(m)
+        m.cut(elements())
+        m.g1(1, 1, 1)
+
+    def fast(m):
+        start(m)
+        m.cut(Toolpath.from_elements(elements()))
+        m.g1(1, 1, 1)
+
+    assert output(fast, accuracy=accuracy) == output(slow, accuracy=accuracy)
+
+
+def test_cut_uninitialised_and_feeds():
+    points = square()
+    feeds = np.array([100, np.nan, 300, 300])
+
+    def slow(m):
+        for p, f in zip(points[1:], feeds):
+            if not math.isnan(f):
+                m.feedrate(f)
+            m.g1(*p)
+
+    def fast(m):
+        m.cut(Toolpath.lines(points, feed=feeds))
+
+    out = output(fast)
+    assert out == output(slow)
+    assert out.splitlines()[:2] == ["F100.0000", "G1 X10.0000 Y0.0000 Z0.0000"]
+
+
+def test_cut_creeping_moves():
+    # Each step is below accuracy, so axis words only appear once the total
+    # movement adds up to more than accuracy
+    x = np.concatenate([[0], np.cumsum(np.full(49, 0.4e-4))])
+    points = np.column_stack([x, np.zeros(50), np.zeros(50)])
+
+    def slow(m):
+        m.g0(0, 0, 0)
+        for p in points[1:]:
+            m.g1(*p)
+
+    def fast(m):
+        m.g0(0, 0, 0)
+        m.cut(Toolpath.lines(points))
+
+    out = output(fast)
+    assert out == output(slow)
+    assert out.count("G1") > 1
+
+
+def test_cut_gap(tmp_machine):
+    tmp_machine.g0(0, 0, 0)
+    tp = Toolpath.lines(square()[[0, 1, 2]]) + Toolpath.lines(square()[[3, 4]])
+    with pytest.raises(MachineError):
+        tmp_machine.cut(tp)
+
+    with pytest.raises(MachineError):
+        tmp_machine.cut(Toolpath.lines(square() + 1))
+
+    tmp_machine.cut(Toolpath.lines(square()))
+    assert tmp_machine.position == Vector()
@@ -148,3 +148,13 @@ def test_vector_tolerance():
     v3 = Vector(1000, -1000, 1000)
     assert v3 == v3 + v1
     assert v3 != v3 + v2
+
+
+def test_vector_isclose():
+    vec0 = Vector(1, 2, 3)
+    assert vec0.isclose(Vector(1.0, 2.0, 3.0))
+    assert vec0.isclose(vec0 + Vector(TOLERANCE / 2, 0, 0))
+    assert not vec0.isclose(vec0 + Vector(0, 0, TOLERANCE * 2))
+    assert Vector().isclose(Vector(0, 0, TOLERANCE / 2))
+    assert vec0.isclose(Vector(1.1, 2, 3), tolerance=0.2)
+    assert not vec0.isclose(Vector(1.1, 2, 3.2), tolerance=0.2)
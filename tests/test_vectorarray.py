@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from gmcode.geom import Vector, VectorArray
+
+VECTORS = [Vector(1, 2, 3), Vector(-4, 5, 0.5), Vector(0, 0, 1)]
+
+
+@pytest.fixture
+def va():
+    return VectorArray.from_vectors(VECTORS)
+
+
+def test_conversion(va):
+    assert va.data.shape == (3, 3)
+    assert va.data.flags["C_CONTIGUOUS"]
+    assert va.data.dtype == np.float64
+    assert va.to_vectors() == VECTORS
+    assert list(va) == VECTORS
+    assert va[1] == VECTORS[1]
+    assert isinstance(va[1:], VectorArray)
+    assert len(va[1:]) == 2
+    assert len(VectorArray([])) == 0
+    with pytest.raises(ValueError):
+        VectorArray([[1, 2]])
+
+
+def test_add_sub(va):
+    other = VectorArray.from_vectors(VECTORS[::-1])
+    for res, a, b in zip(va + other, VECTORS, VECTORS[::-1]):
+        assert res == a + b
+
+    for res, a, b in zip(va - other, VECTORS, VECTORS[::-1]):
+        assert res == a - b
+
+    offset = Vector(1, 1, 1)
+    assert list(va + offset) == [v + offset for v in VECTORS]
+    assert list(va - offset) == [v - offset for v in VECTORS]
+    assert list(-va) == [-v for v in VECTORS]
+
+
+def test_scale(va):
+    assert list(va * 2) == [v * 2 for v in VECTORS]
+    assert list(2 * va) == [v * 2 for v in VECTORS]
+    assert list(va / 4) == [v / 4 for v in VECTORS]
+    scales = np.array([1, 2, 3])
+    assert list(va * scales) == [v * s for v, s in zip(VECTORS, scales)]
+
+
+def test_products(va):
+    other = VectorArray.from_vectors(VECTORS[::-1])
+    assert list(va.cross(other)) == [a.cross(b) for a, b in zip(VECTORS, VECTORS[::-1])]
+    assert va.dot(other) == pytest.approx(
+        [a.dot(b) for a, b in zip(VECTORS, VECTORS[::-1])]
+    )
+    assert va.dot(Vector(0, 0, 1)) == pytest.approx([v.z for v in VECTORS])
+
+
+def test_norm_unit(va):
+    assert abs(va) == pytest.approx([abs(v) for v in VECTORS])
+    assert va.norm() == pytest.approx([abs(v) for v in VECTORS])
+    assert list(va.unit_vector()) == [v.unit_vector() for v in VECTORS]
+    with pytest.raises(ValueError):
+        VectorArray([[0, 0, 0]]).unit_vector()
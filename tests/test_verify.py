@@ -0,0 +1,110 @@
+import pytest
+from gmcode import Machine, Vector, functions
+from gmcode.parser import Parser
+from gmcode.verify import compare
+
+
+def program(path, strip_zeros=False, radius=5.0, comment="spiral", extra=False):
+    with Machine(path, strip_zeros=strip_zeros) as m:
+        m.std_init()
+        m.feedrate(300)
+        m.g0(1, 0, 5)
+        m.g1(z=-1)
+        m.comment(comment)
+        functions.spiral(m, Vector(0, 0, -1), radius, doc=0.5)
+        m.g1(10, 10)
+        functions.helical_entry(m, Vector(10, 5), final_height=-3)
+        m.dwell(0.5)
+        if extra:
+            m.g1(0, 0)
+        m.std_close()
+    return path
+
+
+def test_compare_identical(tmp_path):
+    a = program(tmp_path / "a.ngc")
+    b = program(tmp_path / "b.ngc")
+    result = compare(a, b)
+    assert result.matches
+    assert result.moves == 0
+    assert result.common_bytes == a.stat().st_size
+    assert "match" in str(result)
+
+
+def test_compare_formatting(tmp_path):
+    # the numbers and comments are written differently, the moves are the same
+    a = program(tmp_path / "a.ngc")
+    b = program(tmp_path / "b.ngc", strip_zeros=True, comment="other")
+    assert a.read_text() != b.read_text()
+    result = compare(a, b)
+    assert result.matches
+    assert result.moves > 10
+    assert compare(b, a).matches
+
+
+def test_compare_differences(tmp_path):
+    a = program(tmp_path / "a.ngc")
+    b = program(tmp_path / "b.ngc", radius=5.01)
+    result = compare(a, b)
+    assert not result.matches
+    first = result.differences[0]
+    assert first.reason == "end"
+    moves = list(Parser().parse(a.read_text().splitlines()))
+    assert moves[first.index] == first.a
+    assert first.a.line == first.b.line
+    assert "end differs" in str(result)
+
+    # within tolerance
+    assert compare(a, b, tolerance=0.02).matches
+    assert len(compare(a, b, limit=1).differences) == 1
+
+    c = program(tmp_path / "c.ngc", extra=True)
+    result = compare(a, c)
+    # the extra move, then the end of the program is somewhere else
+    assert [d.reason for d in result.differences] == ["missing", "end"]
+    assert result.differences[0].a is None
+    assert result.differences[0].b.end == (0, 0, -3)
+
+
+def test_compare_common_end(tmp_path):
+    # one line is written differently, the rest is skipped
+    a = program(tmp_path / "a.ngc")
+    lines = a.read_text().splitlines(keepends=True)
+    idx = lines.index("G1 Z-1.0000\n")
+    lines[idx] = "G1 Z-1\n"
+    b = tmp_path / "b.ngc"
+    b.write_text("".join(lines))
+
+    result = compare(a, b)
+    assert result.matches
+    assert result.moves == 1
+    assert result.common_bytes == a.stat().st_size - len("G1 Z-1.0000\n")
+
+    # a change that moves the end of it is found there
+    lines[idx] = "G1 Z-2\n"
+    b.write_text("".join(lines))
+    result = compare(a, b, limit=1000)
+    assert result.differences[0].reason == "end"
+    assert result.moves > 1
+
+
+def test_compare_empty(tmp_path):
+    a = tmp_path / "a.ngc"
+    a.write_text("")
+    b = program(tmp_path / "b.ngc")
+    assert compare(a, a).matches
+    result = compare(a, b)
+    assert result.differences[0].reason == "missing"
+    assert result.differences[0].a is None
+
+
+def test_parser_copy():
+    parser = Parser()
+    parser.parse_line("G1 X1 F100")
+    parser.parse_line("o<hole> sub")
+    other = parser.copy()
+    parser.parse_line("G1 X2")
+    parser.parse_line("o<hole> endsub")
+    assert other.state.position == [1, 0, 0]
+    assert other.subroutines == {"hole": []}
+    assert other._defining == "hole"